@@ -0,0 +1,124 @@
+import sys
+import csv
+import json
+import argparse
+from multiprocessing import Pool, cpu_count
+
+sys.path.insert(1, './model')
+
+from model import Model
+from graph_cache import graph_cache
+from routing_graph import RoutingGraph
+from spatial_index import SpatialIndex
+
+# Points further than this from every node of the map, in meters, are reported as errors instead of snapped
+MAX_SNAP_DISTANCE = 1000
+
+# Set in each worker process by init_worker
+worker_graph = None
+worker_model = None
+
+
+def init_worker(travel_type):
+    """
+    Gets the graph for the worker process. Workers started by fork inherit the graph already loaded by
+    the parent from the graph cache, so it is shared instead of loaded again
+    :param travel_type: ('driving', 'walking' or 'biking') The routing option
+    """
+    global worker_graph, worker_model
+    worker_graph = graph_cache.get(travel_type)
+    worker_model = Model()
+
+
+def route_pair(task):
+    """
+    Finds the route for one origin/destination pair in a worker process
+    :param task: (tuple) The start node, end node, mode, extra travel percentage and algorithm
+    :return: a dictionary with the route, its statistics and the solver time, or an error message. Errors other
+             than bad input or a missing path are prefixed with their type
+    """
+    (start, end, mode, extra_travel, algorithm) = task
+    try:
+        result = worker_model.compute_route(worker_graph, start, end, extra_travel, mode, algorithm)
+    except (ValueError, KeyError) as e:
+        return {"route": None, "error": str(e)}
+    except Exception as e:
+        # Anything else is reported for this pair alone, so the results of the other pairs are kept
+        return {"route": None, "error": "{}: {}".format(type(e).__name__, e)}
+    return {
+        "route": result["route"],
+        "length": result["length"],
+        "elevation_stats": result["elevation_stats"],
+        "shortest_length": result["shortest_length"],
+        "shortest_elevation_stats": result["shortest_elevation_stats"],
+        "solver_time": result["solver_time"],
+        "nodes_settled": result["nodes_settled"],
+        "error": None
+    }
+
+
+def route_many(pairs, mode, extra_travel, travel_type, processes=None, algorithm='dijkstra', chunksize=8):
+    """
+    Finds routes for many origin/destination pairs, using a pool of worker processes that share one loaded graph
+    :param pairs: (list) The ((start latitude, start longitude), (end latitude, end longitude)) pairs
+    :param mode: ('maximize' or 'mimimize') Specifies if the routes should maximize or minimize elevation
+    :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel
+    :param travel_type: ('driving', 'walking' or 'biking') The routing option
+    :param processes: (int) The number of worker processes, one per core by default
+    :param algorithm: ('dijkstra', 'astar' or 'bidirectional') Specifies how the minimize search finds its bounds
+                      (see Model.min_ele)
+    :param chunksize: (int) The number of pairs handed to a worker at a time
+    :return: a list with a dictionary for each pair, in the same order, holding the snapped start and end nodes,
+             the route, its length and elevation statistics, those of the shortest path, the solver time in
+             seconds, and an error message (None when the route was found)
+    """
+    # Load the graph and build everything derived from it before the workers start, so they can share it
+    G = graph_cache.get(travel_type)
+    rg = RoutingGraph.of(G)
+    rg.reverse()
+    index = SpatialIndex.of(rg)
+
+    starts = index.nearest_nodes([p[0][0] for p in pairs], [p[0][1] for p in pairs], MAX_SNAP_DISTANCE)
+    ends = index.nearest_nodes([p[1][0] for p in pairs], [p[1][1] for p in pairs], MAX_SNAP_DISTANCE)
+
+    tasks = []
+    for start, end in zip(starts, ends):
+        if start is not None and end is not None:
+            tasks.append((start, end, mode, extra_travel, algorithm))
+
+    with Pool(processes or cpu_count(), initializer=init_worker, initargs=(travel_type,)) as pool:
+        routed = iter(pool.map(route_pair, tasks, chunksize))
+
+    results = []
+    for start, end in zip(starts, ends):
+        if start is None or end is None:
+            result = {"route": None, "error": "Geocoordinate is not within the map"}
+        else:
+            result = next(routed)
+        result["start"] = start
+        result["end"] = end
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find routes for origin/destination pairs read from a CSV file "
+                                                 "with start_lat, start_long, end_lat and end_long columns")
+    parser.add_argument("pairs_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--mode", default="minimize", choices=["minimize", "maximize"])
+    parser.add_argument("--extra-travel", type=float, default=25)
+    parser.add_argument("--travel-type", default="walking", choices=["driving", "walking", "biking"])
+    parser.add_argument("--algorithm", default="dijkstra", choices=["dijkstra", "astar", "bidirectional"])
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.pairs_file) as infile:
+        pairs = [((float(row["start_lat"]), float(row["start_long"])), (float(row["end_lat"]), float(row["end_long"])))
+                 for row in csv.DictReader(infile)]
+
+    results = route_many(pairs, args.mode, args.extra_travel, args.travel_type, args.processes, args.algorithm)
+
+    with open(args.output_file, 'w') as outfile:
+        json.dump(results, outfile)
+    print("Routed", sum(1 for r in results if r["error"] is None), "of", len(results), "pairs")
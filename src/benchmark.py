@@ -0,0 +1,483 @@
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(1, './model')
+sys.path.insert(1, './view')
+
+from model import Model
+from graph_cache import graph_cache, GRAPH_FILES
+from routing_graph import RoutingGraph
+from route_metrics import routes_metrics
+from synthetic_graph import synthetic_routing_graph, GRAPH_KINDS
+from percentiles import percentile
+from query_trace import new_search_stats
+from view import View
+
+# The minimize search is run both ways, so the bidirectional search is measured against the unidirectional one
+ALGORITHMS = ["shortest", "minimize", "minimize_bidirectional", "maximize"]
+# Settings of a report that must match the baseline's for the two to route the same queries
+CORPUS_SETTINGS = ["kind", "size", "seed", "extra_travel"]
+# Aggregates compared against the baseline, and whether a higher value is a regression
+REGRESSION_METRICS = {
+    "latency_p50_ms": True,
+    "latency_p95_ms": True,
+    "latency_p99_ms": True,
+    "nodes_settled_mean": True,
+    "peak_memory_bytes": True,
+    "failures": True
+}
+
+
+def list_step(rg, node, curr_path, curr_path_lengths, bad_nodes, dist_to_goal, can_travel):
+    """
+    One step of the maximize search as it was written with Python lists: every neighbor is looked up in the
+    path and in the dead nodes by a linear scan, and backtracking copies the path
+    :return: the number of valid neighbors found
+    """
+    valid = 0
+    for nbr, length in rg.edges(node):
+        if (nbr not in curr_path) and (nbr not in bad_nodes):
+            if curr_path_lengths[-1] + length + dist_to_goal[nbr] <= can_travel:
+                valid += 1
+    # Backtrack and step forward again, so the path keeps its length across steps
+    curr_path = curr_path[:-1]
+    curr_path_lengths = curr_path_lengths[:-1]
+    curr_path.append(node)
+    curr_path_lengths.append(0)
+    return valid
+
+
+def flag_step(rg, node, curr_path, curr_path_lengths, on_path, bad_nodes, dist_to_goal, can_travel):
+    """
+    One step of the maximize search as Model.max_ele takes it: membership is checked on flags indexed by
+    compact id, and backtracking pops the path stack in place
+    :return: the number of valid neighbors found
+    """
+    valid = 0
+    for nbr, length in rg.edges(node):
+        if on_path[nbr] or bad_nodes[nbr]:
+            continue
+        if curr_path_lengths[-1] + length + dist_to_goal[nbr] <= can_travel:
+            valid += 1
+    on_path[curr_path.pop()] = 0
+    curr_path_lengths.pop()
+    curr_path.append(node)
+    curr_path_lengths.append(0)
+    on_path[node] = 1
+    return valid
+
+
+def max_ele_step_cost(G, path_lengths=(10, 100, 1000, 10000), steps=2000, seed=0):
+    """
+    Measures how the cost of one step of the maximize search grows with the length of the current path,
+    with the list-based structures it used to have and the flags and stack it has now. The path and the
+    dead nodes are drawn at random, as many dead nodes as nodes on the path
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param path_lengths: (list) The path lengths, in nodes, to measure at
+    :param steps: (int) The number of steps timed at each path length
+    :param seed: (int) The seed of the random paths
+    :return: a list of dictionaries with the path length and the mean cost of a step before and after, in
+             microseconds
+    """
+    rg = RoutingGraph.of(G)
+    n = rg.number_of_nodes()
+    rand = random.Random(seed)
+    dist_to_goal = [0.0] * n
+    can_travel = float('inf')
+    results = []
+    for path_length in path_lengths:
+        path_length = min(path_length, n // 2)
+        sample = rand.sample(range(n), 2 * path_length)
+        (path, dead) = (sample[:path_length], sample[path_length:])
+        nodes = [rand.randrange(n) for _ in range(steps)]
+
+        curr_path = list(path)
+        curr_path_lengths = [0] * path_length
+        t = time.perf_counter()
+        for node in nodes:
+            list_step(rg, node, curr_path, curr_path_lengths, dead, dist_to_goal, can_travel)
+        before = time.perf_counter() - t
+
+        curr_path = list(path)
+        curr_path_lengths = [0] * path_length
+        on_path = bytearray(n)
+        bad_nodes = bytearray(n)
+        for node in path:
+            on_path[node] = 1
+        for node in dead:
+            bad_nodes[node] = 1
+        t = time.perf_counter()
+        for node in nodes:
+            flag_step(rg, node, curr_path, curr_path_lengths, on_path, bad_nodes, dist_to_goal, can_travel)
+        after = time.perf_counter() - t
+
+        results.append({
+            "path_length": path_length,
+            "before_us": before / steps * 1e6,
+            "after_us": after / steps * 1e6
+        })
+    return results
+
+
+def random_walk(rg, steps, rand):
+    """
+    :return: a walk along the edges of a graph with the given number of nodes, as a list of OSM ids
+    """
+    walk = [rand.randrange(rg.number_of_nodes())]
+    while len(walk) < steps:
+        neighbors = rg.neighbors(walk[-1])
+        walk.append(rand.choice(neighbors) if len(neighbors) else rand.randrange(rg.number_of_nodes()))
+    return rg.to_osm(walk)
+
+
+def legacy_render(G, route, alt_routes, filepath):
+    """
+    Draws routes the way View.show_route used to, with a plot_route_folium call for every line drawn
+    """
+    import osmnx as ox
+    route_map = ox.plot_route_folium(G, route, None, route_opacity=0.75, route_color="#42aaf5", tiles='Stamen Terrain')
+    for alt in alt_routes:
+        ox.plot_route_folium(G, alt, route_map, route_opacity=0.75, route_color="#eb4034", tiles='Stamen Terrain')
+    ox.plot_route_folium(G, route, route_map, route_opacity=0.75, route_color="#42aaf5", tiles='Stamen Terrain')
+    route_map.save(filepath)
+
+
+def render_cost(G, route_lengths=(10, 100, 1000, 10000), repeats=3, seed=0):
+    """
+    Measures how long drawing a route and the shortest path on a map and saving the page takes, and how long
+    writing them as GeoJSON takes, against the number of nodes of the routes. Random walks stand in for
+    routes. For networkx graphs with OSMnx installed, the way routes used to be drawn is timed too
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param route_lengths: (list) The route lengths, in nodes, to measure at
+    :param repeats: (int) The number of times each is timed, keeping the fastest
+    :param seed: (int) The seed of the random walks
+    :return: a list of dictionaries with the route length and the time taken by each renderer in milliseconds,
+             None for the old one when it could not be timed
+    """
+    rg = RoutingGraph.of(G)
+    rand = random.Random(seed)
+    view = View()
+    try:
+        import osmnx
+        legacy = not isinstance(G, RoutingGraph)
+    except ImportError:
+        legacy = False
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = directory + "/route.html"
+        for route_length in route_lengths:
+            (route, shortest_path) = (random_walk(rg, route_length, rand), random_walk(rg, route_length, rand))
+            (metrics, shortest_metrics) = routes_metrics(rg, [route, shortest_path])
+            args = (rg, route, Model().elevation_stats_of(metrics), Model().elevation_stats_of(shortest_metrics),
+                    metrics["length"], shortest_metrics["length"], [shortest_path])
+            times = {"html": float('inf'), "geojson": float('inf'), "legacy_html": float('inf') if legacy else None}
+            for _ in range(repeats):
+                t = time.perf_counter()
+                view.get_map(*args).save(filepath)
+                times["html"] = min(times["html"], time.perf_counter() - t)
+
+                t = time.perf_counter()
+                json.dumps(view.get_geojson(*args))
+                times["geojson"] = min(times["geojson"], time.perf_counter() - t)
+
+                if legacy:
+                    t = time.perf_counter()
+                    legacy_render(G, route, [shortest_path], filepath)
+                    times["legacy_html"] = min(times["legacy_html"], time.perf_counter() - t)
+
+            result = {"route_length": route_length}
+            for key, value in times.items():
+                result[key + "_ms"] = value * 1000 if value is not None else None
+            results.append(result)
+    return results
+
+
+def build_corpus(G, size=50, seed=0, min_length=500, max_length=5000, max_tries=None):
+    """
+    Draws a reproducible set of origin/destination pairs whose shortest path length is within a range
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param size: (int) The number of pairs
+    :param seed: (int) The seed of the random draws
+    :param min_length: (number) The shortest allowed shortest path length in meters
+    :param max_length: (number) The longest allowed shortest path length in meters
+    :param max_tries: (int) The number of pairs drawn before giving up, 20 per pair by default
+    :return: a list of dictionaries with the origin and destination nodes and their shortest path length
+    """
+    rg = RoutingGraph.of(G)
+    rand = random.Random(seed)
+    corpus = []
+    for _ in range(max_tries or 20 * size):
+        if len(corpus) == size:
+            break
+        (start, end) = (rand.randrange(rg.number_of_nodes()), rand.randrange(rg.number_of_nodes()))
+        length = float(rg.dijkstra(start, end)[0][end])
+        if min_length <= length <= max_length:
+            corpus.append({"start": int(rg.osm_ids[start]), "end": int(rg.osm_ids[end]), "shortest_length": length})
+    return corpus
+
+
+def run_query(model, G, algorithm, start, end, can_travel):
+    """
+    :return: the route found by one of the benchmarked algorithms
+    """
+    if algorithm == "shortest":
+        return model.get_shortest_path(G, start, end)
+    if algorithm == "minimize_bidirectional":
+        return model.min_ele(G, start, end, can_travel, 'bidirectional')
+    return model.get_op_route(G, start, end, can_travel, algorithm)
+
+
+def run_corpus(G, corpus, extra_travel=25, algorithms=ALGORITHMS, memory=True):
+    """
+    Routes every pair of a corpus with each algorithm, timing the searches and measuring the routes found
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param corpus: (list) The pairs to route (see build_corpus)
+    :param extra_travel: (number) The percentage over the shortest path length that routes may travel
+    :param algorithms: (list) The algorithms to run, among 'shortest', 'minimize', 'minimize_bidirectional' and
+                       'maximize'
+    :param memory: (bool) Also runs each search again under tracemalloc to find its peak memory, which is
+                   kept out of the timed run as tracing slows allocations down
+    :return: a dictionary with a list of per-query results for each algorithm
+    """
+    model = Model()
+    runs = {algorithm: [] for algorithm in algorithms}
+    for pair in corpus:
+        can_travel = (100.0 + extra_travel) * pair["shortest_length"] / 100.0
+        for algorithm in algorithms:
+            model.search_stats = new_search_stats()
+            t = time.perf_counter()
+            try:
+                route = run_query(model, G, algorithm, pair["start"], pair["end"], can_travel)
+            except Exception as e:
+                runs[algorithm].append({"error": "{}: {}".format(type(e).__name__, e)})
+                continue
+            latency = time.perf_counter() - t
+            search_stats = dict(model.search_stats)
+
+            peak_memory = None
+            if memory:
+                tracemalloc.start()
+                run_query(model, G, algorithm, pair["start"], pair["end"], can_travel)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            metrics = routes_metrics(G, [route])[0]
+            runs[algorithm].append({
+                "latency": latency,
+                "nodes_settled": search_stats["nodes_settled"],
+                "nodes_pushed": search_stats["nodes_pushed"],
+                "heap_peak": search_stats["heap_peak"],
+                "peak_memory": peak_memory,
+                "length_ratio": metrics["length"] / pair["shortest_length"],
+                "elevation_gain": metrics["ascents"],
+                "feasible": metrics["length"] <= can_travel + 1e-3
+            })
+    return runs
+
+
+def summarize(runs):
+    """
+    :param runs: (list) The per-query results of an algorithm (see run_corpus)
+    :return: a dictionary with the latency percentiles in milliseconds, the mean nodes settled and pushed, the
+             largest priority queue and peak memory, the mean length ratio to the shortest path and elevation gain, and the counts of
+             failed and infeasible queries
+    """
+    done = [r for r in runs if "error" not in r]
+    latencies = sorted(r["latency"] * 1000 for r in done)
+    memories = [r["peak_memory"] for r in done if r["peak_memory"] is not None]
+
+    def mean(key):
+        return sum(r[key] for r in done) / len(done) if done else None
+
+    return {
+        "queries": len(runs),
+        "failures": len(runs) - len(done),
+        "infeasible": sum(1 for r in done if not r["feasible"]),
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p95_ms": percentile(latencies, 95),
+        "latency_p99_ms": percentile(latencies, 99),
+        "nodes_settled_mean": mean("nodes_settled"),
+        "nodes_pushed_mean": mean("nodes_pushed"),
+        "heap_peak_max": max(r["heap_peak"] for r in done) if done else None,
+        "peak_memory_bytes": max(memories) if memories else None,
+        "length_ratio_mean": mean("length_ratio"),
+        "elevation_gain_mean": mean("elevation_gain")
+    }
+
+
+def run_suite(travel_types=None, size=50, seed=0, extra_travel=25, memory=True):
+    """
+    Benchmarks the algorithms on a seeded corpus for each travel type
+    :param travel_types: (list) The travel types to benchmark, all of them by default
+    :param size: (int) The number of pairs per travel type
+    :param seed: (int) The seed of the corpora
+    :param extra_travel: (number) The percentage over the shortest path length that routes may travel
+    :param memory: (bool) Measures the peak memory of each search (see run_corpus)
+    :return: a dictionary with the settings and, for each travel type, its corpus and a summary per algorithm
+    """
+    report = {"size": size, "seed": seed, "extra_travel": extra_travel, "graphs": {}}
+    for travel_type in travel_types or GRAPH_FILES:
+        G = graph_cache.get(travel_type)
+        corpus = build_corpus(G, size, seed)
+        runs = run_corpus(G, corpus, extra_travel, memory=memory)
+        report["graphs"][travel_type] = {
+            "corpus": corpus,
+            "results": {algorithm: summarize(r) for algorithm, r in runs.items()}
+        }
+    return report
+
+
+def run_scaling(sizes=(1000, 10000, 100000, 1000000), kind='street', size=10, seed=0, extra_travel=25,
+                memory=False):
+    """
+    Benchmarks the algorithms on synthetic maps of growing size, to see how each of them scales
+    :param sizes: (list) The approximate numbers of nodes of the maps
+    :param kind: ('grid', 'geometric' or 'street') The layout of the maps (see synthetic_graph)
+    :param size: (int) The number of pairs per map
+    :param seed: (int) The seed of the maps and corpora
+    :param extra_travel: (number) The percentage over the shortest path length that routes may travel
+    :param memory: (bool) Measures the peak memory of each search (see run_corpus)
+    :return: a dictionary with the settings and, for each map size, its corpus and a summary per algorithm
+    """
+    report = {"kind": kind, "size": size, "seed": seed, "extra_travel": extra_travel, "graphs": {}}
+    for nodes in sizes:
+        rg = synthetic_routing_graph(nodes, kind, seed)
+        corpus = build_corpus(rg, size, seed)
+        runs = run_corpus(rg, corpus, extra_travel, memory=memory)
+        report["graphs"][str(nodes)] = {
+            "nodes": rg.number_of_nodes(),
+            "edges": rg.number_of_edges(),
+            "corpus": corpus,
+            "results": {algorithm: summarize(r) for algorithm, r in runs.items()}
+        }
+    return report
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Finds the regressions of a benchmark report against a baseline report. The aggregates are only comparable
+    when both reports routed the same pairs, so the settings and corpora must match
+    :param report: (dictionary) The report (see run_suite)
+    :param baseline: (dictionary) The report to compare against
+    :param tolerance: (number) The relative change allowed before a metric counts as a regression
+    :return: a list of messages, one per regression
+    """
+    changed = [key for key in CORPUS_SETTINGS if report.get(key) != baseline.get(key)]
+    if changed:
+        raise ValueError("The baseline was run with other settings: " + ", ".join(
+            "{} {} against {}".format(key, report.get(key), baseline.get(key)) for key in changed))
+
+    regressions = []
+    for travel_type, graph in report["graphs"].items():
+        base_graph = baseline.get("graphs", {}).get(travel_type)
+        if base_graph is None:
+            continue
+        pairs = [(pair["start"], pair["end"]) for pair in graph["corpus"]]
+        if pairs != [(pair["start"], pair["end"]) for pair in base_graph["corpus"]]:
+            raise ValueError("The {} corpus differs from the baseline's ({} pairs against {})".format(
+                travel_type, len(pairs), len(base_graph["corpus"])))
+        for algorithm, results in graph["results"].items():
+            base = base_graph["results"].get(algorithm)
+            if base is None:
+                continue
+            checks = dict(REGRESSION_METRICS)
+            # Route quality regresses when the minimized gain rises or the maximized gain falls
+            if algorithm in ("minimize", "minimize_bidirectional", "maximize"):
+                checks["elevation_gain_mean"] = algorithm != "maximize"
+            for metric, higher_is_worse in checks.items():
+                (value, old) = (results.get(metric), base.get(metric))
+                if value is None or old is None:
+                    continue
+                limit = abs(old) * tolerance
+                if (value > old + limit) if higher_is_worse else (value < old - limit):
+                    regressions.append("{} {} {}: {:.4g} against {:.4g}".format(
+                        travel_type, algorithm, metric, value, old))
+    return regressions
+
+
+def print_step_cost(args):
+    G = graph_cache.get(args.travel_type)
+    print("%12s %12s %12s" % ("path length", "before (us)", "after (us)"))
+    for row in max_ele_step_cost(G, steps=args.steps):
+        print("%12d %12.2f %12.2f" % (row["path_length"], row["before_us"], row["after_us"]))
+
+
+def print_render_cost(args):
+    G = graph_cache.get(args.travel_type)
+    print("%12s %12s %12s %12s" % ("route nodes", "html (ms)", "geojson (ms)", "before (ms)"))
+    for row in render_cost(G, repeats=args.repeats):
+        print("%12d %12.1f %12.1f %12s" % (row["route_length"], row["html_ms"], row["geojson_ms"],
+                                            "-" if row["legacy_html_ms"] is None else "%.1f" % row["legacy_html_ms"]))
+
+
+def print_suite(args):
+    if args.command == "scaling":
+        report = run_scaling(args.sizes, args.kind, args.size, args.seed, args.extra_travel, args.memory)
+    else:
+        report = run_suite(args.travel_types, args.size, args.seed, args.extra_travel, not args.no_memory)
+    with open(args.output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    for travel_type, graph in report["graphs"].items():
+        for algorithm, results in graph["results"].items():
+            print("{:8} {:22} p50 {:8.1f} ms  p95 {:8.1f} ms  p99 {:8.1f} ms  {:,.0f} nodes settled".format(
+                travel_type, algorithm, results["latency_p50_ms"] or 0, results["latency_p95_ms"] or 0,
+                results["latency_p99_ms"] or 0, results["nodes_settled_mean"] or 0))
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+        try:
+            regressions = compare(report, baseline, args.tolerance)
+        except ValueError as e:
+            sys.exit("Cannot compare against {}: {}".format(args.baseline, e))
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the routing engine")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    steps = subparsers.add_parser("steps", help="time a step of the maximize search against the path length")
+    steps.add_argument("--travel-type", default="walking", choices=list(GRAPH_FILES))
+    steps.add_argument("--steps", type=int, default=2000)
+    steps.set_defaults(run=print_step_cost)
+
+    render = subparsers.add_parser("render", help="time drawing routes on a map against the route length")
+    render.add_argument("--travel-type", default="walking", choices=list(GRAPH_FILES))
+    render.add_argument("--repeats", type=int, default=3)
+    render.set_defaults(run=print_render_cost)
+
+    suite = subparsers.add_parser("suite", help="route a seeded corpus with every algorithm on every graph")
+    suite.add_argument("--output", default="benchmark.json")
+    suite.add_argument("--baseline", default=None, help="a previous report to check for regressions")
+    suite.add_argument("--tolerance", type=float, default=0.2)
+    suite.add_argument("--travel-types", nargs="+", default=None, choices=list(GRAPH_FILES))
+    suite.add_argument("--size", type=int, default=50)
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--extra-travel", type=float, default=25)
+    suite.add_argument("--no-memory", action="store_true", help="skip the peak memory runs")
+    suite.set_defaults(run=print_suite)
+
+    scaling = subparsers.add_parser("scaling", help="route a seeded corpus on synthetic maps of growing size")
+    scaling.add_argument("--output", default="scaling.json")
+    scaling.add_argument("--baseline", default=None, help="a previous report to check for regressions")
+    scaling.add_argument("--tolerance", type=float, default=0.2)
+    scaling.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    scaling.add_argument("--kind", default="street", choices=GRAPH_KINDS)
+    scaling.add_argument("--size", type=int, default=10)
+    scaling.add_argument("--seed", type=int, default=0)
+    scaling.add_argument("--extra-travel", type=float, default=25)
+    scaling.add_argument("--memory", action="store_true", help="also measure the peak memory of each search")
+    scaling.set_defaults(run=print_suite)
+
+    args = parser.parse_args()
+    args.run(args)
@@ -1,7 +1,12 @@
 from tkinter import *
 from tkinter.ttk import *
-import pickle as pkl
-import osmnx as ox
+from graph_cache import graph_cache
+from spatial_index import SpatialIndex
+from query_trace import QueryTrace, NULL_TRACE
+from route_session import RouteSession
+
+# Points further than this from every node of the map, in meters, are rejected instead of snapped
+MAX_SNAP_DISTANCE = 1000
 
 
 class Controller(Frame):
@@ -17,6 +22,12 @@ class Controller(Frame):
         self.G = None
         self.start = None
         self.end = None
+        # Path of the JSON lines file each query's trace is appended to, or None to not trace queries
+        self.trace_log = None
+        # The session of the last query, reused while only the extra travel changes, and the travel type and
+        # coordinates it was opened for
+        self.session = None
+        self.session_query = None
 
         Frame.__init__(self)
         master.title("520-EleNa")
@@ -54,22 +65,21 @@ class Controller(Frame):
         """
         Load in Pickle file of Hampshire County driving map as default.
         Change file based on routing option.
-        :return: The selected graph of Hampshire County
+        Graphs are loaded through the process-wide graph cache, so each one is only read from disk once.
+        A graph split into tiles only has the tiles around the query loaded.
+        :return: The selected graph of Hampshire County, or the region of it the query's routes lie in
         """
+        return graph_cache.get_region(self.travel_type, (self.start_lat, self.start_long),
+                                      (self.end_lat, self.end_long), self.extra_travel)
 
-        graph_file = "./graphs/graph.pkl"
-        if self.travel_type == "driving":
-            graph_file = "./graphs/drive_graph.pkl"
-        elif self.travel_type == "walking":
-            graph_file = "./graphs/walk_graph.pkl"
-        elif self.travel_type == "biking":
-            graph_file = "./graphs/bike_graph.pkl"
-
-        infile = open(graph_file, 'rb')
-        G = pkl.load(infile)
-        infile.close()
-
-        return G
+    def get_nearest_node(self, G, point):
+        """
+        Finds the node of the graph closest to a point, using the graph's spatial index
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param point: (tuple) The (latitude, longitude) of the point
+        :return: (node) The nearest node, or None if no node is within MAX_SNAP_DISTANCE
+        """
+        return SpatialIndex.of(G).nearest_node(point[0], point[1], MAX_SNAP_DISTANCE)
 
     def confirm(self, travel_type, mode, start_lat, start_long, end_lat, end_long, extra_travel):
         if not self.is_number(start_lat) or not self.is_number(start_long) or not "." in start_lat or not "." in start_long:
@@ -88,14 +98,41 @@ class Controller(Frame):
             self.extra_travel = float(extra_travel)
             self.mode = mode.lower()
             self.travel_type = travel_type.lower()
-            self.G = self.get_map()
-            self.start = ox.get_nearest_node(
-                self.G, (self.start_lat, self.start_long))
-            self.end = ox.get_nearest_node(
-                self.G, (self.end_lat, self.end_long))
+            if self.trace_log is not None:
+                trace = QueryTrace(self.trace_log, travel_type=self.travel_type, mode=self.mode,
+                                   extra_travel=self.extra_travel)
+            else:
+                trace = NULL_TRACE
+
+            with trace.stage("graph_load") as record:
+                misses = graph_cache.misses
+                G = self.get_map()
+                record["cache_hit"] = graph_cache.misses == misses
+
+            # When only the extra travel changed, the nodes and session of the last query are used again, as long
+            # as the graph is the same one (a larger extra travel can need a larger region of a tiled graph)
+            query = (self.travel_type, self.mode, self.start_lat, self.start_long, self.end_lat, self.end_long)
+            if self.session is None or self.session_query != query or G is not self.G:
+                self.G = G
+                with trace.stage("nearest_node"):
+                    self.start = self.get_nearest_node(
+                        self.G, (self.start_lat, self.start_long))
+                    self.end = self.get_nearest_node(
+                        self.G, (self.end_lat, self.end_long))
+
+                if self.start is None or self.end is None:
+                    self.session = None
+                    newWindow = Toplevel(self)
+                    Label(newWindow,
+                          text="Sorry, please enter geocoordinates within the map").pack()
+                    return
+                self.session = RouteSession(self.G, self.start, self.end, self.mode,
+                                            route_cache=self.model.route_cache)
+                self.session_query = query
 
             self.model.get_route(self.G, self.start, self.end,
-                             self.extra_travel, self.mode)
+                             self.extra_travel, self.mode, trace=trace, session=self.session)
+            trace.finish()
 
         pass
 
@@ -1,4 +1,5 @@
 import sys
+import argparse
 
 sys.path.insert(1, './controller')
 sys.path.insert(1, './model')
@@ -7,23 +8,37 @@ sys.path.insert(1, './view')
 from controller import Controller
 from model import Model
 from view import View
+from route_cache import RouteCache
 
 class Main(object):
 
-    def __init__(self):
+    def __init__(self, trace_log=None, route_cache=None, output='html'):
+        self.trace_log = trace_log
+        self.route_cache = route_cache
+        self.output = output
         self.run()
 
     def run(self):
         """
         Executes program to find optimized route based on user inputs
         """
-        model = Model()
-        view = View()
+        model = Model(self.route_cache)
+        view = View(self.output)
         controller = Controller()
 
         model.set_view(view)
         controller.set_model(model)
+        controller.trace_log = self.trace_log
         controller.mainloop()
 
 if __name__ == '__main__':
-    model = Main()
+    parser = argparse.ArgumentParser(description="Find routes that minimize or maximize elevation gain")
+    parser.add_argument("--trace", default=None, metavar="FILE",
+                        help="append the timings and search counters of each query to a JSON lines file")
+    parser.add_argument("--route-cache", default=None, metavar="FILE",
+                        help="keep the routes found in a sqlite database, so repeated queries are answered at once")
+    parser.add_argument("--output", default="html", choices=["html", "geojson"],
+                        help="show routes on a map, or only save them to route.geojson")
+    args = parser.parse_args()
+
+    model = Main(args.trace, RouteCache(path=args.route_cache) if args.route_cache else None, args.output)
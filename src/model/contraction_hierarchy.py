@@ -0,0 +1,306 @@
+from heapq import *
+import numpy as np
+from routing_graph import save_arrays, load_arrays
+from query_trace import count_search
+
+# Witness searches give up after settling this many nodes and add the shortcut instead. This only makes
+# the hierarchy larger, never wrong. Estimating the priority of a node uses shorter searches
+WITNESS_SETTLE_LIMIT = 100
+PRIORITY_SETTLE_LIMIT = 30
+# Weight of the edge difference against the number of contracted neighbors in the priority of a node
+EDGE_DIFFERENCE_WEIGHT = 2
+
+
+class ContractionHierarchy(object):
+    """
+    Contraction hierarchy over the edge lengths of a RoutingGraph, for answering shortest path queries
+    with two small searches. Nodes are contracted one at a time in order of importance (their rank),
+    adding a shortcut edge between their neighbors wherever the shortest path ran through them. A query
+    then only follows edges towards nodes of higher rank, forwards from the source and backwards from
+    the target. Each edge remembers the node it shortcuts (its middle, -1 for edges of the graph) so
+    paths can be unpacked.
+    """
+
+    def __init__(self, rank, up_offsets, up_targets, up_lengths, up_middles,
+                 down_offsets, down_sources, down_lengths, down_middles, graph_shape):
+        """
+        :param rank: (int32 array) The position of every node in the contraction order
+        :param up_offsets: (int64 array) The CSR row offsets of the edges u -> v with rank[u] < rank[v], stored at u
+        :param up_targets: (int32 array) The end node v of each of those edges
+        :param up_lengths: (float64 array) Their lengths in meters
+        :param up_middles: (int32 array) The node each of them shortcuts, or -1
+        :param down_offsets: (int64 array) The CSR row offsets of the edges u -> v with rank[u] > rank[v], stored at v
+        :param down_sources: (int32 array) The starting node u of each of those edges
+        :param down_lengths: (float64 array) Their lengths in meters
+        :param down_middles: (int32 array) The node each of them shortcuts, or -1
+        :param graph_shape: (int64 array) The number of nodes and edges and the checksum of the graph the hierarchy
+                            was built for (see RoutingGraph.graph_shape)
+        """
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_lengths = up_lengths
+        self.up_middles = up_middles
+        self.down_offsets = down_offsets
+        self.down_sources = down_sources
+        self.down_lengths = down_lengths
+        self.down_middles = down_middles
+        self.graph_shape = graph_shape
+
+    @classmethod
+    def build(cls, rg):
+        """
+        Builds the hierarchy for a graph. Nodes are contracted in order of their edge difference (the number of
+        shortcuts contracting them adds minus the number of edges it removes) and their number of contracted
+        neighbors, which spreads the contraction evenly over the graph. This takes minutes on a county-sized
+        graph, so it is done offline by preprocess.py
+        :param rg: (RoutingGraph object) The graph representing the map
+        :return: (ContractionHierarchy) The hierarchy
+        """
+        n = rg.number_of_nodes()
+        # Edges between nodes not contracted yet, as {neighbor: (length, middle)} dictionaries
+        out_edges = [dict() for _ in range(n)]
+        in_edges = [dict() for _ in range(n)]
+        for u in range(n):
+            for v, length in rg.edges(u):
+                if v != u and (v not in out_edges[u] or length < out_edges[u][v][0]):
+                    out_edges[u][v] = (length, -1)
+                    in_edges[v][u] = (length, -1)
+
+        deleted_neighbors = [0] * n
+
+        def find_shortcuts(v, settle_limit):
+            # Shortcuts u -> w are needed where no path from u to w avoiding v is as short as u -> v -> w
+            shortcuts = []
+            outs = [(w, length) for w, (length, middle) in out_edges[v].items()]
+            if len(outs) == 0:
+                return shortcuts
+            max_out = max(length for w, length in outs)
+            for u, (in_length, middle) in in_edges[v].items():
+                dist = witness_search(u, v, in_length + max_out, settle_limit)
+                for w, out_length in outs:
+                    if w != u and dist.get(w, float('inf')) > in_length + out_length:
+                        shortcuts.append((u, w, in_length + out_length))
+            return shortcuts
+
+        def witness_search(source, avoid, max_dist, settle_limit):
+            dist = {source: 0}
+            frontier = [(0, source)]
+            settled = 0
+            while len(frontier) != 0 and settled < settle_limit:
+                (d, curr_node) = heappop(frontier)
+                if d > dist[curr_node]:
+                    continue
+                if d > max_dist:
+                    break
+                settled += 1
+                for nbr, (length, middle) in out_edges[curr_node].items():
+                    new_dist = d + length
+                    if nbr != avoid and new_dist < dist.get(nbr, float('inf')):
+                        dist[nbr] = new_dist
+                        heappush(frontier, (new_dist, nbr))
+            return dist
+
+        def priority(v):
+            edge_difference = len(find_shortcuts(v, PRIORITY_SETTLE_LIMIT)) - len(in_edges[v]) - len(out_edges[v])
+            return EDGE_DIFFERENCE_WEIGHT * edge_difference + deleted_neighbors[v]
+
+        queue = [(priority(v), v) for v in range(n)]
+        heapify(queue)
+        rank = np.empty(n, dtype=np.int32)
+        up_edges = [None] * n
+        down_edges = [None] * n
+        order = 0
+        while len(queue) != 0:
+            (p, v) = heappop(queue)
+            # Priorities go stale as neighbors are contracted, so recompute it and contract v only if it is
+            # still the least important node
+            p = priority(v)
+            if len(queue) != 0 and p > queue[0][0]:
+                heappush(queue, (p, v))
+                continue
+
+            shortcuts = find_shortcuts(v, WITNESS_SETTLE_LIMIT)
+            rank[v] = order
+            order += 1
+            up_edges[v] = [(w, length, middle) for w, (length, middle) in out_edges[v].items()]
+            down_edges[v] = [(u, length, middle) for u, (length, middle) in in_edges[v].items()]
+            for u in in_edges[v]:
+                del out_edges[u][v]
+                deleted_neighbors[u] += 1
+            for w in out_edges[v]:
+                del in_edges[w][v]
+                deleted_neighbors[w] += 1
+            out_edges[v] = None
+            in_edges[v] = None
+            for u, w, length in shortcuts:
+                if w not in out_edges[u] or length < out_edges[u][w][0]:
+                    out_edges[u][w] = (length, v)
+                    in_edges[w][u] = (length, v)
+
+        (up_offsets, up_targets, up_lengths, up_middles) = cls.to_csr(up_edges)
+        (down_offsets, down_sources, down_lengths, down_middles) = cls.to_csr(down_edges)
+        return cls(rank, up_offsets, up_targets, up_lengths, up_middles,
+                   down_offsets, down_sources, down_lengths, down_middles,
+                   rg.graph_shape())
+
+    @staticmethod
+    def to_csr(edges):
+        """
+        Packs lists of (node, length, middle) edges, one list per node, into CSR arrays
+        :return: a (offsets, nodes, lengths, middles) tuple of arrays
+        """
+        offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(node_edges) for node_edges in edges])
+        flat = [edge for node_edges in edges for edge in node_edges]
+        return (offsets,
+                np.array([node for node, length, middle in flat], dtype=np.int32),
+                np.array([length for node, length, middle in flat], dtype=np.float64),
+                np.array([middle for node, length, middle in flat], dtype=np.int32))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a hierarchy saved with save
+        :param path: (str) The path of the hierarchy file
+        :return: (ContractionHierarchy) The loaded hierarchy
+        """
+        arrays = load_arrays(path)
+        return cls(arrays['rank'], arrays['up_offsets'], arrays['up_targets'], arrays['up_lengths'],
+                   arrays['up_middles'], arrays['down_offsets'], arrays['down_sources'], arrays['down_lengths'],
+                   arrays['down_middles'], arrays['graph_shape'])
+
+    def save(self, path):
+        """
+        Saves the hierarchy in the same flat binary format as compiled graphs
+        :param path: (str) The path of the hierarchy file
+        """
+        save_arrays(path, [('rank', self.rank), ('up_offsets', self.up_offsets), ('up_targets', self.up_targets),
+                           ('up_lengths', self.up_lengths), ('up_middles', self.up_middles),
+                           ('down_offsets', self.down_offsets), ('down_sources', self.down_sources),
+                           ('down_lengths', self.down_lengths), ('down_middles', self.down_middles),
+                           ('graph_shape', self.graph_shape)])
+
+    def matches(self, rg):
+        """
+        :param rg: (RoutingGraph object) A graph
+        :return: (bool) True if the hierarchy was built for the same graph as rg
+        """
+        # Files saved before the checksum was kept only hold the number of nodes and edges
+        shape = self.graph_shape.tolist()
+        return shape == rg.graph_shape().tolist()[:len(shape)]
+
+    def shortest_distance(self, source, target, stats=None):
+        """
+        Finds the shortest path length between two nodes with a bidirectional search over the hierarchy
+        :param source: (int) The compact id of the starting node
+        :param target: (int) The compact id of the end node
+        :param stats: (dict) Optional search counters the search's work is added to (see query_trace.count_search)
+        :return: a (distance, meeting node, forward previous nodes, backward next nodes) tuple. The distance is
+                 infinite if there is no path
+        """
+        dists = [{source: 0}, {target: 0}]
+        links = [{source: -1}, {target: -1}]
+        frontiers = [[(0, source)], [(0, target)]]
+        edge_arrays = [(self.up_offsets, self.up_targets, self.up_lengths),
+                       (self.down_offsets, self.down_sources, self.down_lengths)]
+        best = float('inf')
+        meeting_node = -1
+        settled = 0
+        pushed = 2
+        heap_peak = 0
+        while len(frontiers[0]) != 0 or len(frontiers[1]) != 0:
+            if len(frontiers[0]) + len(frontiers[1]) > heap_peak:
+                heap_peak = len(frontiers[0]) + len(frontiers[1])
+            # Advance the direction whose next node is closer
+            if len(frontiers[1]) == 0 or (len(frontiers[0]) != 0 and frontiers[0][0][0] <= frontiers[1][0][0]):
+                side = 0
+            else:
+                side = 1
+            (d, curr_node) = heappop(frontiers[side])
+            if d > dists[side][curr_node]:
+                continue
+            # Nothing left in this direction can lead to a shorter path
+            if d >= best:
+                frontiers[side] = []
+                continue
+            settled += 1
+
+            other = dists[1 - side].get(curr_node)
+            if other is not None and d + other < best:
+                best = d + other
+                meeting_node = curr_node
+
+            (offsets, nodes, lengths) = edge_arrays[side]
+            start, end = offsets[curr_node], offsets[curr_node + 1]
+            for nbr, length in zip(nodes[start:end].tolist(), lengths[start:end].tolist()):
+                new_dist = d + length
+                if new_dist < dists[side].get(nbr, float('inf')):
+                    dists[side][nbr] = new_dist
+                    links[side][nbr] = curr_node
+                    heappush(frontiers[side], (new_dist, nbr))
+                    pushed += 1
+        count_search(stats, settled, pushed, heap_peak)
+        return best, meeting_node, links[0], links[1]
+
+    def shortest_path(self, source, target, stats=None):
+        """
+        Finds the shortest path, by length, between two nodes
+        :param source: (int) The compact id of the starting node
+        :param target: (int) The compact id of the end node
+        :param stats: (dict) Optional search counters (see shortest_distance)
+        :return: the path as a list of compact node ids
+        """
+        (distance, meeting_node, prev_nodes, next_nodes) = self.shortest_distance(source, target, stats)
+        if distance == float('inf'):
+            raise ValueError("No path between compact nodes {} and {}".format(source, target))
+
+        # The path in the hierarchy, from source up to the meeting node and back down to target
+        nodes = [meeting_node]
+        while prev_nodes[nodes[0]] != -1:
+            nodes.insert(0, prev_nodes[nodes[0]])
+        while next_nodes[nodes[-1]] != -1:
+            nodes.append(next_nodes[nodes[-1]])
+
+        path = [source]
+        for u, v in zip(nodes, nodes[1:]):
+            self.unpack_edge(u, v, path)
+        return path
+
+    def unpack_edge(self, u, v, path):
+        """
+        Replaces an edge of the hierarchy by the edges of the graph it stands for
+        :param u: (int) The compact id of the starting node of the edge
+        :param v: (int) The compact id of the end node of the edge
+        :param path: (list) The path ending at u, which the nodes after u are appended to
+        """
+        stack = [(u, v)]
+        while len(stack) != 0:
+            (a, b) = stack.pop()
+            middle = self.edge_middle(a, b)
+            if middle == -1:
+                path.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+
+    def edge_middle(self, u, v):
+        """
+        :return: (int) The node the hierarchy edge u -> v shortcuts, or -1 if it is an edge of the graph
+        """
+        if self.rank[u] < self.rank[v]:
+            (offsets, nodes, middles, owner, other) = (self.up_offsets, self.up_targets, self.up_middles, u, v)
+        else:
+            (offsets, nodes, middles, owner, other) = (self.down_offsets, self.down_sources, self.down_middles, v, u)
+        start, end = offsets[owner], offsets[owner + 1]
+        for i, node in enumerate(nodes[start:end].tolist()):
+            if node == other:
+                return int(middles[start + i])
+        raise KeyError((u, v))
+
+    def memory_usage(self):
+        """
+        :return: (int) The number of bytes used by the hierarchy's arrays
+        """
+        return sum(a.nbytes for a in (self.rank, self.up_offsets, self.up_targets, self.up_lengths, self.up_middles,
+                                      self.down_offsets, self.down_sources, self.down_lengths, self.down_middles))
@@ -0,0 +1,192 @@
+import os
+import pickle as pkl
+from collections import OrderedDict
+from routing_graph import RoutingGraph
+from contraction_hierarchy import ContractionHierarchy
+from landmarks import Landmarks
+from graph_tiles import TiledGraph, TILES_MANIFEST
+
+GRAPH_FILES = {
+    "driving": "./graphs/drive_graph.pkl",
+    "walking": "./graphs/walk_graph.pkl",
+    "biking": "./graphs/bike_graph.pkl"
+}
+DEFAULT_GRAPH_FILE = "./graphs/graph.pkl"
+
+# Rough size of a loaded OSMnx graph, used to charge networkx graphs against the memory budget
+NETWORKX_BYTES_PER_NODE = 600
+NETWORKX_BYTES_PER_EDGE = 1200
+
+
+def load_graph(travel_type):
+    """
+    Loads the graph of Hampshire County for a travel type from disk, using the compiled
+    graph file (see preprocess.py) when there is one and the Pickle file otherwise. A contraction
+    hierarchy and landmarks saved next to the graph are loaded with it
+    :param travel_type: ('driving', 'walking' or 'biking') The routing option
+    :return: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    """
+    graph_file = GRAPH_FILES.get(travel_type, DEFAULT_GRAPH_FILE)
+
+    compiled_file = os.path.splitext(graph_file)[0] + ".rgraph"
+    if (os.path.exists(compiled_file) and os.path.exists(graph_file) and
+            os.path.getmtime(compiled_file) < os.path.getmtime(graph_file)):
+        print("Ignoring", compiled_file, "as it is older than", graph_file)
+        compiled_file = None
+    if compiled_file is not None and os.path.exists(compiled_file):
+        G = RoutingGraph.load(compiled_file)
+    else:
+        infile = open(graph_file, 'rb')
+        G = pkl.load(infile)
+        infile.close()
+        # Convert the graph now, so a graph with missing elevations is rejected here rather than mid-search
+        RoutingGraph.of(G)
+
+    hierarchy_file = os.path.splitext(graph_file)[0] + ".ch"
+    if os.path.exists(hierarchy_file):
+        rg = RoutingGraph.of(G)
+        hierarchy = ContractionHierarchy.load(hierarchy_file)
+        if hierarchy.matches(rg):
+            rg.indexes['contraction_hierarchy'] = hierarchy
+        else:
+            print("Ignoring", hierarchy_file, "as it was built for a different graph")
+
+    landmarks_file = os.path.splitext(graph_file)[0] + ".landmarks"
+    if os.path.exists(landmarks_file):
+        rg = RoutingGraph.of(G)
+        landmarks = Landmarks.load(landmarks_file)
+        if landmarks.matches(rg):
+            rg.indexes['landmarks'] = landmarks
+        else:
+            print("Ignoring", landmarks_file, "as it was built for a different graph")
+
+    return G
+
+
+def load_tiles(travel_type):
+    """
+    Opens the tiles of the graph for a travel type (see preprocess.py --tiles), if it was split into tiles
+    :param travel_type: ('driving', 'walking' or 'biking') The routing option
+    :return: (TiledGraph object) The tiled graph, or None if the graph has no tiles
+    """
+    tiles_directory = os.path.splitext(GRAPH_FILES.get(travel_type, DEFAULT_GRAPH_FILE))[0] + ".tiles"
+    if not os.path.exists(os.path.join(tiles_directory, TILES_MANIFEST)):
+        return None
+    return TiledGraph(tiles_directory)
+
+
+class GraphCache(object):
+    """
+    Keeps loaded graphs, and the routing graphs and indexes derived from them, in memory so repeated
+    queries for the same travel type do not go back to disk. When the graphs held use more than the
+    memory budget, the least recently used ones are dropped. Tiled graphs are not counted in the budget:
+    each one holds at most its max_tiles tiles and max_regions regions (see TiledGraph).
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, loader=load_graph, tiles_loader=load_tiles):
+        """
+        :param max_bytes: (int) The memory budget in bytes. The most recently used graph is always kept,
+                          even when it alone is over the budget
+        :param loader: (function) Loads the graph for a travel type
+        :param tiles_loader: (function) Opens the tiles of the graph for a travel type, None if it has none
+        """
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.tiles_loader = tiles_loader
+        self.graphs = OrderedDict()
+        self.tiled_graphs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, travel_type):
+        """
+        Gets the graph for a travel type, loading it on the first request
+        :param travel_type: ('driving', 'walking' or 'biking') The routing option
+        :return: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        """
+        travel_type = travel_type.lower()
+        if travel_type in self.graphs:
+            self.hits += 1
+            self.graphs.move_to_end(travel_type)
+            return self.graphs[travel_type]
+
+        self.misses += 1
+        G = self.loader(travel_type)
+        self.graphs[travel_type] = G
+        self.evict()
+        return G
+
+    def get_region(self, travel_type, start, end, extra_travel):
+        """
+        Gets a graph holding every route between two points within a length budget. For a graph split into
+        tiles, only the tiles around the points are loaded (see TiledGraph); otherwise it is the whole graph
+        :param travel_type: ('driving', 'walking' or 'biking') The routing option
+        :param start: (tuple) The (latitude, longitude) of the starting point
+        :param end: (tuple) The (latitude, longitude) of the end point
+        :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel
+        :return: (networkx MultiDiGraph or RoutingGraph object) The graph
+        """
+        travel_type = travel_type.lower()
+        if travel_type not in self.tiled_graphs:
+            self.tiled_graphs[travel_type] = self.tiles_loader(travel_type)
+        tiles = self.tiled_graphs[travel_type]
+        if tiles is None:
+            return self.get(travel_type)
+
+        regions_built = tiles.regions_built
+        G = tiles.graph_for(start, end, extra_travel)
+        if tiles.regions_built == regions_built:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return G
+
+    def warm_up(self, travel_types=None):
+        """
+        Loads graphs ahead of time and builds the structures the routing algorithms derive from them
+        :param travel_types: (list) The travel types to load, all of them by default
+        """
+        if travel_types is None:
+            travel_types = list(GRAPH_FILES)
+        for travel_type in travel_types:
+            rg = RoutingGraph.of(self.get(travel_type))
+            rg.reverse()
+        self.evict()
+
+    def memory_usage(self, G):
+        """
+        Estimates the memory held for a graph
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph
+        :return: (int) The estimated number of bytes
+        """
+        if isinstance(G, RoutingGraph):
+            return G.memory_usage()
+        total = NETWORKX_BYTES_PER_NODE * G.number_of_nodes() + NETWORKX_BYTES_PER_EDGE * G.number_of_edges()
+        rg = RoutingGraph.converted(G)
+        if rg is not None:
+            total += rg.memory_usage()
+        return total
+
+    def total_memory_usage(self):
+        """
+        :return: (int) The estimated number of bytes held for the cached graphs, without the tiled graphs
+        """
+        return sum(self.memory_usage(G) for G in self.graphs.values())
+
+    def evict(self):
+        """
+        Drops the least recently used graphs until the cache fits in its memory budget
+        """
+        while len(self.graphs) > 1 and self.total_memory_usage() > self.max_bytes:
+            self.graphs.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every cached graph
+        """
+        self.graphs.clear()
+        self.tiled_graphs.clear()
+
+
+# Cache shared by everything in the process
+graph_cache = GraphCache()
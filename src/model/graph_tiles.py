@@ -0,0 +1,267 @@
+import os
+import json
+import math
+from collections import OrderedDict
+import numpy as np
+from routing_graph import RoutingGraph, save_arrays, load_arrays
+from spatial_index import SpatialIndex, EARTH_RADIUS, great_circle_distance
+
+# Width and height of a tile in degrees, about 5.5 km north to south
+TILE_DEGREES = 0.05
+TILES_MANIFEST = "tiles.json"
+# Typical ratio of the shortest path length to the straight-line distance, used to guess the first region
+INITIAL_CIRCUITY = 1.4
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+def tile_file(directory, key):
+    """
+    :param directory: (str) The directory of the tiles
+    :param key: (tuple) The (row, column) of a tile
+    :return: (str) The path of the tile's file
+    """
+    return os.path.join(directory, "{}_{}.tile".format(key[0], key[1]))
+
+
+def split_tiles(G, directory, size=TILE_DEGREES):
+    """
+    Splits a graph into square tiles of latitude and longitude saved as separate files, so a region of it
+    can be loaded without the rest (see TiledGraph). Each tile holds its nodes and their outgoing edges. An
+    edge to a node of the tile stores the node's position in the tile; an edge to a node of another tile
+    stores the number of nodes of the tile plus the node's position in the tile's boundary table, which holds
+    the OSM id and tile of every node outside the tile that an edge leads to
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param directory: (str) The directory the tiles and their manifest are written to
+    :param size: (number) The width and height of a tile in degrees
+    :return: (int) The number of tiles
+    """
+    rg = RoutingGraph.of(G)
+    os.makedirs(directory, exist_ok=True)
+    rows = np.floor(rg.y / size).astype(np.int64)
+    cols = np.floor(rg.x / size).astype(np.int64)
+    # Nodes grouped by tile, in increasing order of their compact id (so of their OSM id) within each tile
+    order = np.lexsort((cols, rows))
+    splits = np.flatnonzero((np.diff(rows[order]) != 0) | (np.diff(cols[order]) != 0)) + 1
+    local = np.empty(rg.number_of_nodes(), dtype=np.int64)
+
+    tiles = []
+    for nodes in np.split(order, splits):
+        key = (int(rows[nodes[0]]), int(cols[nodes[0]]))
+        local[nodes] = np.arange(len(nodes))
+        counts = rg.offsets[nodes + 1] - rg.offsets[nodes]
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        edges = np.repeat(rg.offsets[nodes] - offsets[:-1], counts) + np.arange(offsets[-1])
+        targets = rg.targets[edges]
+
+        inside = (rows[targets] == key[0]) & (cols[targets] == key[1])
+        (boundary, boundary_refs) = np.unique(targets[~inside], return_inverse=True)
+        refs = np.empty(len(targets), dtype=np.int32)
+        refs[inside] = local[targets[inside]]
+        refs[~inside] = len(nodes) + boundary_refs.reshape(-1)
+        save_arrays(tile_file(directory, key), [
+            ('osm_ids', rg.osm_ids[nodes]), ('x', rg.x[nodes]), ('y', rg.y[nodes]),
+            ('elevation', rg.elevation[nodes]), ('offsets', offsets), ('targets', refs),
+            ('lengths', rg.lengths[edges]), ('keys', rg.keys[edges]), ('boundary_ids', rg.osm_ids[boundary]),
+            ('boundary_rows', rows[boundary]), ('boundary_cols', cols[boundary])])
+        tiles.append([key[0], key[1], len(nodes), len(edges)])
+
+    with open(os.path.join(directory, TILES_MANIFEST), 'w') as outfile:
+        json.dump({"size": size, "tiles": tiles}, outfile)
+    return len(tiles)
+
+
+class TiledGraph(object):
+    """
+    A graph saved as tiles by split_tiles, of which only the region a query needs is loaded. The region is
+    every tile within a margin of the start and end: a route no longer than can_travel stays within the
+    ellipse whose foci are its ends and whose major axis is can_travel, and the margin is the half minor axis
+    of that ellipse. As the shortest path length is only known once the region is loaded, the first region
+    is a guess, and it is grown until it covers the ellipse of the shortest path found in it. Tiles and the
+    regions built from them are kept for the next queries, the least recently used being dropped first, so
+    memory grows with the size of the routes rather than the size of the map.
+    """
+
+    def __init__(self, directory, max_tiles=256, max_regions=4, snap_distance=1000):
+        """
+        :param directory: (str) The directory of the tiles
+        :param max_tiles: (int) The number of tiles kept loaded
+        :param max_regions: (int) The number of regions kept
+        :param snap_distance: (number) The distance in meters around the start and end that is always loaded,
+                              so the nodes nearest to them are in the region
+        """
+        self.directory = directory
+        with open(os.path.join(directory, TILES_MANIFEST)) as infile:
+            manifest = json.load(infile)
+        self.size = manifest["size"]
+        self.tiles = {(row, col): nodes for (row, col, nodes, edges) in manifest["tiles"]}
+        self.rows = (min(row for (row, col) in self.tiles), max(row for (row, col) in self.tiles))
+        self.cols = (min(col for (row, col) in self.tiles), max(col for (row, col) in self.tiles))
+        self.max_tiles = max_tiles
+        self.max_regions = max_regions
+        self.snap_distance = snap_distance
+        self.loaded_tiles = OrderedDict()
+        self.regions = OrderedDict()
+        self.shortest_lengths = OrderedDict()
+        self.regions_built = 0
+
+    def tiles_around(self, points, margin):
+        """
+        :param points: (list) The (latitude, longitude) of points
+        :param margin: (number) A distance in meters
+        :return: (set) The (row, column) of the tiles within the margin of the bounding box of the points
+        """
+        lats = [lat for (lat, lon) in points]
+        lons = [lon for (lat, lon) in points]
+        dlat = margin / METERS_PER_DEGREE
+        # A degree of longitude is shortest on the side of the box furthest from the equator
+        widest_lat = min(max(abs(min(lats) - dlat), abs(max(lats) + dlat)), 89.9)
+        dlon = margin / (METERS_PER_DEGREE * math.cos(math.radians(widest_lat)))
+        # Regions far larger than the map are cut to the tiles there are
+        rows = range(max(int(math.floor((min(lats) - dlat) / self.size)), self.rows[0]),
+                     min(int(math.floor((max(lats) + dlat) / self.size)), self.rows[1]) + 1)
+        cols = range(max(int(math.floor((min(lons) - dlon) / self.size)), self.cols[0]),
+                     min(int(math.floor((max(lons) + dlon) / self.size)), self.cols[1]) + 1)
+        return {(row, col) for row in rows for col in cols if (row, col) in self.tiles}
+
+    def load_tile(self, key):
+        """
+        Gets the arrays of a tile, memory-mapping its file the first time it is asked for
+        :param key: (tuple) The (row, column) of the tile
+        :return: a dictionary of the tile's arrays by name (see split_tiles)
+        """
+        if key in self.loaded_tiles:
+            self.loaded_tiles.move_to_end(key)
+            return self.loaded_tiles[key]
+        tile = load_arrays(tile_file(self.directory, key))
+        self.loaded_tiles[key] = tile
+        while len(self.loaded_tiles) > self.max_tiles:
+            self.loaded_tiles.popitem(last=False)
+        return tile
+
+    def build_region(self, keys):
+        """
+        Joins tiles into one routing graph. Edges to nodes of tiles that are not part of the region are left out
+        :param keys: (set) The (row, column) of the tiles
+        :return: (RoutingGraph) The graph of the region
+        """
+        keys = sorted(keys)
+        tiles = [self.load_tile(key) for key in keys]
+        counts = [len(tile['osm_ids']) for tile in tiles]
+        bases = dict(zip(keys, np.cumsum([0] + counts[:-1]).tolist()))
+        osm_ids = np.concatenate([tile['osm_ids'] for tile in tiles])
+
+        sources = []
+        targets = []
+        edges = []
+        for key, tile in zip(keys, tiles):
+            n = len(tile['osm_ids'])
+            refs = tile['targets'].astype(np.int64)
+            tile_sources = bases[key] + np.repeat(np.arange(n), np.diff(tile['offsets']))
+            tile_targets = np.full(len(refs), -1, dtype=np.int64)
+            inside = refs < n
+            tile_targets[inside] = bases[key] + refs[inside]
+            # Boundary nodes are looked up in their own tile, when it is part of the region
+            boundary = refs[~inside] - n
+            (boundary_rows, boundary_cols) = (tile['boundary_rows'][boundary], tile['boundary_cols'][boundary])
+            found = np.full(len(boundary), -1, dtype=np.int64)
+            for other in set(zip(boundary_rows.tolist(), boundary_cols.tolist())):
+                if other not in bases:
+                    continue
+                wanted = (boundary_rows == other[0]) & (boundary_cols == other[1])
+                other_ids = self.load_tile(other)['osm_ids']
+                found[wanted] = bases[other] + np.searchsorted(other_ids, tile['boundary_ids'][boundary[wanted]])
+            tile_targets[~inside] = found
+            kept = tile_targets >= 0
+            sources.append(tile_sources[kept])
+            targets.append(tile_targets[kept])
+            edges.append((tile['lengths'][kept], tile['keys'][kept]))
+
+        # Routing graphs number their nodes in increasing order of OSM id
+        order = np.argsort(osm_ids, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        sources = rank[np.concatenate(sources)]
+        targets = rank[np.concatenate(targets)]
+        edge_order = np.argsort(sources, kind='stable')
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(sources, minlength=len(order)))
+        return RoutingGraph(osm_ids[order], np.concatenate([tile['x'] for tile in tiles])[order],
+                            np.concatenate([tile['y'] for tile in tiles])[order],
+                            np.concatenate([tile['elevation'] for tile in tiles])[order], offsets,
+                            targets[edge_order].astype(np.int32),
+                            np.concatenate([lengths for (lengths, _) in edges])[edge_order],
+                            keys=np.concatenate([keys for (_, keys) in edges])[edge_order])
+
+    def get_region(self, keys):
+        """
+        Gets a routing graph holding at least some tiles, reusing a kept region when one holds them all
+        :param keys: (set) The (row, column) of the tiles
+        :return: a (set of tiles, RoutingGraph) pair for the region
+        """
+        for region_keys in reversed(self.regions):
+            if keys <= region_keys:
+                self.regions.move_to_end(region_keys)
+                return region_keys, self.regions[region_keys]
+        region_keys = frozenset(keys)
+        self.regions[region_keys] = self.build_region(keys)
+        self.regions_built += 1
+        while len(self.regions) > self.max_regions:
+            self.regions.popitem(last=False)
+        return region_keys, self.regions[region_keys]
+
+    def get_shortest_length(self, region_keys, rg, start, end):
+        """
+        :return: (number) The shortest path length between two nodes of a region in meters, inf if there is none
+        """
+        key = (region_keys, start, end)
+        if key not in self.shortest_lengths:
+            self.shortest_lengths[key] = float(rg.dijkstra(start, end)[0][end])
+            while len(self.shortest_lengths) > 1024:
+                self.shortest_lengths.popitem(last=False)
+        return self.shortest_lengths[key]
+
+    def graph_for(self, start, end, extra_travel):
+        """
+        Gets a routing graph holding every route between two points within a length budget
+        :param start: (tuple) The (latitude, longitude) of the starting point
+        :param end: (tuple) The (latitude, longitude) of the end point
+        :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel
+        :return: (RoutingGraph) The graph of the region
+        """
+        budget = (100.0 + extra_travel) / 100.0
+        distance = float(great_circle_distance(start[0], start[1], end[0], end[1]))
+        points = [start, end]
+        margin = max(math.sqrt(max((budget * INITIAL_CIRCUITY * distance) ** 2 - distance ** 2, 0)) / 2,
+                     self.snap_distance)
+        while True:
+            keys = self.tiles_around(points, margin)
+            if len(keys) == 0:
+                margin *= 2
+                continue
+            (region_keys, rg) = self.get_region(keys)
+            index = SpatialIndex.of(rg)
+            (s, t) = (index.nearest_node(start[0], start[1]), index.nearest_node(end[0], end[1]))
+            (s, t) = (rg.index_of(s), rg.index_of(t))
+            length = self.get_shortest_length(region_keys, rg, s, t)
+            if length == float('inf'):
+                # The ends may only be joined through tiles that are not loaded yet
+                if len(region_keys) == len(self.tiles):
+                    return rg
+                margin *= 2
+                continue
+
+            # The ellipse is drawn around the nodes the route starts and ends at
+            ends = [(float(rg.y[s]), float(rg.x[s])), (float(rg.y[t]), float(rg.x[t]))]
+            distance = float(great_circle_distance(ends[0][0], ends[0][1], ends[1][0], ends[1][1]))
+            needed = math.sqrt(max((budget * length) ** 2 - distance ** 2, 0)) / 2
+            points = [start, end] + ends
+            if self.tiles_around(points, needed) <= region_keys:
+                return rg
+            margin = max(margin, needed)
+
+    def memory_usage(self):
+        """
+        :return: (int) The number of bytes used by the regions kept, which are copies of their tiles
+        """
+        return sum(rg.memory_usage() for rg in self.regions.values())
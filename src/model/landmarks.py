@@ -0,0 +1,141 @@
+import numpy as np
+from routing_graph import save_arrays, load_arrays
+
+# Number of landmarks picked for a graph. Each one stores two distances per node
+LANDMARK_COUNT = 16
+# Distances are stored as float32, so bounds leave room for their rounding
+ROUNDING = 1e-6
+
+
+class Landmarks(object):
+    """
+    Shortest path lengths from and to a few landmark nodes, for lower bounds on the path length between any
+    two nodes (the ALT bounds of Goldberg and Harrelson). By the triangle inequality, a path from u to the goal
+    is at least as long as d(L, goal) - d(L, u) and d(u, L) - d(goal, L) for every landmark L, so a bound costs
+    a few array reads instead of a search. Landmarks far out at the edges of the map give the best bounds
+    """
+
+    def __init__(self, landmarks, from_landmarks, to_landmarks, graph_shape):
+        """
+        :param landmarks: (int32 array) The compact id of every landmark
+        :param from_landmarks: (float32 array) The shortest path length from each landmark to every node, as
+                               one row per landmark. inf where there is no path
+        :param to_landmarks: (float32 array) The shortest path length from every node to each landmark, as
+                             one row per landmark. inf where there is no path
+        :param graph_shape: (int64 array) The number of nodes and edges and the checksum of the graph the landmarks
+                            were picked for (see RoutingGraph.graph_shape)
+        """
+        self.landmarks = landmarks
+        self.from_landmarks = from_landmarks
+        self.to_landmarks = to_landmarks
+        self.graph_shape = graph_shape
+
+    @classmethod
+    def build(cls, rg, count=LANDMARK_COUNT):
+        """
+        Picks landmarks for a graph and finds the distances from and to them. Each landmark is the node farthest
+        (going there and back) from the landmarks picked before it, starting from the node farthest from the
+        first node. This runs two Dijkstra searches over the whole graph per landmark, so it is done offline
+        by preprocess.py
+        :param rg: (RoutingGraph object) The graph representing the map
+        :param count: (int) The number of landmarks. Fewer are picked if the graph runs out of distinct nodes
+        :return: (Landmarks) The landmarks
+        """
+        reverse = rg.reverse()
+        landmarks = []
+        (from_landmarks, to_landmarks) = ([], [])
+        # Round trip length from the nearest landmark to every node, -1 where no landmark reaches the node
+        nearest = np.array(rg.dijkstra(0)[0])
+        nearest[~np.isfinite(nearest)] = -1
+        while len(landmarks) < count:
+            landmark = int(np.argmax(nearest))
+            if nearest[landmark] <= 0:
+                break
+            landmarks.append(landmark)
+            from_landmarks.append(np.array(rg.dijkstra(landmark)[0]))
+            to_landmarks.append(np.array(reverse.dijkstra(landmark)[0]))
+            round_trip = from_landmarks[-1] + to_landmarks[-1]
+            round_trip[~np.isfinite(round_trip)] = -1
+            nearest = round_trip if len(landmarks) == 1 else np.minimum(nearest, round_trip)
+
+        return cls(np.array(landmarks, dtype=np.int32),
+                   np.array(from_landmarks, dtype=np.float32).reshape(len(landmarks), rg.number_of_nodes()),
+                   np.array(to_landmarks, dtype=np.float32).reshape(len(landmarks), rg.number_of_nodes()),
+                   rg.graph_shape())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads landmarks saved with save
+        :param path: (str) The path of the landmarks file
+        :return: (Landmarks) The loaded landmarks
+        """
+        arrays = load_arrays(path)
+        shape = (len(arrays['landmarks']), int(arrays['graph_shape'][0]))
+        return cls(arrays['landmarks'], arrays['from_landmarks'].reshape(shape),
+                   arrays['to_landmarks'].reshape(shape), arrays['graph_shape'])
+
+    def save(self, path):
+        """
+        Saves the landmarks in the same flat binary format as compiled graphs
+        :param path: (str) The path of the landmarks file
+        """
+        save_arrays(path, [('landmarks', self.landmarks), ('from_landmarks', self.from_landmarks.ravel()),
+                           ('to_landmarks', self.to_landmarks.ravel()), ('graph_shape', self.graph_shape)])
+
+    def matches(self, rg):
+        """
+        :param rg: (RoutingGraph object) A graph
+        :return: (bool) True if the landmarks were picked for the same graph as rg
+        """
+        # Files saved before the checksum was kept only hold the number of nodes and edges
+        shape = self.graph_shape.tolist()
+        return shape == rg.graph_shape().tolist()[:len(shape)]
+
+    def lower_bound(self, u, goal):
+        """
+        :param u: (int) The compact id of a node
+        :param goal: (int) The compact id of the end point
+        :return: (number) A lower bound on the length of any path from u to the goal in meters, inf if there is none
+        """
+        return float(self.bounds(self.from_landmarks[:, goal], self.from_landmarks[:, u],
+                                 self.to_landmarks[:, u], self.to_landmarks[:, goal]))
+
+    def lower_bounds(self, goal):
+        """
+        :param goal: (int) The compact id of the end point
+        :return: (float64 array) A lower bound on the length of any path from every node to the goal in meters,
+                 inf where there is none
+        """
+        return self.bounds(self.from_landmarks[:, goal, None], self.from_landmarks,
+                           self.to_landmarks, self.to_landmarks[:, goal, None])
+
+    def lower_bounds_from(self, source):
+        """
+        :param source: (int) The compact id of the starting point
+        :return: (float64 array) A lower bound on the length of any path from the source to every node in meters,
+                 inf where there is none
+        """
+        return self.bounds(self.from_landmarks, self.from_landmarks[:, source, None],
+                           self.to_landmarks[:, source, None], self.to_landmarks)
+
+    @staticmethod
+    def bounds(from_to_end, from_to_start, start_to, end_to):
+        """
+        Computes max(d(L, end) - d(L, start), d(start, L) - d(end, L), 0) over the landmarks L, given the
+        distances as arrays with one row per landmark
+        :return: (float64 array) The bounds, with the landmark axis reduced
+        """
+        def differences(minuend, subtrahend):
+            return minuend.astype(np.float64) * (1 - ROUNDING) - subtrahend.astype(np.float64) * (1 + ROUNDING)
+
+        # Where neither node is reached by a landmark, the difference is nan and says nothing
+        with np.errstate(invalid='ignore'):
+            return np.fmax(np.fmax.reduce(differences(from_to_end, from_to_start), axis=0, initial=0),
+                           np.fmax.reduce(differences(start_to, end_to), axis=0, initial=0))
+
+    def memory_usage(self):
+        """
+        :return: (int) The number of bytes used by the landmarks' arrays
+        """
+        return sum(a.nbytes for a in (self.landmarks, self.from_landmarks, self.to_landmarks))
@@ -2,10 +2,27 @@ import sys
 import osmnx as ox
 import networkx as nx
 from heapq import *
+from bisect import bisect_left
 import time
+import numpy as np
+from routing_graph import RoutingGraph
+from spatial_index import great_circle_distance
+from route_metrics import route_metrics, routes_metrics
+from query_trace import new_search_stats, count_search, NULL_TRACE
 
 class Model(object):
 
+    def __init__(self, route_cache=None):
+        """
+        :param route_cache: (RouteCache object) Optional cache of the results of compute_route
+        """
+        # Counters of the work done by the searches, reset by get_route
+        self.search_stats = new_search_stats()
+        self.route_cache = route_cache
+        # Searches from or towards a node that do not depend on the length budget, kept by (search, node) for
+        # a route session (see RouteSession), or None to do them again for every query
+        self.kept_searches = None
+
     def set_view(self, vobj):
         """
         Sets the view
@@ -13,187 +30,979 @@ class Model(object):
         """
         self.vobj = vobj
 
-    def get_route(self, G, start, end, extra_travel, mode):
+    def get_route(self, G, start, end, extra_travel, mode, algorithm='dijkstra', trace=NULL_TRACE, session=None):
         """
         Finds a path with elevation maximized or minimized as specified (within a specified path length).
         Also provides statistics in comparison with the shortest route (not accounting for elevation)
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param start: (node) The starting point
         :param goal: (node) The end point 
         :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel.
         :param mode: ('maximize' or 'mimimize') Specifies if the route should maximize or minimize elevation
+        :param algorithm: ('dijkstra', 'astar' or 'bidirectional') Specifies how the searches find their bounds
+                          (see min_ele)
+        :param trace: (QueryTrace object) Optional trace the searches and the rendering of the map are recorded in
+        :param session: (RouteSession object) Optional session for the same graph, nodes, mode and algorithm,
+                        which finds the route reusing the work of its earlier queries
+        :return: a dictionary with the routes and their statistics (see compute_route)
         """
-        shortest_path = nx.shortest_path(G, start, end, weight='length')
+        if session is not None:
+            result = session.compute_route(extra_travel, trace)
+        else:
+            result = self.compute_route(G, start, end, extra_travel, mode, algorithm, trace=trace)
         print()
         print("Printing Statistics of Shortest path route")
-        self.print_route_stats(G, shortest_path)
+        self.print_route_stats(G, result["shortest_path"])
 
-        shortest_path_length = self.get_total_length(G, shortest_path)
-        can_travel = ((100.0 + extra_travel)*shortest_path_length)/100.0
         print()
-        print('Distance you are willing to travel : {:,.0f} meters'.format(can_travel))
+        print('Distance you are willing to travel : {:,.0f} meters'.format(result["can_travel"]))
 
-        t = time.time()
-        optimized_route = self.get_op_route(G, start, end, can_travel, mode)
         print()
-        print("Our algorithm took :", time.time() - t, " seconds")
+        print("Our algorithm took :", result["solver_time"], " seconds")
+        print("Nodes settled by the searches ({}): {:,}".format(algorithm, result["nodes_settled"]))
         print("Printing Statistics of our algorithm's " + mode + "d elevation route")
-        self.print_route_stats(G, optimized_route)
-        elevation_stats_optimized = self.get_elevation_stats(G, optimized_route)
-        elevation_stats_shortest = self.get_elevation_stats(G, shortest_path)
-        total_distance_optimized = self.get_total_length(G, optimized_route)
-        total_distance_shortest = self.get_total_length(G, shortest_path)
-        self.vobj.show_route(G, optimized_route, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, alt_route=[shortest_path])
+        self.print_route_stats(G, result["route"])
+        with trace.stage("render"):
+            self.vobj.show_route(G, result["route"], result["elevation_stats"], result["shortest_elevation_stats"], result["length"], result["shortest_length"], alt_route=[result["shortest_path"]])
+        return result
+
+    def compute_route(self, G, start, end, extra_travel, mode, algorithm='dijkstra', time_budget=None,
+                      trace=NULL_TRACE):
+        """
+        Finds a path with elevation maximized or minimized as specified (within a specified path length),
+        without printing or displaying anything
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param start: (node) The starting point
+        :param end: (node) The end point
+        :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel.
+        :param mode: ('maximize' or 'mimimize') Specifies if the route should maximize or minimize elevation
+        :param algorithm: ('dijkstra', 'astar' or 'bidirectional') Specifies how the searches find their bounds
+                          (see min_ele)
+        :param time_budget: (number) Optional time in seconds the maximize search may take (see max_ele_anytime)
+        :param trace: (QueryTrace object) Optional trace the shortest path and optimized searches are recorded in,
+                      with their search counters and the length of the path each found
+        :return: a dictionary containing the optimized route and the shortest path, their lengths and elevation
+                 statistics, the length budget, the time taken by the optimized search in seconds, the
+                 number of nodes settled and pushed and the largest priority queue of all searches, and whether
+                 the result came from the route cache. With a time budget, it also holds the upper bound, gap
+                 and iterations of the maximize search
+        """
+        if self.route_cache is not None:
+            (key, result) = self.get_cached_route(G, start, end, extra_travel, mode, algorithm, time_budget, trace)
+            if result is not None:
+                return result
+            # The route is found for the bottom of the extra travel bucket, so it suits every query in it
+            extra_travel = self.route_cache.bucket_of(extra_travel)
+
+        self.search_stats = new_search_stats()
+        with trace.stage("shortest_path", self.search_stats) as record:
+            shortest_path = self.get_shortest_path(G, start, end, algorithm)
+            shortest_path_length = self.get_total_length(G, shortest_path)
+            record["path_nodes"] = len(shortest_path)
+            record["path_length"] = shortest_path_length
+        can_travel = ((100.0 + extra_travel)*shortest_path_length)/100.0
+
+        with trace.stage("optimized_search", self.search_stats) as record:
+            t = time.time()
+            optimized_route = self.get_op_route(G, start, end, can_travel, mode, algorithm, time_budget)
+            solver_time = time.time() - t
+            record["path_nodes"] = len(optimized_route)
 
+        (metrics, shortest_metrics) = routes_metrics(G, [optimized_route, shortest_path])
+        record["path_length"] = metrics["length"]
+        result = {
+            "route": optimized_route,
+            "length": metrics["length"],
+            "elevation_stats": self.elevation_stats_of(metrics),
+            "shortest_path": shortest_path,
+            "shortest_length": shortest_path_length,
+            "shortest_elevation_stats": self.elevation_stats_of(shortest_metrics),
+            "can_travel": can_travel,
+            "solver_time": solver_time,
+            "nodes_settled": self.search_stats["nodes_settled"],
+            "nodes_pushed": self.search_stats["nodes_pushed"],
+            "heap_peak": self.search_stats["heap_peak"],
+            "cached": False
+        }
+        if "anytime" in self.search_stats:
+            result["anytime"] = self.search_stats["anytime"]
+        if self.route_cache is not None:
+            self.route_cache.put(key, result)
+        return result
 
-    def get_op_route(self, G, start, end, can_travel, mode):
+    def get_cached_route(self, G, start, end, extra_travel, mode, algorithm='dijkstra', time_budget=None,
+                         trace=NULL_TRACE):
+        """
+        Looks a query up in the route cache (see compute_route for the parameters)
+        :return: a (cache key, cached result or None) pair. The result is marked as cached
+        """
+        with trace.stage("route_cache") as record:
+            key = self.route_cache.key(G, start, end, mode, extra_travel, algorithm, time_budget)
+            result = self.route_cache.get(key)
+            record["hit"] = result is not None
+        if result is not None:
+            result["cached"] = True
+        return (key, result)
+
+    def get_op_route(self, G, start, end, can_travel, mode, algorithm='dijkstra', time_budget=None):
         """
         Finds a path with elevation maximized or minimized as specified (within a specified path length)
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param start: (node) The starting point
         :param goal: (node) The end point 
         :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
         :param mode: ('maximize' or 'mimimize') Specifies if the route should maximize or minimize elevation
+        :param algorithm: ('dijkstra', 'astar' or 'bidirectional') Specifies how min_ele finds its bounds.
+                          max_ele needs exact distances to the goal from every node, so it always uses Dijkstra
+        :param time_budget: (number) Optional time in seconds the maximize search may take. If given, the best path
+                            found within it by max_ele_anytime is returned, and its upper bound, gap and iterations
+                            are kept in search_stats["anytime"]
         :return: The minimized/maximized elevation path as a list of nodes
         """
-        if(mode == 'maximize'):
+        if(mode == 'maximize' and time_budget is not None):
+            result = self.max_ele_anytime(G, start, end, can_travel, time_budget)
+            self.search_stats["anytime"] = {key: result[key] for key in
+                                            ["elevation_gain", "upper_bound", "gap", "elapsed", "iterations"]}
+            return result["route"]
+        elif(mode == 'maximize'):
             return self.max_ele(G, start, end, can_travel)
         elif(mode == 'minimize'):
-            return self.min_ele(G, start, end, can_travel)
+            return self.min_ele(G, start, end, can_travel, algorithm)
         else:
             raise Exception("Invalid mode specified. Valid modes: 'minimize', 'maximize'")
 
     def max_ele(self, G, start, goal, can_travel):
         """
         Finds a path with elevation maximized (within a specified path length)
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param start: (node) The starting point
         :param goal: (node) The end point 
         :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
         :return: The maximized elevation path as a list of nodes
         """
-        # Get the shortest path and its length 
-        shortest_path = nx.shortest_path(G, start, goal, weight='length')
-        shortest_path_length = self.get_total_length(G, shortest_path)
-        
-        if (can_travel == shortest_path_length):
-            return shortest_path
+        rg = RoutingGraph.of(G)
+        start = rg.index_of(start)
+        goal = rg.index_of(goal)
 
-        curr_path = []
-        bad_nodes = []
+        # Landmark bounds on the remaining distance cost a few array reads per node instead of a search over the
+        # whole graph. They are not exact, so the walk can run into nodes it cannot leave within can_travel and
+        # back out of start; then it is run again with exact distances
+        if 'landmarks' in rg.indexes:
+            path = self.max_ele_walk(rg, start, goal, can_travel, self.get_distance_bounds(rg, goal))
+            if path is not None:
+                return rg.to_osm(path)
+
+        # Exact remaining distance from every node to the goal, computed once per query
+        dist_to_goal, next_nodes = self.get_dist_to_goal(rg, goal)
+        if dist_to_goal[start] == float('inf'):
+            raise ValueError("No path between {} and {}".format(rg.osm_ids[start], rg.osm_ids[goal]))
+
+        # If there is no room for a detour, follow the shortest path
+        if (can_travel <= dist_to_goal[start]):
+            return rg.to_osm(self.get_path_from_nexts(next_nodes, start, goal))
+
+        return rg.to_osm(self.max_ele_walk(rg, start, goal, can_travel, dist_to_goal))
+
+    def max_ele_walk(self, rg, start, goal, can_travel, dist_to_goal):
+        """
+        Walks from start to the goal, always stepping to the highest neighbor from which the goal can still be
+        reached within can_travel, and backing up from nodes with no such neighbor
+        :param rg: (RoutingGraph object) The graph representing the map
+        :param start: (int) The compact id of the starting point
+        :param goal: (int) The compact id of the end point
+        :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
+        :param dist_to_goal: (list) A lower bound on the path length from every node to the goal
+        :return: The path as a list of compact ids, or None if the walk backed out of start
+        """
+        elevation = rg.elevation.tolist()
+        # Path membership and dead nodes are kept as flags indexed by compact id, so checking a neighbor takes
+        # constant time however long the path grows. The path itself is a stack that is pushed and popped in place
+        on_path = bytearray(rg.number_of_nodes())
+        bad_nodes = bytearray(rg.number_of_nodes())
+        curr_path = [start]
+        # Length of the path up to (and including) each node on curr_path
+        curr_path_lengths = [0]
+        on_path[start] = 1
         curr_node = start
-        curr_path.append(curr_node)
-        
+
         while curr_node != goal:
-            # Get the neighbors of the current node
-            neighbors = G.neighbors(curr_node)
-
-            # Filter the neighbors to find the valid possible next nodes
-            valid_neighbors = []
-            for nbr in neighbors:
-                # Filter out the neighbors that are in the path or are bad (ie: have no valid neighbors)
-                if (nbr not in curr_path) and (nbr not in bad_nodes):
-                    nbr_goal_path = nx.shortest_path(G, nbr, goal, weight='length')
-                    nbr_goal_length = self.get_total_length(G, nbr_goal_path)
-                    curr_path_length = self.get_total_length(G, curr_path)
-                    curr_nbr_edge_cost = self.get_cost(G, curr_node, nbr)
-
-                    # Append only the nodes that will not cause the path length to be too long
-                    if curr_path_length + curr_nbr_edge_cost + nbr_goal_length <= can_travel:
-                        valid_neighbors.append(nbr)
+            # Find the valid neighbor with the highest elevation: one that is neither on the path nor bad
+            # (ie: has no valid neighbors), and will not cause the path length to be too long
+            max_ele_vnbr = None
+            max_ele_length = 0
+            for nbr, length in rg.edges(curr_node):
+                if on_path[nbr] or bad_nodes[nbr]:
+                    continue
+                if curr_path_lengths[-1] + length + dist_to_goal[nbr] <= can_travel:
+                    if max_ele_vnbr is None or elevation[nbr] > elevation[max_ele_vnbr]:
+                        (max_ele_vnbr, max_ele_length) = (nbr, length)
 
             # If a node has no valid neighbors
-            if (len(valid_neighbors) == 0):
-                # Mark the node as bad
-                bad_nodes.append(curr_node)
-                # Backtrack on the path
-                curr_path = curr_path[:-1]
-                # Set the current node to the end of the path (previous node)
+            if max_ele_vnbr is None:
+                # Mark the node as bad and backtrack to the previous node on the path
+                bad_nodes[curr_node] = 1
+                on_path[curr_node] = 0
+                curr_path.pop()
+                curr_path_lengths.pop()
+                if len(curr_path) == 0:
+                    return None
                 curr_node = curr_path[-1]
-            
-            # If a node does have valid neighbors
+
+            # If a node does have valid neighbors, add the highest one to the path and update the current node
             else:
-                # Find the valid neighbor with the highest elevation, add it to the path, and update the current node 
-                max_ele_vnbr = valid_neighbors[0]
-                for vnbr in valid_neighbors:
-                    if G.nodes[vnbr]["elevation"] > G.nodes[max_ele_vnbr]["elevation"]:
-                        max_ele_vnbr = vnbr
+                curr_path_lengths.append(curr_path_lengths[-1] + max_ele_length)
                 curr_path.append(max_ele_vnbr)
+                on_path[max_ele_vnbr] = 1
                 curr_node = max_ele_vnbr
 
         return curr_path
 
-    def min_ele(self, G, start, goal, can_travel):
+    def get_dist_to_goal(self, rg, goal):
         """
-        Finds a path with elevation gain minimized (within a specified path length)
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        Finds the shortest path length from every node to the goal with a single reverse Dijkstra search
+        :param rg: (RoutingGraph object) The graph representing the map
+        :param goal: (int) The compact id of the end point
+        :return: a (distances, next nodes) pair of lists, indexed by compact id, holding the shortest path length
+                 to the goal in meters and the next node on that shortest path
+        """
+        return self.kept_search('dist_to_goal', goal, lambda: rg.reverse().dijkstra(goal, stats=self.search_stats))
+
+    def kept_search(self, name, node, search):
+        """
+        Runs a search, or gets its result again if the model keeps its searches (see kept_searches)
+        :param name: (str) The name of the search
+        :param node: (int) The compact id of the node the search is from or towards
+        :param search: (function) Runs the search
+        :return: the result of the search
+        """
+        if self.kept_searches is None:
+            return search()
+        if (name, node) not in self.kept_searches:
+            self.kept_searches[(name, node)] = search()
+        return self.kept_searches[(name, node)]
+
+    def max_ele_anytime(self, G, start, goal, can_travel, time_budget):
+        """
+        Finds a path with elevation gain maximized (within a specified path length), stopping after a time budget
+        with the best path found so far (see max_ele_improvements)
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param start: (node) The starting point
+        :param goal: (node) The end point
+        :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
+        :param time_budget: (number) The time the search may take in seconds
+        :return: a dictionary containing the best route, its elevation gain, an upper bound on the elevation gain of
+                 any valid path, the relative gap between the two, the elapsed time in seconds and the number of
+                 search states expanded. The search needs the shortest path length from every node to the goal
+                 before it has a route, so it takes at least that long. When the time budget runs out before the
+                 upper bound is found, the route is the shortest path and the bound and gap are None
+        """
+        deadline = time.time() + time_budget
+        for result in self.max_ele_improvements(G, start, goal, can_travel, deadline):
+            pass
+        return result
+
+    def max_ele_improvements(self, G, start, goal, can_travel, deadline=None, max_width=1024):
+        """
+        Finds paths with more and more elevation gain (within a specified path length), yielding each improvement
+        as soon as it is found. The first path is the shortest path. Then beam searches from start, of width 1, 2,
+        4, ... up to max_width, keep the paths with the most elevation gain at each step. Paths that can no longer
+        reach the goal within can_travel are dropped, and the best path of each step is completed along the
+        shortest path to the goal to give a valid route
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param start: (node) The starting point
+        :param goal: (node) The end point
+        :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
+        :param deadline: (number) Optional time (as returned by time.time) at which the search stops
+        :param max_width: (int) The width of the last beam search
+        :return: a generator of dictionaries, as returned by max_ele_anytime. The last one is the final result
+        """
+        t = time.time()
+        rg = RoutingGraph.of(G)
+        start = rg.index_of(start)
+        goal = rg.index_of(goal)
+
+        dist_to_goal, next_nodes = self.get_dist_to_goal(rg, goal)
+        if dist_to_goal[start] == float('inf'):
+            raise ValueError("No path between {} and {}".format(rg.osm_ids[start], rg.osm_ids[goal]))
+        # The bound takes one or two more searches over the graph, which are not started once the deadline has passed
+        upper_bound = None
+        if deadline is None or time.time() < deadline:
+            upper_bound = self.get_gain_upper_bound(rg, start, goal, can_travel, dist_to_goal, deadline)
+
+        def result(path, gain, iterations):
+            if upper_bound is None:
+                gap = None
+            else:
+                gap = (upper_bound - gain) / upper_bound if upper_bound > 0 else 0.0
+            return {
+                "route": rg.to_osm(path),
+                "elevation_gain": gain,
+                "upper_bound": upper_bound,
+                "gap": gap,
+                "elapsed": time.time() - t,
+                "iterations": iterations
+            }
+
+        def completion(path, path_nodes, gain):
+            # Follow the shortest path to the goal from the end of path, if that keeps the route simple
+            path = list(path)
+            curr_node = path[-1]
+            while curr_node != goal:
+                for nbr, length, edge_gain in rg.edge_gains(curr_node):
+                    if nbr == next_nodes[curr_node]:
+                        gain += edge_gain
+                        break
+                curr_node = next_nodes[curr_node]
+                if curr_node in path_nodes:
+                    return None, None
+                path.append(curr_node)
+            return path, gain
+
+        best_path = self.get_path_from_nexts(next_nodes, start, goal)
+        best_gain = sum(rg.gains[rg.edge_indexes(best_path[:-1], best_path[1:])].tolist())
+        iterations = 0
+        if upper_bound is None:
+            yield result(best_path, best_gain, iterations)
+            return
+        yield result(best_path, best_gain, iterations)
+
+        width = 1
+        while width <= max_width and can_travel > dist_to_goal[start]:
+            # Each state is a path from start, stored as (elevation gain, length, path, set of its nodes)
+            beam = [(0, 0, [start], {start})]
+            while len(beam) != 0:
+                if deadline is not None and time.time() > deadline:
+                    # The last result holds the time and work actually spent, not those of the last improvement
+                    yield result(best_path, best_gain, iterations)
+                    return
+                # The best path of the step, completed to the goal
+                (gain, length, path, path_nodes) = beam[0]
+                (route, route_gain) = completion(path, path_nodes, gain)
+                if route is not None and route_gain > best_gain + 1e-6:
+                    (best_path, best_gain) = (route, route_gain)
+                    yield result(best_path, best_gain, iterations)
+
+                # Keep the best extension of the paths into each node
+                extensions = {}
+                for (gain, length, path, path_nodes) in beam:
+                    iterations += 1
+                    if path[-1] == goal:
+                        continue
+                    for nbr, edge_length, edge_gain in rg.edge_gains(path[-1]):
+                        new_length = length + edge_length
+                        if nbr in path_nodes or new_length + dist_to_goal[nbr] > can_travel:
+                            continue
+                        new_gain = gain + edge_gain
+                        if nbr not in extensions or (new_gain, -new_length) > extensions[nbr][:2]:
+                            extensions[nbr] = (new_gain, -new_length, path, path_nodes)
+                beam = []
+                for nbr, (gain, neg_length, path, path_nodes) in extensions.items():
+                    beam.append((gain, -neg_length, path + [nbr], path_nodes | {nbr}))
+                beam.sort(key=lambda state: (-state[0], state[1]))
+                beam = beam[:width]
+            width *= 2
+
+        yield result(best_path, best_gain, iterations)
+
+    def get_gain_upper_bound(self, rg, start, goal, can_travel, dist_to_goal, deadline=None):
+        """
+        Finds an upper bound on the elevation gain of any simple path from start to the goal within a path length.
+        Such a path only uses edges that can be on a path within can_travel, each at most once. Its gain is half of
+        its total rise and fall plus its net rise, and it uses each street at most once whichever way, so three
+        bounds hold, of which the smallest is returned:
+        - filling can_travel with the usable edges from the steepest up (counting part of the last one)
+        - the same with the total rise and fall of the usable streets
+        - for the steepest grade g of the usable edges, g * can_travel minus the least value of g * length minus
+          rise and fall over paths to the goal (a Lagrangian bound, found with one more Dijkstra search)
+        The bound still counts steep streets anywhere within reach, so it is usually well above the best path
+        :param rg: (RoutingGraph object) The graph representing the map
+        :param start: (int) The compact id of the starting point
+        :param goal: (int) The compact id of the end point
+        :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
+        :param dist_to_goal: (list) The shortest path length from every node to the goal
+        :param deadline: (number) Optional time (as returned by time.time) after which the Lagrangian bound is skipped
+        :return: (number) The upper bound in meters
+        """
+        (dist_from_start, prev_nodes) = self.kept_search('dist_from_start', start,
+                                                         lambda: rg.dijkstra(start, stats=self.search_stats))
+        sources = np.repeat(np.arange(rg.number_of_nodes()), np.diff(rg.offsets))
+        usable = ((np.array(dist_from_start)[sources] + rg.lengths + np.array(dist_to_goal)[rg.targets] <= can_travel)
+                  & (sources != rg.targets))
+        lengths = rg.lengths.astype(np.float64)
+        falls_and_rises = np.abs(rg.rises)
+        gain_bound = self.fill_length(lengths[usable], rg.gains[usable], can_travel)
+
+        # The two edges of a street count once, with the shorter length
+        (usable_sources, usable_targets) = (sources[usable], rg.targets[usable])
+        streets = (np.minimum(usable_sources, usable_targets).astype(np.int64) * rg.number_of_nodes() +
+                   np.maximum(usable_sources, usable_targets))
+        order = np.lexsort((lengths[usable], streets))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = streets[order][1:] != streets[order][:-1]
+        change_bound = self.fill_length(lengths[usable][order][first], falls_and_rises[usable][order][first],
+                                        can_travel)
+
+        if usable.any() and (deadline is None or time.time() < deadline):
+            grade = float(np.max(falls_and_rises[usable] / np.maximum(lengths[usable], 1e-9)))
+            # Edges that cannot be used are given a length no path within can_travel gets near
+            weights = np.where(usable, np.maximum(grade * lengths - falls_and_rises, 0), grade * can_travel + 1)
+            weighted = RoutingGraph(rg.osm_ids, rg.x, rg.y, rg.elevation, rg.offsets, rg.targets,
+                                    weights.astype(np.float32), rg.rises)
+            # The weights are rounded to float32, so leave room for their rounding
+            least = weighted.dijkstra(start, goal, stats=self.search_stats)[0][goal] * (1 - 1e-6)
+            change_bound = min(change_bound, grade * can_travel - least)
+
+        net_rise = float(rg.elevation[goal]) - float(rg.elevation[start])
+        return max(min(gain_bound, (change_bound + net_rise) / 2), 0.0)
+
+    def fill_length(self, lengths, values, length):
+        """
+        Finds the most value edges can add up to within a total length, when part of an edge can be counted
+        :param lengths: (float64 array) The length of every edge
+        :param values: (array) The value of every edge
+        :param length: (number) The total length
+        :return: (number) The value of the edges from the highest value per meter down, the last one in part
+        """
+        order = np.argsort(-values / np.maximum(lengths, 1e-9), kind='stable')
+        (lengths, values) = (lengths[order], values[order])
+        filled = np.cumsum(lengths)
+        n_full = int(np.searchsorted(filled, length, side='right'))
+        bound = float(np.sum(values[:n_full]))
+        if n_full < len(lengths):
+            room = length - (filled[n_full - 1] if n_full > 0 else 0)
+            bound += float(values[n_full] * room / max(lengths[n_full], 1e-9))
+        return bound
+
+    def min_ele(self, G, start, goal, can_travel, algorithm='dijkstra'):
+        """
+        Finds a path with elevation gain (the total climb) minimized (within a specified path length).
+        This is a label-setting search for a resource constrained shortest path: elevation gain is the cost
+        and length is the resource. A label is a path to a node; labels are settled in order of elevation gain
+        plus a lower bound on the gain still needed to reach the goal, labels that cannot reach the goal within
+        can_travel are pruned using a lower bound on the remaining distance, and labels no shorter than one
+        already settled at the same node are dominated and dropped.
+        With 'dijkstra', the bounds are exact and come from two reverse Dijkstra searches over the whole graph.
+        With 'astar', the bounds come from the straight-line distance (or the graph's landmarks, see
+        get_distance_bounds) and the climb left to the goal, so only the part of the graph between start and
+        goal is explored.
+        With 'bidirectional', labels are also grown backward from the goal (see min_ele_bidirectional).
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param start: (node) The starting point
         :param goal: (node) The end point 
         :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
+        :param algorithm: ('dijkstra', 'astar' or 'bidirectional') Specifies how the lower bounds are found
         :return: The minimized elevation path as a list of nodes
         """
+        rg = RoutingGraph.of(G)
+        start = rg.index_of(start)
+        goal = rg.index_of(goal)
+        elevation = rg.elevation.tolist()
+
+        if algorithm == 'bidirectional':
+            return rg.to_osm(self.min_ele_bidirectional(rg, start, goal, can_travel))
+        elif algorithm == 'dijkstra':
+            # Exact remaining distance from every node to the goal, used as the lower bound for pruning
+            dist_to_goal, next_nodes = self.get_dist_to_goal(rg, goal)
+            if dist_to_goal[start] == float('inf'):
+                raise ValueError("No path between {} and {}".format(rg.osm_ids[start], rg.osm_ids[goal]))
+            shortest_path = self.get_path_from_nexts(next_nodes, start, goal)
+        elif algorithm == 'astar':
+            dist_to_goal = self.get_distance_bounds(rg, goal)
+            shortest_path = rg.shortest_path(start, goal, dist_to_goal, self.search_stats)
+        else:
+            raise Exception("Invalid algorithm specified. Valid algorithms: 'dijkstra', 'astar', 'bidirectional'")
+
+        # If there is no room for a detour, follow the shortest path
+        if (can_travel <= sum(rg.edge_length(u, v) for u, v in zip(shortest_path, shortest_path[1:]))):
+            return rg.to_osm(shortest_path)
+
+        if algorithm == 'dijkstra':
+            # Least elevation gain of any path from each node to the goal, ignoring the budget, and the length
+            # of that path
+            gain_to_goal, gain_path_lengths, gain_next_nodes = self.get_gain_to_goal(rg, goal)
+        else:
+            # Any path must climb at least up to the elevation of the goal. Without the least elevation
+            # gain paths, labels can only be completed at the goal itself
+            goal_elevation = elevation[goal]
+            gain_to_goal = [max(goal_elevation - e, 0) for e in elevation]
+            gain_path_lengths = None
+
+        # The shortest path is within the budget, so no better path can climb more than it
+        upper_bound = sum(rg.gains[rg.edge_indexes(shortest_path[:-1], shortest_path[1:])].tolist())
+
+        # Each label is a path, stored as its last node, its elevation gain and the label it extends
+        label_nodes = [start]
+        label_ele_costs = [0]
+        label_prevs = [None]
+
+        # Length of the shortest label settled at each node
+        settled_lengths = [float('inf')] * rg.number_of_nodes()
+
+        # Edges of the nodes seen so far, as nodes are usually settled more than once
+        adjacency = {}
+
         frontier = []
-        heappush(frontier, (0, start))
+        heappush(frontier, (gain_to_goal[start], 0, 0))
+        (settled, popped, heap_peak) = (0, 0, 0)
+
+        while len(frontier) != 0:
+            if len(frontier) > heap_peak:
+                heap_peak = len(frontier)
+            (val, cost, label) = heappop(frontier)
+            popped += 1
+            curr_node = label_nodes[label]
+
+            # A label settled earlier at this node has no more elevation gain and is no longer
+            if cost >= settled_lengths[curr_node]:
+                continue
+            settled_lengths[curr_node] = cost
+            settled += 1
+
+            if curr_node == goal:
+                break
+            # No path costs less than this label's bound, so if the label can be completed along the least
+            # elevation gain path to the goal within the budget, that completion is the best path
+            if gain_path_lengths is not None and cost + gain_path_lengths[curr_node] <= can_travel:
+                break
+
+            # Get all edges that are incident to the current node
+            edges = adjacency.get(curr_node)
+            if edges is None:
+                edges = adjacency[curr_node] = rg.edge_gains(curr_node)
+            ele_cost = label_ele_costs[label]
+            for next, length, gain in edges:
+                new_cost = cost + length
+                # Skip paths that cannot reach the goal in time or are dominated at next
+                if new_cost + dist_to_goal[next] > can_travel or new_cost >= settled_lengths[next]:
+                    continue
+
+                new_ele_cost = ele_cost + gain
+                # Skip paths that cannot do better than the shortest path
+                if new_ele_cost + gain_to_goal[next] > upper_bound + 1e-6:
+                    continue
 
-        prev_nodes = {}
-        prev_nodes[start] = None
-        
-        curr_costs = {}
-        curr_costs[start] = 0
+                label_nodes.append(next)
+                label_ele_costs.append(new_ele_cost)
+                label_prevs.append(label)
+                heappush(frontier, (new_ele_cost + gain_to_goal[next], new_cost, len(label_nodes) - 1))
+        count_search(self.search_stats, settled, popped + len(frontier), heap_peak)
 
-        curr_ele_costs = {}
-        curr_ele_costs[start] = 0
+        # Get a path from the chain of labels, followed by the least elevation gain path to the goal
+        labels = self.get_path_from_prevs(label_prevs, 0, label)
+        path = [label_nodes[l] for l in labels]
+        if curr_node != goal:
+            path = path[:-1] + self.get_path_from_nexts(gain_next_nodes, curr_node, goal)
+        return rg.to_osm(path)
+
+    def min_ele_bidirectional(self, rg, start, goal, can_travel):
+        """
+        Finds a path with elevation gain minimized (within a specified path length) with two label-setting
+        searches that meet in the middle: one forward from start, and one backward from the goal over the
+        reversed edges, counting the gain of each edge in its own direction. Neither needs a search over the
+        whole graph first: labels are pruned with a lower bound on the distance to the other end (see
+        get_distance_bounds) and the climb to or from it. Keys are elevation gain plus the average of the two climb bounds, which keeps the keys
+        of the two searches consistent with each other (Ikeda et al.).
+        Whenever a label is pushed, it is joined to the labels the other search has settled at the same node,
+        and the best joined path within can_travel is kept. Along any path from start to the goal, the forward
+        key of a node plus its backward key is the elevation gain of the path, so once the smallest keys of
+        the two frontiers add up to the best gain found, no path can do better and the search stops
+        :param rg: (RoutingGraph object) The graph representing the map
+        :param start: (int) The compact id of the starting point
+        :param goal: (int) The compact id of the end point
+        :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
+        :return: The minimized elevation path as a list of compact ids
+        """
+        elevation = rg.elevation.astype(np.float64)
+        climb_to_goal = np.maximum(elevation[goal] - elevation, 0)
+        climb_from_start = np.maximum(elevation - elevation[start], 0)
+        # Everything below is indexed by direction: 0 is forward from start, 1 is backward from the goal
+        graphs = [rg, rg.reverse()]
+        ends = [start, goal]
+        dist_bounds = [self.get_distance_bounds(rg, goal), self.get_distance_bounds_from(rg, start)]
+        climb_bounds = [climb_to_goal.tolist(), climb_from_start.tolist()]
+        potentials = [((climb_to_goal - climb_from_start) / 2).tolist(),
+                      ((climb_from_start - climb_to_goal) / 2).tolist()]
+
+        shortest_path = rg.shortest_path(start, goal, dist_bounds[0], self.search_stats)
+        # If there is no room for a detour, follow the shortest path
+        if (can_travel <= sum(rg.edge_length(u, v) for u, v in zip(shortest_path, shortest_path[1:]))):
+            return shortest_path
+        # The shortest path is within the budget, so it is the route to beat
+        best_ele_cost = sum(rg.gains[rg.edge_indexes(shortest_path[:-1], shortest_path[1:])].tolist())
+        best_join = None
+
+        # Each label is a path from the end of its search, stored as its last node, its length, its elevation
+        # gain and the label it extends
+        label_nodes = [[start], [goal]]
+        label_lengths = [[0], [0]]
+        label_ele_costs = [[0], [0]]
+        label_prevs = [[None], [None]]
+        # Length of the shortest label settled at each node, and the labels settled at each node with their
+        # lengths negated, in the order they were settled: by increasing elevation gain, so by decreasing length
+        settled_lengths = [[float('inf')] * rg.number_of_nodes(), [float('inf')] * rg.number_of_nodes()]
+        settled_labels = [{}, {}]
+        settled_neg_lengths = [{}, {}]
+        # Edges of the nodes seen so far, as nodes are usually settled more than once
+        adjacency = [{}, {}]
+        frontiers = [[(potentials[0][start], 0, 0)], [(potentials[1][goal], 0, 0)]]
+        # Keys only grow along a path, so no label of a search has a smaller key than its end. Once a search has
+        # run out of labels, the other one can still join its settled labels, which have keys from there on
+        root_vals = [potentials[0][start], potentials[1][goal]]
+        (settled, popped, heap_peak) = (0, 0, 0)
+
+        while len(frontiers[0]) != 0 or len(frontiers[1]) != 0:
+            (forward_val, backward_val) = (frontiers[0][0][0] if frontiers[0] else root_vals[0],
+                                           frontiers[1][0][0] if frontiers[1] else root_vals[1])
+            if forward_val + backward_val >= best_ele_cost and frontiers[0] and frontiers[1]:
+                break
+            if len(frontiers[0]) + len(frontiers[1]) > heap_peak:
+                heap_peak = len(frontiers[0]) + len(frontiers[1])
+            # Grow the search with the smaller key, so the two meet halfway in elevation gain
+            if not frontiers[1]:
+                d = 0
+            elif not frontiers[0]:
+                d = 1
+            else:
+                d = 0 if forward_val <= backward_val else 1
+            (frontier, other_val) = (frontiers[d], backward_val if d == 0 else forward_val)
+            (val, cost, label) = heappop(frontier)
+            popped += 1
+            curr_node = label_nodes[d][label]
+            lengths = settled_lengths[d]
+            if cost >= lengths[curr_node]:
+                continue
+            lengths[curr_node] = cost
+            settled_labels[d].setdefault(curr_node, []).append(label)
+            settled_neg_lengths[d].setdefault(curr_node, []).append(-cost)
+            settled += 1
+
+            edges = adjacency[d].get(curr_node)
+            if edges is None:
+                edges = adjacency[d][curr_node] = graphs[d].edge_gains(curr_node)
+            ele_cost = label_ele_costs[d][label]
+            (dist_bound, climb_bound, potential) = (dist_bounds[d], climb_bounds[d], potentials[d])
+            (other_labels, other_neg_lengths, other_ele_costs) = (settled_labels[1 - d], settled_neg_lengths[1 - d],
+                                                                  label_ele_costs[1 - d])
+            other_end = ends[1 - d]
+            for next, length, gain in edges:
+                new_cost = cost + length
+                if new_cost + dist_bound[next] > can_travel:
+                    continue
+                new_ele_cost = ele_cost + gain
+                # Skip paths that cannot do better than the best path found
+                if new_ele_cost + climb_bound[next] >= best_ele_cost:
+                    continue
+                # A path reaching the other end is complete, whether or not the other search has settled its end
+                if next == other_end:
+                    if new_ele_cost < best_ele_cost:
+                        best_ele_cost = new_ele_cost
+                        best_join = (d, label, next, 0)
+                # Join the path to the least elevation gain label of the other search at next that it fits with
+                elif next in other_labels:
+                    i = bisect_left(other_neg_lengths[next], new_cost - can_travel)
+                    if i < len(other_labels[next]):
+                        other = other_labels[next][i]
+                        if new_ele_cost + other_ele_costs[other] < best_ele_cost:
+                            best_ele_cost = new_ele_cost + other_ele_costs[other]
+                            best_join = (d, label, next, other)
+                # Any better path through this label would have to join a label of the other search that is
+                # settled already, which it just did
+                new_val = new_ele_cost + potential[next]
+                if new_cost >= lengths[next] or new_val + other_val >= best_ele_cost:
+                    continue
+
+                label_nodes[d].append(next)
+                label_lengths[d].append(new_cost)
+                label_ele_costs[d].append(new_ele_cost)
+                label_prevs[d].append(label)
+                heappush(frontier, (new_val, new_cost, len(label_nodes[d]) - 1))
+        count_search(self.search_stats, settled, popped + len(frontiers[0]) + len(frontiers[1]), heap_peak)
+
+        if best_join is None:
+            return shortest_path
+        (d, label, node, other) = best_join
+        halves = [[label_nodes[d][l] for l in self.get_path_from_prevs(label_prevs[d], 0, label)] + [node],
+                  [label_nodes[1 - d][l] for l in self.get_path_from_prevs(label_prevs[1 - d], 0, other)]]
+        # The backward half runs from the goal, and both halves hold the node they were joined at
+        (forward, backward) = (halves[0], halves[1]) if d == 0 else (halves[1], halves[0])
+        return self.get_simple_path(forward + backward[::-1][1:])
+
+    def get_simple_path(self, path):
+        """
+        Removes the loops of a path. The two halves of a path joined by min_ele_bidirectional can cross, and
+        cutting out the loop between the two visits of a node gives a path that is no longer and climbs no more
+        :param path: the path as a list of nodes
+        :return: the path without loops, as a list of nodes
+        """
+        route = []
+        positions = {}
+        for node in path:
+            if node in positions:
+                for removed in route[positions[node] + 1:]:
+                    del positions[removed]
+                del route[positions[node] + 1:]
+            else:
+                positions[node] = len(route)
+                route.append(node)
+        return route
+
+    def pareto_routes(self, G, start, goal, can_travel):
+        """
+        Finds every route between two nodes that is not beaten on both length and elevation gain by another,
+        up to a maximum length, in a single bi-objective search. Labels are settled in order of length plus the
+        remaining distance to the goal, so a label only needs to be kept if it has less elevation gain than
+        every label settled before it at the same node, and less than the best route to the goal so far, after
+        adding the least elevation gain still needed to reach the goal
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param start: (node) The starting point
+        :param goal: (node) The end point
+        :param can_travel: (number) The maximum length a route on the frontier is allowed to have in meters
+        :return: a list of dictionaries holding the length, elevation gain and route of each frontier route, from
+                 the shortest path to the route with the least elevation gain. Budgets up to can_travel can be
+                 answered from it with get_pareto_route
+        """
+        rg = RoutingGraph.of(G)
+        start = rg.index_of(start)
+        goal = rg.index_of(goal)
+
+        dist_to_goal, next_nodes = self.get_dist_to_goal(rg, goal)
+        if dist_to_goal[start] == float('inf'):
+            raise ValueError("No path between {} and {}".format(rg.osm_ids[start], rg.osm_ids[goal]))
+        gain_to_goal, gain_path_lengths, gain_next_nodes = self.get_gain_to_goal(rg, goal)
+
+        # Each label is a path, stored as its last node, its length, its elevation gain and the label it extends
+        label_nodes = [start]
+        label_lengths = [0]
+        label_ele_costs = [0]
+        label_prevs = [None]
+
+        # Least elevation gain of any label settled at each node. Labels must improve on it by more than
+        # a millimeter to be kept, so the frontier is not cluttered by routes that differ only by rounding
+        best_ele_costs = [float('inf')] * rg.number_of_nodes()
+        tolerance = 1e-3
+
+        frontier = []
+        heappush(frontier, (dist_to_goal[start], gain_to_goal[start], 0))
+        goal_labels = []
+        (settled, popped, heap_peak) = (0, 0, 0)
 
         while len(frontier) != 0:
-            (val, curr_node) = heappop(frontier)
+            if len(frontier) > heap_peak:
+                heap_peak = len(frontier)
+            (val, ele_val, label) = heappop(frontier)
+            popped += 1
+            curr_node = label_nodes[label]
+            ele_cost = label_ele_costs[label]
+            if ele_cost + tolerance > best_ele_costs[curr_node] or ele_val + tolerance > best_ele_costs[goal]:
+                continue
+            best_ele_costs[curr_node] = ele_cost
+            settled += 1
+
             if curr_node == goal:
-                if curr_costs[curr_node] <= can_travel:
+                goal_labels.append(label)
+                # No route can have less elevation gain than the least elevation gain path to the goal
+                if ele_cost <= gain_to_goal[start] + tolerance:
                     break
-            
-            # Get all edges that are incident to the current node
-            for u, next, data in G.edges(curr_node, data=True):
-                new_cost = curr_costs[curr_node] + self.get_cost(G, curr_node, next)
-                new_ele_cost = curr_ele_costs[curr_node]
-                elevationcost = self.get_elevation_cost(G, curr_node, next)
-
-                if elevationcost > 0:
-                    new_ele_cost = new_ele_cost + elevationcost
-
-                # If next is an unexplored node or if the current path has a 
-                # lower elevation cost than any other path to next
-                if next not in curr_ele_costs or new_ele_cost < curr_ele_costs[next]:
-                    # Update costs
-                    curr_ele_costs[next] = new_ele_cost
-                    curr_costs[next] = new_cost
-                    # Push next onto frontier with updated priority
-                    heappush(frontier, (new_ele_cost, next))
-                    # Make next the previous node for curr_node
-                    prev_nodes[next] = curr_node
-
-        # Get a path from the set of previous nodes
-        path = self.get_path_from_prevs(prev_nodes, start, goal)
-        return path
+                continue
+
+            cost = label_lengths[label]
+            for next, length, gain in rg.edge_gains(curr_node):
+                new_cost = cost + length
+                if new_cost + dist_to_goal[next] > can_travel:
+                    continue
+                new_ele_cost = ele_cost + gain
+                if new_ele_cost + tolerance > best_ele_costs[next] or \
+                        new_ele_cost + gain_to_goal[next] + tolerance > best_ele_costs[goal]:
+                    continue
+
+                label_nodes.append(next)
+                label_lengths.append(new_cost)
+                label_ele_costs.append(new_ele_cost)
+                label_prevs.append(label)
+                heappush(frontier, (new_cost + dist_to_goal[next], new_ele_cost + gain_to_goal[next],
+                                    len(label_nodes) - 1))
+        count_search(self.search_stats, settled, popped + len(frontier), heap_peak)
+
+        routes = []
+        for label in goal_labels:
+            labels = self.get_path_from_prevs(label_prevs, 0, label)
+            routes.append({
+                "length": label_lengths[label],
+                "elevation_gain": label_ele_costs[label],
+                "route": rg.to_osm([label_nodes[l] for l in labels])
+            })
+        return routes
+
+    def get_pareto_route(self, routes, can_travel):
+        """
+        Looks up the route with the least elevation gain within a length budget on a frontier
+        :param routes: (list) The frontier, as returned by pareto_routes
+        :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
+        :return: The route as a list of nodes. If no frontier route is short enough, the shortest path
+        """
+        best = routes[0]
+        for route in routes:
+            if route["length"] > can_travel:
+                break
+            best = route
+        return best["route"]
+
+    def get_pareto_routes(self, G, start, end, extra_travel, count=5):
+        """
+        Finds the routes trading extra length for less elevation gain, up to a specified path length, and
+        displays the least elevation gain route within that length with some of the others as alternatives
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param start: (node) The starting point
+        :param end: (node) The end point
+        :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel.
+        :param count: (int) The largest number of frontier routes to display
+        :return: the frontier, as returned by pareto_routes
+        """
+        self.search_stats = new_search_stats()
+        shortest_path = self.get_shortest_path(G, start, end)
+        shortest_path_length = self.get_total_length(G, shortest_path)
+        can_travel = ((100.0 + extra_travel)*shortest_path_length)/100.0
+
+        t = time.time()
+        routes = self.pareto_routes(G, start, end, can_travel)
+        solver_time = time.time() - t
+        route = self.get_pareto_route(routes, can_travel)
+
+        print()
+        print("Found", len(routes), "routes trading length for elevation gain in", solver_time, "seconds")
+        for r in routes:
+            print('{:,.0f} meters with {:,.0f} meters of elevation gain'.format(r["length"], r["elevation_gain"]))
+
+        # Show routes spread evenly along the frontier, leaving out the ends which are drawn anyway
+        middle = routes[1:-1]
+        step = max(len(middle) / max(count - 2, 1), 1)
+        alt_routes = [middle[int(i * step)]["route"] for i in range(min(count - 2, len(middle)))]
+        self.vobj.show_route(G, route, self.get_elevation_stats(G, route), self.get_elevation_stats(G, shortest_path),
+                             self.get_total_length(G, route), shortest_path_length,
+                             alt_route=[shortest_path, routes[-1]["route"]] + alt_routes)
+        return routes
+
+    def get_gain_to_goal(self, rg, goal):
+        """
+        Finds the least elevation gain from every node to the goal, disregarding length, with a single
+        reverse Dijkstra search. Ties in elevation gain are broken by length
+        :param rg: (RoutingGraph object) The graph representing the map
+        :param goal: (int) The compact id of the end point
+        :return: a (elevation gains, lengths, next nodes) triple of lists, indexed by compact id, holding the least
+                 elevation gain to the goal, the length of the path achieving it and the next node on that path
+        """
+        return self.kept_search('gain_to_goal', goal, lambda: self.search_gain_to_goal(rg, goal))
+
+    def search_gain_to_goal(self, rg, goal):
+        """
+        Runs the search of get_gain_to_goal
+        """
+        reverse_graph = rg.reverse()
+        ele_costs = [float('inf')] * rg.number_of_nodes()
+        lengths = [float('inf')] * rg.number_of_nodes()
+        next_nodes = [-1] * rg.number_of_nodes()
+        ele_costs[goal] = 0
+        lengths[goal] = 0
+
+        frontier = [(0, 0, goal)]
+        (settled, popped, heap_peak) = (0, 0, 0)
+        while len(frontier) != 0:
+            if len(frontier) > heap_peak:
+                heap_peak = len(frontier)
+            (ele_cost, cost, curr_node) = heappop(frontier)
+            popped += 1
+            if ele_cost > ele_costs[curr_node] or (ele_cost == ele_costs[curr_node] and cost > lengths[curr_node]):
+                continue
+            settled += 1
+            # Each reversed edge prev -> curr_node is the edge curr_node -> prev of the graph, walked backwards
+            for prev, length, gain in reverse_graph.edge_gains(curr_node):
+                new_ele_cost = ele_cost + gain
+                new_cost = cost + length
+                if new_ele_cost < ele_costs[prev] or (new_ele_cost == ele_costs[prev] and new_cost < lengths[prev]):
+                    ele_costs[prev] = new_ele_cost
+                    lengths[prev] = new_cost
+                    next_nodes[prev] = curr_node
+                    heappush(frontier, (new_ele_cost, new_cost, prev))
+        count_search(self.search_stats, settled, popped, heap_peak)
+        return ele_costs, lengths, next_nodes
+
+    def get_shortest_path(self, G, start, end, algorithm='dijkstra'):
+        """
+        Finds the shortest path between two nodes, disregarding elevation
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param start: (node) The starting point
+        :param end: (node) The end point
+        :param algorithm: ('dijkstra', 'astar' or 'bidirectional') Specifies if the search is guided by the
+                          straight-line distance to end, which it is for 'astar' and 'bidirectional'
+        :return: The shortest path as a list of nodes
+        """
+        rg = RoutingGraph.of(G)
+        start = rg.index_of(start)
+        end = rg.index_of(end)
+        # A contraction hierarchy built by preprocess.py answers the query faster than either search
+        hierarchy = rg.indexes.get('contraction_hierarchy')
+        if hierarchy is not None:
+            return rg.to_osm(hierarchy.shortest_path(start, end, self.search_stats))
+        if algorithm == 'dijkstra':
+            potentials = None
+        elif algorithm in ['astar', 'bidirectional']:
+            potentials = self.get_distance_bounds(rg, end)
+        else:
+            raise Exception("Invalid algorithm specified. Valid algorithms: 'dijkstra', 'astar', 'bidirectional'")
+        return rg.to_osm(rg.shortest_path(start, end, potentials, self.search_stats))
+
+    def get_distance_bounds(self, rg, goal):
+        """
+        Finds a lower bound on the path length from every node to the goal from the straight-line
+        (great circle) distance between the node and the goal, and from the graph's landmarks if it has them
+        :param rg: (RoutingGraph object) The graph representing the map
+        :param goal: (int) The compact id of the end point
+        :return: a list, indexed by compact id, of lower bounds in meters
+        """
+        distances = great_circle_distance(rg.y[goal], rg.x[goal], rg.y, rg.x)
+        # Edge lengths are stored as float32, so leave room for their rounding
+        distances = distances * (1 - 1e-6)
+        # Landmarks picked by preprocess.py usually give much closer bounds along the roads
+        landmarks = rg.indexes.get('landmarks')
+        if landmarks is not None:
+            distances = np.maximum(distances, landmarks.lower_bounds(goal))
+        return distances.tolist()
+
+    def get_distance_bounds_from(self, rg, start):
+        """
+        Finds a lower bound on the path length from the starting point to every node, in the same way as
+        get_distance_bounds
+        :param rg: (RoutingGraph object) The graph representing the map
+        :param start: (int) The compact id of the starting point
+        :return: a list, indexed by compact id, of lower bounds in meters
+        """
+        distances = great_circle_distance(rg.y[start], rg.x[start], rg.y, rg.x) * (1 - 1e-6)
+        landmarks = rg.indexes.get('landmarks')
+        if landmarks is not None:
+            distances = np.maximum(distances, landmarks.lower_bounds_from(start))
+        return distances.tolist()
 
     def get_elevation_cost(self, G, start, end):
         """
-        Gets the elevation cost between two nodes
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        Gets the rise between two nodes: the elevation of end minus the elevation of start, positive uphill
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param start: (node) The starting point
         :param end: (node) The end point 
-        :return: The elevation cost between the two nodes in meters
+        :return: The rise between the two nodes in meters
         """
-        return (G.nodes[start]['elevation'] - G.nodes[end]['elevation'])
+        rg = RoutingGraph.of(G)
+        return float(rg.elevation[rg.index_of(end)]) - float(rg.elevation[rg.index_of(start)])
 
     def get_cost(self, G, start, end):
         """
         Gets the cost of an edge between two nodes in meters
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param start: (node) The starting point
         :param end: (node) The end point 
-        :return: (number) the cost of the edge between start and end in meters
+        :return: (number) the cost of the shortest of the parallel edges between start and end in meters
         """
-        edge = G.edges[start, end, 0]
-        return edge['length']
+        rg = RoutingGraph.of(G)
+        return rg.edge_length(rg.index_of(start), rg.index_of(end))
 
     def get_path_from_prevs(self, prev_nodes, start, goal):
         """
@@ -212,65 +1021,65 @@ class Model(object):
         route = route[::-1]
         return route
 
+    def get_path_from_nexts(self, next_nodes, start, goal):
+        """
+        Finds a path from a list of next nodes
+        :param next_nodes: a list, indexed by nodes, where each index node points to the following node in a path to goal
+        :param start: (node) the starting point of the path
+        :param goal: (node) the goal node of the path
+        :return: the path as a list of nodes
+        """
+        route = [start]
+        while route[-1] != goal:
+            route.append(next_nodes[route[-1]])
+        return route
+
     def get_elevation_stats(self, G, route):
         """
         Gathers statistics regarding elevation about a route
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param route: the route as a list of nodes
         :return: a dictionary containing the net elevation change, total elevation gain, total elevation loss, and total elevation change in meters
         """
         if route is None:
             return 0
-        elevation_stats = {
-            "net_change": 0,
-            "ascents": 0,
-            "descents": 0,
-            "total_change": 0
-        }
-        for i in range(len(route)-1):
-            elevation_change = self.get_elevation_cost(
-                G, route[i], route[i+1])
-            if elevation_change == 0:
-                continue
-            if elevation_change > 0:
-                elevation_stats["ascents"] += elevation_change
-                elevation_stats["total_change"] += elevation_change
-            elif elevation_change < 0:
-                elevation_stats["descents"] += elevation_change
-                elevation_stats["total_change"] += (-elevation_change)
-            elevation_stats["net_change"] += elevation_change
+        return self.elevation_stats_of(route_metrics(G, route))
 
-        return elevation_stats
+    def elevation_stats_of(self, metrics):
+        """
+        Picks the elevation statistics out of the statistics computed by route_metrics
+        :param metrics: (dict) The statistics of a route
+        :return: a dictionary containing the net elevation change, total elevation gain, total elevation loss, and total elevation change in meters
+        """
+        return {key: metrics[key] for key in ["net_change", "ascents", "descents", "total_change"]}
 
     def get_total_length(self, G, route):
         """
         Finds and returns the length of a route, disregarding elevation, in meters
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param route: the route as a list of nodes
         :return: (number) the length of the route in meters
         """
         if route is None or len(route) <= 1:
             return 0
-        cost = 0
-        for i in range(len(route)-1):
-            cost += self.get_cost(G, route[i], route[i+1])
-        return cost
+        return route_metrics(G, route)["length"]
 
     def print_route_stats(self, G, route):
         """
         Prints the statistics about a route, including distance and elevation statistics
-        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
         :param route: the route as a list of nodes
         """
+        metrics = route_metrics(G, route)
         print('Total trip distance: {:,.0f} meters'.format(
-            self.get_total_length(G, route)))
-
-        elevation_stats = self.get_elevation_stats(G, route)
+            metrics["length"]))
         print('Net elevation change: {:,.0f}'.format(
-            elevation_stats["net_change"]))
+            metrics["net_change"]))
         print('Elevation gain (ascents): {:,.0f}'.format(
-            elevation_stats["ascents"]))
+            metrics["ascents"]))
         print('Elevation loss (descents): {:,.0f}'.format(
-            elevation_stats["descents"]))
+            metrics["descents"]))
         print('Total elevation change: {:,.0f}'.format(
-            elevation_stats["total_change"]))
+            metrics["total_change"]))
+        print('Median grade: {:.1f}%, 90th percentile grade: {:.1f}%, steepest grade: {:.1f}%'.format(
+            metrics["grade_p50"], metrics["grade_p90"], metrics["grade_max"]))
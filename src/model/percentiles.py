@@ -0,0 +1,11 @@
+def percentile(values, p):
+    """
+    Finds a percentile of some values with the nearest-rank method
+    :param values: (list) The values, sorted in increasing order
+    :param p: (number) The percentile, between 0 and 100
+    :return: The value, or None if there are no values
+    """
+    if not values:
+        return None
+    rank = max(int(-(-p * len(values) // 100)), 1)
+    return values[rank - 1]
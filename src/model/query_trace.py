@@ -0,0 +1,132 @@
+import json
+import time
+from contextlib import contextmanager
+
+# Search counters that add up over the searches of a stage. "heap_peak", the largest number of entries a
+# search's priority queue held, is kept as the largest over the searches instead
+SEARCH_COUNTERS = ["nodes_settled", "nodes_pushed"]
+
+
+def new_search_stats():
+    """
+    :return: a dictionary of search counters, all at 0, for the searches to add to (see count_search)
+    """
+    return {"nodes_settled": 0, "nodes_pushed": 0, "heap_peak": 0}
+
+
+def count_search(stats, settled, pushed, heap_peak):
+    """
+    Adds the work done by a search to search counters
+    :param stats: (dict) The search counters (see new_search_stats), or None to drop the counts
+    :param settled: (int) The number of nodes or labels the search settled
+    :param pushed: (int) The number of entries the search pushed onto its priority queue
+    :param heap_peak: (int) The largest number of entries its priority queue held
+    """
+    if stats is not None:
+        stats["nodes_settled"] = stats.get("nodes_settled", 0) + settled
+        stats["nodes_pushed"] = stats.get("nodes_pushed", 0) + pushed
+        stats["heap_peak"] = max(stats.get("heap_peak", 0), heap_peak)
+
+
+class QueryTrace(object):
+    """
+    Records the stages of a query (graph load, nearest node snapping, shortest path, optimized search,
+    rendering): the wall time of each, the search counters it used up and whatever the stage adds, such as
+    the length of the path it found. A finished trace can be appended to a JSON lines log, one query per line.
+    """
+
+    def __init__(self, log_file=None, **fields):
+        """
+        :param log_file: (str) Optional path of the JSON lines file the trace is appended to when finished
+        :param fields: Values describing the query, such as its mode and travel type, kept with the trace
+        """
+        self.log_file = log_file
+        self.fields = fields
+        self.stages = []
+        self.started = time.perf_counter()
+        self.total_time = None
+
+    @contextmanager
+    def stage(self, name, stats=None):
+        """
+        Times a stage of the query, as a with block
+        :param name: (str) The name of the stage
+        :param stats: (dict) Optional search counters (see new_search_stats). What the stage adds to them is
+                      recorded with it
+        :return: the stage's record, a dictionary that the block can add values to
+        """
+        record = {"stage": name}
+        if stats is not None:
+            before = {key: stats.get(key, 0) for key in SEARCH_COUNTERS}
+            heap_peak = stats.get("heap_peak", 0)
+            stats["heap_peak"] = 0
+        t = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - t
+            if stats is not None:
+                for key in SEARCH_COUNTERS:
+                    record[key] = stats.get(key, 0) - before[key]
+                record["heap_peak"] = stats.get("heap_peak", 0)
+                stats["heap_peak"] = max(heap_peak, record["heap_peak"])
+            self.stages.append(record)
+
+    def add_stages(self, stages):
+        """
+        Adds stages recorded by another trace, such as one kept in a worker process
+        :param stages: (list) The stage records
+        """
+        self.stages.extend(stages)
+
+    def to_dict(self):
+        """
+        :return: a dictionary with the query's fields, its total time in seconds and the record of each stage
+        """
+        result = dict(self.fields)
+        result["total_time"] = self.total_time if self.total_time is not None else \
+            time.perf_counter() - self.started
+        result["stages"] = self.stages
+        return result
+
+    def finish(self):
+        """
+        Ends the query, appending it to the log file if there is one
+        :return: the trace as a dictionary (see to_dict)
+        """
+        self.total_time = time.perf_counter() - self.started
+        result = self.to_dict()
+        if self.log_file is not None:
+            with open(self.log_file, "a") as outfile:
+                outfile.write(json.dumps(result) + "\n")
+        return result
+
+
+class NullStage(object):
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullTrace(object):
+    """
+    Stands in for a QueryTrace when tracing is off, so the stages of a query cost next to nothing
+    """
+    stage_context = NullStage()
+
+    def stage(self, name, stats=None):
+        return self.stage_context
+
+    def add_stages(self, stages):
+        pass
+
+    def to_dict(self):
+        return None
+
+    def finish(self):
+        return None
+
+
+NULL_TRACE = NullTrace()
@@ -0,0 +1,151 @@
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from routing_graph import RoutingGraph
+
+
+def graph_version(G):
+    """
+    Identifies the contents of a graph, so routes found on one version of a map are not served for another.
+    The version is a hash of the graph's nodes, edges and elevations, worked out once per graph
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :return: (str) The version
+    """
+    def build(rg):
+        digest = hashlib.blake2b(digest_size=16)
+        for array in [rg.osm_ids, rg.elevation, rg.offsets, rg.targets, rg.lengths]:
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+    return RoutingGraph.of(G).get_index('version', build)
+
+
+class RouteCache(object):
+    """
+    Keeps the results of route queries, keyed by the graph version, the snapped start and end nodes, the mode,
+    the algorithm, the time budget and the extra travel rounded down to a bucket. Queries in the same bucket
+    share the route found for the bottom of the bucket, which is within the budget of all of them.
+    When the cache holds more than max_entries results, the least recently used ones are dropped, and results
+    older than the time to live are never returned. With a path, the results are kept in a sqlite database,
+    so they survive restarts and can be shared by processes.
+    """
+
+    def __init__(self, max_entries=10000, ttl=None, path=None, bucket=1):
+        """
+        :param max_entries: (int) The number of results kept
+        :param ttl: (number) Optional number of seconds a result is kept for
+        :param path: (str) Optional path of the sqlite database the results are kept in, in memory if not given
+        :param bucket: (number) The width, in percent, of the extra travel buckets
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS routes "
+                            "(key TEXT PRIMARY KEY, result TEXT, created REAL, used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS routes_used ON routes (used)")
+            self.db.commit()
+
+    def bucket_of(self, extra_travel):
+        """
+        :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel
+        :return: (number) The bottom of the extra travel bucket, which routes for extra_travel are found with
+        """
+        return math.floor(extra_travel / self.bucket + 1e-9) * self.bucket
+
+    def key(self, G, start, end, mode, extra_travel, algorithm='dijkstra', time_budget=None):
+        """
+        :return: (str) The key of a query's result (see Model.compute_route for the parameters)
+        """
+        return json.dumps([graph_version(G), int(start), int(end), mode, self.bucket_of(extra_travel), algorithm,
+                           time_budget])
+
+    def get(self, key):
+        """
+        Gets a cached result
+        :param key: (str) The key of the result (see key)
+        :return: (dictionary) The result, or None if it is not cached or has expired
+        """
+        now = time.time()
+        with self.lock:
+            if self.db is not None:
+                row = self.db.execute("SELECT result, created FROM routes WHERE key = ?", (key,)).fetchone()
+                if row is not None and (self.ttl is None or now - row[1] <= self.ttl):
+                    self.db.execute("UPDATE routes SET used = ? WHERE key = ?", (now, key))
+                    self.db.commit()
+                    self.hits += 1
+                    return json.loads(row[0])
+            else:
+                entry = self.entries.get(key)
+                if entry is not None and (self.ttl is None or now - entry[0] <= self.ttl):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(entry[1])
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """
+        Caches a result, dropping the least recently used and expired ones if the cache is full
+        :param key: (str) The key of the result (see key)
+        :param result: (dictionary) The result, which must be JSON serializable
+        """
+        now = time.time()
+        value = json.dumps(result)
+        with self.lock:
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?)", (key, value, now, now))
+                if self.ttl is not None:
+                    self.db.execute("DELETE FROM routes WHERE created < ?", (now - self.ttl,))
+                self.db.execute("DELETE FROM routes WHERE key IN (SELECT key FROM routes ORDER BY used DESC "
+                                "LIMIT -1 OFFSET ?)", (self.max_entries,))
+                self.db.commit()
+            else:
+                self.entries[key] = (now, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                if self.ttl is not None:
+                    # Entries are in order of use, so expired ones can be anywhere
+                    for old_key in [k for k, (created, _) in self.entries.items() if now - created > self.ttl]:
+                        del self.entries[old_key]
+
+    def __len__(self):
+        with self.lock:
+            if self.db is not None:
+                return self.db.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+            return len(self.entries)
+
+    def stats(self):
+        """
+        :return: a dictionary with the number of cached results and the hit and miss counts
+        """
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        """
+        Drops every cached result
+        """
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM routes")
+                self.db.commit()
+
+    def close(self):
+        """
+        Closes the database the results are kept in, if any
+        """
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
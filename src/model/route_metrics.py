@@ -0,0 +1,104 @@
+import numpy as np
+from routing_graph import RoutingGraph
+
+# Percentiles of the steepness of a route's edges that are reported
+GRADE_PERCENTILES = [50, 90, 99]
+
+
+def route_arrays(G, route):
+    """
+    Gathers the elevation of every node and the length of every edge of a route in one pass
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param route: the route as a list of nodes
+    :return: a (node elevations, edge lengths) pair of float64 arrays
+    """
+    return routes_arrays(G, [route])[0]
+
+
+def routes_arrays(G, routes):
+    """
+    Gathers the node elevations and edge lengths of many routes. The nodes and edges of all the routes are
+    looked up together in the routing graph with a few array operations, so the length of an edge is the
+    length of the shortest of its parallel edges, as used by the routing algorithms
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param routes: a list of routes, each a list of nodes
+    :return: a list with a (node elevations, edge lengths) pair of float64 arrays for each route
+    """
+    G = RoutingGraph.of(G)
+    sizes = [len(route) for route in routes]
+    nodes = G.indexes_of(np.concatenate([np.asarray(route, dtype=np.int64) for route in routes] +
+                                        [np.zeros(0, dtype=np.int64)]))
+    # An edge joins each node to the next one, except where one route ends and the next begins
+    is_edge = np.ones(max(len(nodes) - 1, 0), dtype=bool)
+    route_ends = np.cumsum(sizes)[:-1]
+    is_edge[route_ends[(route_ends > 0) & (route_ends < len(nodes))] - 1] = False
+    edges = G.edge_indexes(nodes[:-1][is_edge], nodes[1:][is_edge])
+
+    elevations = G.elevation[nodes].astype(np.float64)
+    lengths = G.lengths[edges].astype(np.float64)
+    arrays = []
+    node_start = 0
+    edge_start = 0
+    for size in sizes:
+        arrays.append((elevations[node_start:node_start + size],
+                       lengths[edge_start:edge_start + max(size - 1, 0)]))
+        node_start += size
+        edge_start += max(size - 1, 0)
+    return arrays
+
+
+def metrics_from_arrays(elevations, lengths):
+    """
+    Computes the statistics of a route from its node elevations and edge lengths. Sums are accumulated
+    edge by edge in route order, so they match adding the edges up one at a time exactly
+    :param elevations: (float64 array) The elevation of every node of the route
+    :param lengths: (float64 array) The length of every edge of the route
+    :return: a dictionary containing the length, the net elevation change (end minus start), total elevation gain
+             (climbing), total elevation loss (descending, negative) and total elevation change in meters, and
+             percentiles of the grade (steepness) of the edges in percent
+    """
+    # The rise of each edge: positive uphill, negative downhill
+    changes = elevations[1:] - elevations[:-1]
+    grades = np.divide(np.abs(changes), lengths, out=np.zeros_like(changes), where=lengths > 0) * 100
+
+    metrics = {
+        "length": total(lengths),
+        "net_change": total(changes),
+        "ascents": total(np.where(changes > 0, changes, 0.0)),
+        "descents": total(np.where(changes < 0, changes, 0.0)),
+        "total_change": total(np.abs(changes))
+    }
+    for p in GRADE_PERCENTILES:
+        metrics["grade_p" + str(p)] = float(np.percentile(grades, p)) if len(grades) != 0 else 0.0
+    metrics["grade_max"] = float(np.max(grades)) if len(grades) != 0 else 0.0
+    return metrics
+
+
+def total(values):
+    """
+    Adds up values in order, as cumsum does, rather than pairwise as sum does
+    :return: (float) The total, 0 for no values
+    """
+    if len(values) == 0:
+        return 0.0
+    return float(np.cumsum(values)[-1])
+
+
+def route_metrics(G, route):
+    """
+    Computes the statistics of a route
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param route: the route as a list of nodes
+    :return: a dictionary of statistics (see metrics_from_arrays)
+    """
+    return metrics_from_arrays(*route_arrays(G, route))
+
+
+def routes_metrics(G, routes):
+    """
+    Computes the statistics of many routes at once
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param routes: a list of routes, each a list of nodes
+    :return: a list with a dictionary of statistics (see metrics_from_arrays) for each route
+    """
+    return [metrics_from_arrays(elevations, lengths) for elevations, lengths in routes_arrays(G, routes)]
@@ -0,0 +1,120 @@
+import time
+from model import Model
+from route_metrics import routes_metrics
+from query_trace import new_search_stats, NULL_TRACE
+
+
+class RouteSession(object):
+    """
+    Keeps the work done for a query between two snapped nodes, so asking again with another extra travel
+    percentage does not start over. The shortest path and its statistics are found once, and so are the searches
+    from and towards the ends that do not depend on the length budget, so a new budget only runs the search
+    that does. The routes found are kept too: the route with the least elevation gain within a budget is also
+    the best within any smaller budget it fits in, so those are answered without searching.
+    """
+
+    def __init__(self, G, start, end, mode, algorithm='dijkstra', time_budget=None, route_cache=None):
+        """
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param start: (node) The starting point
+        :param end: (node) The end point
+        :param mode: ('maximize' or 'mimimize') Specifies if the route should maximize or minimize elevation
+        :param algorithm: ('dijkstra', 'astar' or 'bidirectional') Specifies how the searches find their bounds
+                          (see Model.min_ele)
+        :param time_budget: (number) Optional time in seconds the maximize search may take (see max_ele_anytime)
+        :param route_cache: (RouteCache object) Optional cache of the routes found, checked before the kept routes
+                            and shared with Model.compute_route
+        """
+        if mode not in ['minimize', 'maximize']:
+            raise Exception("Invalid mode specified. Valid modes: 'minimize', 'maximize'")
+        self.G = G
+        self.start = start
+        self.end = end
+        self.mode = mode
+        self.algorithm = algorithm
+        self.time_budget = time_budget
+        self.model = Model(route_cache)
+        self.model.kept_searches = {}
+        self.shortest_path = None
+        self.shortest_path_length = None
+        self.shortest_metrics = None
+        # The (budget, route, route length) of every route found
+        self.routes = []
+
+    def compute_route(self, extra_travel, trace=NULL_TRACE):
+        """
+        Finds a path with elevation maximized or minimized within a length budget, reusing the work of the
+        earlier queries of the session
+        :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel.
+        :param trace: (QueryTrace object) Optional trace the searches are recorded in. The shortest path stage is
+                      only recorded for the first query
+        :return: a dictionary holding the same statistics as Model.compute_route returns, counting only the work
+                 done for this query, and whether the route was found without searching again ("resumed")
+        """
+        model = self.model
+        if model.route_cache is not None:
+            (key, result) = model.get_cached_route(self.G, self.start, self.end, extra_travel, self.mode,
+                                                   self.algorithm, self.time_budget, trace)
+            if result is not None:
+                result["resumed"] = False
+                return result
+            # As in Model.compute_route, the route is found for the bottom of the extra travel bucket
+            extra_travel = model.route_cache.bucket_of(extra_travel)
+
+        model.search_stats = new_search_stats()
+        if self.shortest_path is None:
+            with trace.stage("shortest_path", model.search_stats) as record:
+                self.shortest_path = model.get_shortest_path(self.G, self.start, self.end, self.algorithm)
+                self.shortest_metrics = routes_metrics(self.G, [self.shortest_path])[0]
+                self.shortest_path_length = self.shortest_metrics["length"]
+                record["path_nodes"] = len(self.shortest_path)
+                record["path_length"] = self.shortest_path_length
+        can_travel = ((100.0 + extra_travel)*self.shortest_path_length)/100.0
+
+        with trace.stage("optimized_search", model.search_stats) as record:
+            t = time.time()
+            (optimized_route, resumed) = self.get_op_route(can_travel)
+            solver_time = time.time() - t
+            record["path_nodes"] = len(optimized_route)
+            record["resumed"] = resumed
+
+        metrics = routes_metrics(self.G, [optimized_route])[0]
+        record["path_length"] = metrics["length"]
+        result = {
+            "route": optimized_route,
+            "length": metrics["length"],
+            "elevation_stats": model.elevation_stats_of(metrics),
+            "shortest_path": self.shortest_path,
+            "shortest_length": self.shortest_path_length,
+            "shortest_elevation_stats": model.elevation_stats_of(self.shortest_metrics),
+            "can_travel": can_travel,
+            "solver_time": solver_time,
+            "nodes_settled": model.search_stats["nodes_settled"],
+            "nodes_pushed": model.search_stats["nodes_pushed"],
+            "heap_peak": model.search_stats["heap_peak"],
+            "cached": False,
+            "resumed": resumed
+        }
+        if "anytime" in model.search_stats:
+            result["anytime"] = model.search_stats["anytime"]
+        if model.route_cache is not None:
+            model.route_cache.put(key, result)
+        return result
+
+    def get_op_route(self, can_travel):
+        """
+        Finds the optimized route for a length budget, from the kept routes when possible
+        :param can_travel: (number) The maximum langth a valid path is allowed to have in meters
+        :return: a (route, whether it was found without searching) pair
+        """
+        for (budget, route, length) in self.routes:
+            # Maximize routes are found greedily, so they are only known to be the answer for their own budget
+            if budget == can_travel or (self.mode == 'minimize' and length <= can_travel <= budget):
+                return route, True
+
+        route = self.model.get_op_route(self.G, self.start, self.end, can_travel, self.mode, self.algorithm,
+                                        self.time_budget)
+        # Routes found within a time budget depend on how far the search got, so they are not kept
+        if self.mode == 'minimize' or self.time_budget is None:
+            self.routes.append((can_travel, route, self.model.get_total_length(self.G, route)))
+        return route, False
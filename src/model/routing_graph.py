@@ -0,0 +1,456 @@
+import mmap
+import struct
+import weakref
+import zlib
+from heapq import *
+import numpy as np
+from query_trace import count_search
+
+# Layout of the compiled graph file: a header, a table describing each array, then the arrays themselves
+GRAPH_FILE_MAGIC = b'ELENARG1'
+GRAPH_FILE_HEADER = struct.Struct('<8sII')
+GRAPH_FILE_SECTION = struct.Struct('<16s4sQQ')
+
+# Routing graphs already built from networkx graphs, so a graph is only converted once
+_converted_graphs = weakref.WeakKeyDictionary()
+
+
+def save_arrays(path, arrays):
+    """
+    Saves named arrays as a flat binary file that load_arrays can memory-map
+    :param path: (str) The path of the file
+    :param arrays: (list) The (name, numpy array) pairs to save. Names are at most 16 bytes long
+    """
+    # Arrays start on 8 byte boundaries so they can be read in place
+    offset = GRAPH_FILE_HEADER.size + len(arrays) * GRAPH_FILE_SECTION.size
+    sections = []
+    for name, array in arrays:
+        offset += -offset % 8
+        sections.append((name, array, offset))
+        offset += array.nbytes
+
+    with open(path, 'wb') as outfile:
+        outfile.write(GRAPH_FILE_HEADER.pack(GRAPH_FILE_MAGIC, 1, len(arrays)))
+        for name, array, offset in sections:
+            outfile.write(GRAPH_FILE_SECTION.pack(name.encode(), array.dtype.str.encode(), offset, len(array)))
+        for name, array, offset in sections:
+            outfile.write(b'\0' * (offset - outfile.tell()))
+            outfile.write(np.ascontiguousarray(array).tobytes())
+
+
+def load_arrays(path):
+    """
+    Loads the arrays saved with save_arrays. They are memory-mapped read-only, so loading is nearly
+    instant and processes loading the same file share its pages
+    :param path: (str) The path of the file
+    :return: a dictionary of the arrays by name
+    """
+    with open(path, 'rb') as infile:
+        buf = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, n_sections = GRAPH_FILE_HEADER.unpack_from(buf, 0)
+    if magic != GRAPH_FILE_MAGIC:
+        raise ValueError("{} is not a compiled graph file".format(path))
+
+    arrays = {}
+    for i in range(n_sections):
+        name, dtype, offset, count = GRAPH_FILE_SECTION.unpack_from(
+            buf, GRAPH_FILE_HEADER.size + i * GRAPH_FILE_SECTION.size)
+        arrays[name.rstrip(b'\0').decode()] = np.frombuffer(
+            buf, dtype=np.dtype(dtype.rstrip(b'\0').decode()), count=count, offset=offset)
+    return arrays
+
+
+def check_elevation(osm_ids, elevation):
+    """
+    Makes sure every node has an elevation, as the routing algorithms cannot do without it
+    :param osm_ids: (int64 array) The OSM id of every node
+    :param elevation: (float32 array) The elevation of every node, NaN where it is missing
+    """
+    missing = np.isnan(elevation)
+    if np.any(missing):
+        raise ValueError("{} of {} nodes have no elevation, for example node {}. Add elevations to the graph "
+                         "(osmnx.add_node_elevations) before routing on it".format(
+                             int(np.sum(missing)), len(elevation), int(osm_ids[np.argmax(missing)])))
+
+
+class RoutingGraph(object):
+    """
+    Compact, array-backed (CSR) version of an OSMnx MultiDiGraph used by the routing algorithms.
+    Nodes are numbered 0..n-1 in increasing order of their OSM id. The outgoing edges of node i are
+    targets[offsets[i]:offsets[i+1]], with matching entries in lengths, keys, rises, gains and grades.
+    Parallel edges are collapsed: each edge is the shortest of the edges between its two nodes, and its key
+    is the key of that edge in the MultiDiGraph.
+    The rise of an edge is the elevation of its end minus the elevation of its start, so it is positive
+    going uphill; its gain is the rise counted only when positive, and its grade is the rise over the length.
+    """
+
+    def __init__(self, osm_ids, x, y, elevation, offsets, targets, lengths, rises=None, keys=None, gains=None,
+                 grades=None):
+        """
+        :param osm_ids: (int64 array) The sorted OSM id of every node
+        :param x: (float64 array) The longitude of every node
+        :param y: (float64 array) The latitude of every node
+        :param elevation: (float32 array) The elevation of every node in meters
+        :param offsets: (int64 array) The CSR row offsets, of length number of nodes + 1
+        :param targets: (int32 array) The end node of every edge
+        :param lengths: (float32 array) The length of every edge in meters
+        :param rises: (float64 array) Optional rise of every edge in meters, computed from elevation if not
+                      given. A reversed graph passes the rises of the edges it reverses
+        :param keys: (int32 array) Optional MultiDiGraph key of every edge, 0 if not given
+        :param gains: (float64 array) Optional gain of every edge, computed from rises if not given
+        :param grades: (float32 array) Optional grade of every edge, computed from rises and lengths if not given
+        """
+        self.osm_ids = osm_ids
+        self.x = x
+        self.y = y
+        self.elevation = elevation
+        self.offsets = offsets
+        self.targets = targets
+        self.lengths = lengths
+        self.keys = keys if keys is not None else np.zeros(len(targets), dtype=np.int32)
+        if rises is None:
+            sources = np.repeat(np.arange(len(osm_ids), dtype=np.int64), np.diff(offsets))
+            rises = elevation[targets].astype(np.float64) - elevation[sources].astype(np.float64)
+        self.rises = rises
+        self.gains = gains if gains is not None else np.maximum(rises, 0)
+        if grades is None:
+            grades = np.divide(rises, lengths, out=np.zeros(len(rises)), where=lengths > 0).astype(np.float32)
+        self.grades = grades
+        self.reverse_graph = None
+        # Structures derived from the graph (spatial index, ...), built on first use by get_index
+        self.indexes = {}
+
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Builds a routing graph from a networkx graph
+        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :return: (RoutingGraph) The compact version of G
+        """
+        osm_ids = np.array(sorted(G.nodes), dtype=np.int64)
+        node_index = {osm_id: i for i, osm_id in enumerate(osm_ids.tolist())}
+
+        x = np.empty(len(osm_ids), dtype=np.float64)
+        y = np.empty(len(osm_ids), dtype=np.float64)
+        elevation = np.empty(len(osm_ids), dtype=np.float32)
+        offsets = np.zeros(len(osm_ids) + 1, dtype=np.int64)
+        targets = []
+        lengths = []
+        keys = []
+        for i, osm_id in enumerate(osm_ids.tolist()):
+            data = G.nodes[osm_id]
+            x[i] = data['x']
+            y[i] = data['y']
+            elevation[i] = data.get('elevation', np.nan)
+            # Parallel edges are collapsed, keeping the shortest one, like networkx's shortest path functions do
+            for nbr, parallel_edges in G[osm_id].items():
+                (key, length) = min(((key, data['length']) for key, data in parallel_edges.items()),
+                                    key=lambda edge: edge[1])
+                targets.append(node_index[nbr])
+                lengths.append(length)
+                keys.append(key)
+            offsets[i + 1] = len(targets)
+
+        check_elevation(osm_ids, elevation)
+        return cls(osm_ids, x, y, elevation, offsets,
+                   np.array(targets, dtype=np.int32), np.array(lengths, dtype=np.float32),
+                   keys=np.array(keys, dtype=np.int32))
+
+    @classmethod
+    def of(cls, G):
+        """
+        Gets the routing graph for a graph, converting and remembering it the first time a networkx graph is seen
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :return: (RoutingGraph) The routing graph for G
+        """
+        if isinstance(G, RoutingGraph):
+            return G
+        rg = _converted_graphs.get(G)
+        if rg is None:
+            rg = cls.from_networkx(G)
+            _converted_graphs[G] = rg
+        return rg
+
+    @classmethod
+    def converted(cls, G):
+        """
+        Gets the routing graph already built for a graph, without converting it
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :return: (RoutingGraph) The routing graph for G, or None if G has not been converted yet
+        """
+        if isinstance(G, RoutingGraph):
+            return G
+        return _converted_graphs.get(G)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a routing graph saved with save. The arrays are memory-mapped read-only, so loading is
+        nearly instant and processes loading the same file share its pages
+        :param path: (str) The path of the compiled graph file
+        :return: (RoutingGraph) The loaded graph
+        """
+        arrays = load_arrays(path)
+        check_elevation(arrays['osm_ids'], arrays['elevation'])
+        rg = cls(arrays['osm_ids'], arrays['x'], arrays['y'], arrays['elevation'],
+                 arrays['offsets'], arrays['targets'], arrays['lengths'], arrays.get('rises'), arrays.get('keys'),
+                 arrays.get('gains'), arrays.get('grades'))
+        # Files compiled before rises, gains and grades were stored get them computed, and the reversed graph
+        # rebuilt, on first use
+        if 'reverse_rises' in arrays:
+            rg.reverse_graph = cls(arrays['osm_ids'], arrays['x'], arrays['y'], arrays['elevation'],
+                                   arrays['reverse_offsets'], arrays['reverse_targets'], arrays['reverse_lengths'],
+                                   arrays['reverse_rises'], arrays.get('reverse_keys'), arrays.get('reverse_gains'),
+                                   arrays.get('reverse_grades'))
+            rg.reverse_graph.reverse_graph = rg
+        return rg
+
+    def save(self, path):
+        """
+        Saves the graph, and its reversed graph, as a flat binary file that load can memory-map
+        :param path: (str) The path of the compiled graph file
+        """
+        reverse_graph = self.reverse()
+        arrays = [('osm_ids', self.osm_ids), ('x', self.x), ('y', self.y), ('elevation', self.elevation),
+                  ('offsets', self.offsets), ('targets', self.targets), ('lengths', self.lengths),
+                  ('rises', self.rises), ('keys', self.keys), ('gains', self.gains), ('grades', self.grades),
+                  ('reverse_offsets', reverse_graph.offsets), ('reverse_targets', reverse_graph.targets),
+                  ('reverse_lengths', reverse_graph.lengths), ('reverse_rises', reverse_graph.rises),
+                  ('reverse_keys', reverse_graph.keys), ('reverse_gains', reverse_graph.gains),
+                  ('reverse_grades', reverse_graph.grades)]
+
+        save_arrays(path, arrays)
+
+    def number_of_nodes(self):
+        return len(self.osm_ids)
+
+    def number_of_edges(self):
+        return len(self.targets)
+
+    def index_of(self, osm_id):
+        """
+        Gets the compact id of a node
+        :param osm_id: (node) The OSM id of the node
+        :return: (int) The compact id of the node
+        """
+        i = int(np.searchsorted(self.osm_ids, osm_id))
+        if i == len(self.osm_ids) or self.osm_ids[i] != osm_id:
+            raise KeyError(osm_id)
+        return i
+
+    def indexes_of(self, osm_ids):
+        """
+        Gets the compact ids of many nodes at once
+        :param osm_ids: (list) The OSM ids of the nodes
+        :return: (int64 array) The compact ids of the nodes
+        """
+        osm_ids = np.asarray(osm_ids, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.osm_ids, osm_ids), len(self.osm_ids) - 1)
+        missing = self.osm_ids[found] != osm_ids
+        if np.any(missing):
+            raise KeyError(int(osm_ids[np.argmax(missing)]))
+        return found
+
+    def to_osm(self, path):
+        """
+        Converts a path of compact ids to a path of OSM ids
+        :param path: a list of compact node ids
+        :return: the path as a list of OSM node ids
+        """
+        return self.osm_ids[np.asarray(path, dtype=np.int64)].tolist()
+
+    def from_osm(self, route):
+        """
+        Converts a route of OSM ids to a path of compact ids
+        :param route: the route as a list of OSM node ids
+        :return: the path as a list of compact node ids
+        """
+        return [self.index_of(n) for n in route]
+
+    def neighbors(self, node):
+        """
+        :param node: (int) The compact id of a node
+        :return: a list of the compact ids of the nodes reachable over one edge
+        """
+        return self.targets[self.offsets[node]:self.offsets[node + 1]].tolist()
+
+    def edges(self, node):
+        """
+        :param node: (int) The compact id of a node
+        :return: a list of (end node, length) pairs for the outgoing edges of node
+        """
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return list(zip(self.targets[start:end].tolist(), self.lengths[start:end].tolist()))
+
+    def edge_gains(self, node):
+        """
+        :param node: (int) The compact id of a node
+        :return: a list of (end node, length, gain) triples for the outgoing edges of node. On a reversed graph,
+                 the gain is that of the edge of the original graph, from the end node to node
+        """
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return list(zip(self.targets[start:end].tolist(), self.lengths[start:end].tolist(),
+                        self.gains[start:end].tolist()))
+
+    def edge_length(self, start, end):
+        """
+        Gets the length of the edge between two nodes
+        :param start: (int) The compact id of the starting node
+        :param end: (int) The compact id of the end node
+        :return: (number) the length of the edge in meters
+        """
+        for nbr, length in self.edges(start):
+            if nbr == end:
+                return length
+        raise KeyError((start, end))
+
+    def edge_key(self, start, end):
+        """
+        Gets the key, in the networkx graph, of the edge between two nodes
+        :param start: (int) The compact id of the starting node
+        :param end: (int) The compact id of the end node
+        :return: (int) the key of the shortest of the parallel edges between the two nodes
+        """
+        return int(self.keys[self.edge_indexes([start], [end])[0]])
+
+    def edge_indexes(self, starts, ends):
+        """
+        Finds the positions of many edges in the edge arrays at once
+        :param starts: (int array) The compact ids of the starting nodes
+        :param ends: (int array) The compact ids of the end nodes
+        :return: (int64 array) The index of each edge in targets and lengths
+        """
+        n = self.number_of_nodes()
+        (keys, order) = self.get_index('edge_keys', RoutingGraph.build_edge_keys)
+        wanted = np.asarray(starts, dtype=np.int64) * n + np.asarray(ends, dtype=np.int64)
+        found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        if len(wanted) != 0 and (len(keys) == 0 or np.any(keys[found] != wanted)):
+            missing = int(np.argmax(keys[found] != wanted)) if len(keys) != 0 else 0
+            raise KeyError((int(wanted[missing] // n), int(wanted[missing] % n)))
+        return order[found]
+
+    def build_edge_keys(self):
+        """
+        Builds the lookup used by edge_indexes: every edge numbered start * number of nodes + end, sorted
+        :return: a (sorted edge numbers, edge index of each) pair of arrays
+        """
+        sources = np.repeat(np.arange(self.number_of_nodes(), dtype=np.int64), np.diff(self.offsets))
+        keys = sources * self.number_of_nodes() + self.targets
+        order = np.argsort(keys, kind='stable')
+        return (keys[order], order)
+
+    def reverse(self):
+        """
+        Gets the graph with every edge reversed, building it on first use
+        :return: (RoutingGraph) The reversed graph
+        """
+        if self.reverse_graph is None:
+            sources = np.repeat(np.arange(self.number_of_nodes(), dtype=np.int32), np.diff(self.offsets))
+            order = np.argsort(self.targets, kind='stable')
+            offsets = np.zeros(self.number_of_nodes() + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(self.targets, minlength=self.number_of_nodes()))
+            self.reverse_graph = RoutingGraph(self.osm_ids, self.x, self.y, self.elevation, offsets,
+                                              sources[order], self.lengths[order], self.rises[order],
+                                              self.keys[order], self.gains[order], self.grades[order])
+            self.reverse_graph.reverse_graph = self
+        return self.reverse_graph
+
+    def graph_shape(self):
+        """
+        Gets the number of nodes and edges of the graph and a checksum of its nodes and edges. Structures built
+        offline for a graph keep it, to check that they are loaded with the same graph
+        :return: (int64 array) The number of nodes, the number of edges and the checksum
+        """
+        def build(rg):
+            checksum = 0
+            for a in (rg.osm_ids, rg.offsets, rg.targets, rg.lengths):
+                checksum = zlib.crc32(np.ascontiguousarray(a), checksum)
+            return np.array([rg.number_of_nodes(), rg.number_of_edges(), checksum], dtype=np.int64)
+        return self.get_index('graph_shape', build)
+
+    def get_index(self, name, build):
+        """
+        Gets a structure derived from the graph, building and keeping it the first time it is asked for
+        :param name: (str) The name of the index
+        :param build: (function) Called with the graph to build the index if it does not exist yet
+        :return: The index
+        """
+        if name not in self.indexes:
+            self.indexes[name] = build(self)
+        return self.indexes[name]
+
+    def dijkstra(self, source, target=None, potentials=None, stats=None):
+        """
+        Finds shortest path lengths from a node with Dijkstra's algorithm, or with A* when potentials are given
+        :param source: (int) The compact id of the starting node
+        :param target: (int) Optional compact id of a node at which the search can stop
+        :param potentials: (list) Optional lower bounds, indexed by compact id, on the length from each node to
+                           target. They must be consistent (never drop by more than an edge's length along it)
+        :param stats: (dict) Optional search counters the search's work is added to (see query_trace.count_search)
+        :return: a (distances, previous nodes) pair of lists indexed by compact id. Unreachable nodes have
+                 an infinite distance and a previous node of -1. With a target, only the distances of settled
+                 nodes are final
+        """
+        dist = [float('inf')] * self.number_of_nodes()
+        prev_nodes = [-1] * self.number_of_nodes()
+        dist[source] = 0
+        frontier = [(0 if potentials is None else potentials[source], 0, source)]
+        settled = 0
+        stale = 0
+        heap_peak = 1
+        while len(frontier) != 0:
+            (key, d, curr_node) = heappop(frontier)
+            if d > dist[curr_node]:
+                stale += 1
+                continue
+            settled += 1
+            if curr_node == target:
+                break
+            for nbr, length in self.edges(curr_node):
+                new_dist = d + length
+                if new_dist < dist[nbr]:
+                    dist[nbr] = new_dist
+                    prev_nodes[nbr] = curr_node
+                    heappush(frontier, (new_dist if potentials is None else new_dist + potentials[nbr], new_dist, nbr))
+            # The queue only grows while a node is expanded, so its peak is found without looking at every push
+            if len(frontier) > heap_peak:
+                heap_peak = len(frontier)
+        # Every entry pushed was either popped, as a settled or stale entry, or is still queued
+        count_search(stats, settled, settled + stale + len(frontier), heap_peak)
+        return dist, prev_nodes
+
+    def shortest_path(self, source, target, potentials=None, stats=None):
+        """
+        Finds the shortest path, by length, between two nodes
+        :param source: (int) The compact id of the starting node
+        :param target: (int) The compact id of the end node
+        :param potentials: (list) Optional lower bounds on the length to target, which turn the search into A*
+        :param stats: (dict) Optional search counters (see dijkstra)
+        :return: the path as a list of compact node ids
+        """
+        dist, prev_nodes = self.dijkstra(source, target, potentials, stats)
+        if dist[target] == float('inf'):
+            raise ValueError("No path between {} and {}".format(self.osm_ids[source], self.osm_ids[target]))
+        path = [target]
+        while path[-1] != source:
+            path.append(prev_nodes[path[-1]])
+        return path[::-1]
+
+    def memory_usage(self):
+        """
+        :return: (int) The number of bytes used by the graph's arrays, its reversed graph and its indexes
+        """
+        total = sum(a.nbytes for a in (self.osm_ids, self.x, self.y, self.elevation, self.offsets,
+                                       self.targets, self.lengths, self.keys, self.rises, self.gains,
+                                       self.grades))
+        if self.reverse_graph is not None:
+            total += sum(a.nbytes for a in (self.reverse_graph.offsets, self.reverse_graph.targets,
+                                            self.reverse_graph.lengths, self.reverse_graph.keys,
+                                            self.reverse_graph.rises,
+                                            self.reverse_graph.gains, self.reverse_graph.grades))
+        for index in self.indexes.values():
+            if hasattr(index, 'memory_usage'):
+                total += index.memory_usage()
+            elif isinstance(index, tuple):
+                total += sum(a.nbytes for a in index if isinstance(a, np.ndarray))
+        return total
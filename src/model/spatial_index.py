@@ -0,0 +1,202 @@
+import math
+import numpy as np
+from routing_graph import RoutingGraph
+
+EARTH_RADIUS = 6371009
+# Average number of nodes in a grid cell
+NODES_PER_CELL = 4
+
+
+def great_circle_distance(lat1, lon1, lat2, lon2):
+    """
+    Finds the great circle distance between points, accepting numbers or numpy arrays
+    :return: The distance in meters
+    """
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+class SpatialIndex(object):
+    """
+    Uniform grid over the nodes of a graph for finding the node nearest to a point. Nodes are
+    projected to meters around the graph's mean latitude and bucketed into square cells, and a query
+    only looks at the block of cells around the point that can still hold a closer node.
+    """
+
+    def __init__(self, rg):
+        """
+        :param rg: (RoutingGraph object) The graph to index
+        """
+        self.rg = rg
+        lat0 = math.radians(float(np.mean(rg.y)))
+        self.min_x = float(np.min(rg.x))
+        self.min_y = float(np.min(rg.y))
+        self.meters_per_lon = EARTH_RADIUS * math.cos(lat0) * math.pi / 180
+        self.meters_per_lat = EARTH_RADIUS * math.pi / 180
+
+        # Projected distances can be up to this many times the great circle distance across the graph
+        lat_max = math.radians(float(np.max(np.abs(rg.y))))
+        self.slack = max(math.cos(lat0) / max(math.cos(lat_max), 1e-6), 1.0) * 1.001
+
+        px, py = self.project(rg.y, rg.x)
+        area = max(float(np.max(px)) * float(np.max(py)), 1.0)
+        self.cell_size = max(math.sqrt(area * NODES_PER_CELL / len(rg.osm_ids)), 1.0)
+        self.cols = int(np.max(px) // self.cell_size) + 1
+        self.rows = int(np.max(py) // self.cell_size) + 1
+
+        cells = (py // self.cell_size).astype(np.int64) * self.cols + (px // self.cell_size).astype(np.int64)
+        self.cell_nodes = np.argsort(cells, kind='stable').astype(np.int32)
+        self.cell_offsets = np.zeros(self.rows * self.cols + 1, dtype=np.int64)
+        self.cell_offsets[1:] = np.cumsum(np.bincount(cells, minlength=self.rows * self.cols))
+
+    @classmethod
+    def of(cls, G):
+        """
+        Gets the spatial index of a graph, building it the first time it is asked for
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :return: (SpatialIndex) The index
+        """
+        return RoutingGraph.of(G).get_index('spatial', cls)
+
+    def project(self, lat, lon):
+        """
+        Projects points to meters east and north of the south-west corner of the graph
+        :return: a (x, y) pair
+        """
+        return ((np.asarray(lon) - self.min_x) * self.meters_per_lon,
+                (np.asarray(lat) - self.min_y) * self.meters_per_lat)
+
+    def nearest_node(self, lat, lon, max_distance=None):
+        """
+        Finds the node closest to a point
+        :param lat: (number) The latitude of the point
+        :param lon: (number) The longitude of the point
+        :param max_distance: (number) Optional largest distance, in meters, a point may be snapped over
+        :return: (node) The OSM id of the nearest node, or None if there is no node within max_distance
+        """
+        (node, distance) = self.nearest(lat, lon, max_distance)
+        if node is None:
+            return None
+        return int(self.rg.osm_ids[node])
+
+    def nearest_nodes(self, lats, lons, max_distance=None):
+        """
+        Finds the node closest to each of many points. This is the search of nearest, run for all the points at
+        once: every round looks at the blocks of cells around all the points not settled yet with numpy, and
+        doubles the size of the blocks for the next round
+        :param lats: (list) The latitudes of the points
+        :param lons: (list) The longitudes of the points
+        :param max_distance: (number) Optional largest distance, in meters, a point may be snapped over
+        :return: a list of the OSM ids of the nearest nodes, with None for points that have no node within max_distance
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        (px, py) = self.project(lats, lons)
+        cols = np.clip(px // self.cell_size, 0, self.cols - 1).astype(np.int64)
+        rows = np.clip(py // self.cell_size, 0, self.rows - 1).astype(np.int64)
+        nodes = np.full(len(lats), -1, dtype=np.int64)
+        distances = np.full(len(lats), np.inf)
+
+        # The points whose nearest node may still be outside the block of cells looked at
+        pending = np.arange(len(lats))
+        r = 1
+        while len(pending) != 0:
+            (points, candidates) = self.blocks_nodes(rows[pending], cols[pending], r)
+            candidate_distances = great_circle_distance(lats[pending][points], lons[pending][points],
+                                                        self.rg.y[candidates], self.rg.x[candidates])
+            # The nearest candidate of each point, the first one in its block on ties as in nearest
+            best_distances = np.full(len(pending), np.inf)
+            np.minimum.at(best_distances, points, candidate_distances)
+            nearest = np.flatnonzero(candidate_distances == best_distances[points])
+            first = np.full(len(pending), len(candidates))
+            np.minimum.at(first, points[nearest], nearest)
+            best_nodes = np.full(len(pending), -1, dtype=np.int64)
+            found = first < len(candidates)
+            best_nodes[found] = candidates[first[found]]
+
+            done = (best_distances * self.slack <= r * self.cell_size) | (r >= max(self.rows, self.cols))
+            nodes[pending[done]] = best_nodes[done]
+            distances[pending[done]] = best_distances[done]
+            if max_distance is not None and max_distance * self.slack < r * self.cell_size:
+                break
+            pending = pending[~done]
+            r *= 2
+
+        if max_distance is not None:
+            nodes[distances > max_distance] = -1
+        return [int(self.rg.osm_ids[node]) if node >= 0 else None for node in nodes.tolist()]
+
+    def nearest(self, lat, lon, max_distance=None):
+        """
+        Finds the node closest to a point
+        :return: a (compact node id, distance in meters) pair, or (None, None) if there is no node within max_distance
+        """
+        (px, py) = self.project(lat, lon)
+        col = min(max(int(px // self.cell_size), 0), self.cols - 1)
+        row = min(max(int(py // self.cell_size), 0), self.rows - 1)
+
+        # Look at the block of cells within r cells of the point, doubling r until the nearest node found
+        # is closer than anything outside the block could be
+        r = 1
+        while True:
+            candidates = self.block_nodes(row, col, r)
+            if len(candidates) != 0:
+                distances = great_circle_distance(lat, lon, self.rg.y[candidates], self.rg.x[candidates])
+                i = int(np.argmin(distances))
+                (best_node, best_distance) = (int(candidates[i]), float(distances[i]))
+                if best_distance * self.slack <= r * self.cell_size or r >= max(self.rows, self.cols):
+                    break
+            elif r >= max(self.rows, self.cols):
+                return (None, None)
+            if max_distance is not None and max_distance * self.slack < r * self.cell_size:
+                return (None, None)
+            r *= 2
+
+        if max_distance is not None and best_distance > max_distance:
+            return (None, None)
+        return (best_node, best_distance)
+
+    def block_nodes(self, row, col, r):
+        """
+        Gets the nodes in the cells at most r cells away from a cell in both directions
+        :return: (int32 array) The compact ids of the nodes
+        """
+        first_col = max(col - r, 0)
+        last_col = min(col + r, self.cols - 1)
+        # The cells of one grid row are contiguous, so each row of the block is one slice
+        slices = []
+        for i in range(max(row - r, 0), min(row + r, self.rows - 1) + 1):
+            start = self.cell_offsets[i * self.cols + first_col]
+            end = self.cell_offsets[i * self.cols + last_col + 1]
+            slices.append(self.cell_nodes[start:end])
+        return np.concatenate(slices)
+
+    def blocks_nodes(self, rows, cols, r):
+        """
+        Gets the nodes in the cells at most r cells away from each of many cells in both directions
+        :param rows: (int64 array) The row of each cell
+        :param cols: (int64 array) The column of each cell
+        :param r: (int) The number of cells the blocks reach out
+        :return: a (cell positions, compact node ids) pair of arrays, with an entry for every node of every block
+        """
+        first_cols = np.maximum(cols - r, 0)
+        last_cols = np.minimum(cols + r, self.cols - 1)
+        (points, starts, ends) = ([], [], [])
+        # The cells of one grid row are contiguous, so each row of a block is one slice
+        for dr in range(-r, r + 1):
+            block_rows = rows + dr
+            inside = np.flatnonzero((block_rows >= 0) & (block_rows < self.rows))
+            points.append(inside)
+            starts.append(self.cell_offsets[block_rows[inside] * self.cols + first_cols[inside]])
+            ends.append(self.cell_offsets[block_rows[inside] * self.cols + last_cols[inside] + 1])
+        (points, starts, ends) = (np.concatenate(points), np.concatenate(starts), np.concatenate(ends))
+        counts = ends - starts
+        positions = np.arange(int(counts.sum())) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return np.repeat(points, counts), self.cell_nodes[positions].astype(np.int64)
+
+    def memory_usage(self):
+        """
+        :return: (int) The number of bytes used by the index's arrays
+        """
+        return self.cell_nodes.nbytes + self.cell_offsets.nbytes
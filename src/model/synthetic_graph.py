@@ -0,0 +1,178 @@
+import math
+import numpy as np
+import networkx as nx
+from routing_graph import RoutingGraph
+from spatial_index import EARTH_RADIUS
+
+# Synthetic maps are laid out around Amherst, so coordinates look like the real graphs
+ORIGIN_LAT = 42.3732
+ORIGIN_LONG = -72.5199
+GRAPH_KINDS = ["grid", "geometric", "street"]
+# Street-like graphs are grids with moved intersections, missing blocks, one-way streets and winding roads
+STREET_JITTER = 0.3
+STREET_DROP = 0.1
+STREET_ONEWAY = 0.05
+STREET_CURVATURE = 0.2
+# Average number of neighbors of a node in a random geometric graph
+GEOMETRIC_DEGREE = 6
+# Number of hills and valleys the terrain is made of
+TERRAIN_FEATURES = 24
+
+
+def grid_edges(side, rand, drop=0.0):
+    """
+    Finds the edges of a square grid, numbering nodes row by row
+    :param side: (int) The number of nodes along each side
+    :param rand: (numpy Generator) The source of randomness
+    :param drop: (number) The share of edges left out
+    :return: a (start nodes, end nodes) pair of int64 arrays, one entry per undirected edge
+    """
+    ids = np.arange(side * side, dtype=np.int64).reshape(side, side)
+    us = np.concatenate([ids[:, :-1].ravel(), ids[:-1, :].ravel()])
+    vs = np.concatenate([ids[:, 1:].ravel(), ids[1:, :].ravel()])
+    keep = rand.random(len(us)) >= drop
+    return us[keep], vs[keep]
+
+
+def geometric_edges(px, py, radius):
+    """
+    Finds every pair of points closer than a radius, by bucketing the points into cells as wide as the radius
+    and pairing each point with the points of its own and neighboring cells
+    :param px: (float64 array) The x coordinate of every point in meters
+    :param py: (float64 array) The y coordinate of every point in meters
+    :param radius: (number) The largest distance between connected points in meters
+    :return: a (start nodes, end nodes) pair of int64 arrays, one entry per undirected edge
+    """
+    cx = np.floor(px / radius).astype(np.int64)
+    cy = np.floor(py / radius).astype(np.int64)
+    width = int(cx.max()) + 2
+    cells = cy * width + cx
+    order = np.argsort(cells, kind='stable')
+    sorted_cells = cells[order]
+
+    us = []
+    vs = []
+    # Half of the neighboring cells are enough, as each pair of cells is then visited once
+    for dx, dy in [(0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]:
+        other = cells + dy * width + dx
+        first = np.searchsorted(sorted_cells, other, side='left')
+        counts = np.searchsorted(sorted_cells, other, side='right') - first
+        u = np.repeat(np.arange(len(px), dtype=np.int64), counts)
+        # Position of each candidate within its cell, then its point
+        within = np.arange(len(u)) - np.repeat(np.cumsum(counts) - counts, counts)
+        v = order[np.repeat(first, counts) + within]
+        close = (px[u] - px[v]) ** 2 + (py[u] - py[v]) ** 2 <= radius ** 2
+        if (dx, dy) == (0, 0):
+            # Within a cell, keep each pair once
+            close &= u < v
+        us.append(u[close])
+        vs.append(v[close])
+    return np.concatenate(us), np.concatenate(vs)
+
+
+def terrain(px, py, extent, relief, rand):
+    """
+    Makes up smooth terrain out of Gaussian hills and valleys, on a gentle slope
+    :param px: (float64 array) The x coordinate of every point in meters
+    :param py: (float64 array) The y coordinate of every point in meters
+    :param extent: (number) The width of the map in meters
+    :param relief: (number) The typical height of a hill in meters
+    :param rand: (numpy Generator) The source of randomness
+    :return: (float32 array) The elevation of every point in meters, with the lowest point at 0
+    """
+    slope = rand.normal(0, relief / max(extent, 1.0), 2)
+    elevation = slope[0] * px + slope[1] * py
+    for _ in range(TERRAIN_FEATURES):
+        (hx, hy) = rand.random(2) * extent
+        height = rand.normal(0, relief)
+        width = extent * rand.uniform(0.05, 0.25)
+        elevation += height * np.exp(-((px - hx) ** 2 + (py - hy) ** 2) / (2 * width ** 2))
+    elevation += rand.normal(0, relief * 0.01, len(px))
+    return (elevation - elevation.min()).astype(np.float32)
+
+
+def synthetic_arrays(nodes=10000, kind='grid', seed=0, spacing=100, relief=50):
+    """
+    Makes up the nodes and directed edges of a map
+    :param nodes: (int) The approximate number of nodes
+    :param kind: ('grid', 'geometric' or 'street') The layout of the map: a square grid, points scattered
+                 at random and joined to the points near them, or a grid made to look like streets
+    :param seed: (int) The seed of the random layout and terrain
+    :param spacing: (number) The average distance between neighboring nodes in meters
+    :param relief: (number) The typical height of a hill in meters
+    :return: a dictionary of arrays: the longitude ("x"), latitude ("y") and "elevation" of every node, and the
+             start ("us"), end ("vs") and "length" of every directed edge, sorted by start then end node
+    """
+    if kind not in GRAPH_KINDS:
+        raise ValueError("kind must be one of " + ", ".join(GRAPH_KINDS))
+    rand = np.random.default_rng(seed)
+    side = max(int(round(math.sqrt(nodes))), 2)
+    extent = side * spacing
+
+    if kind == 'geometric':
+        px = rand.random(side * side) * extent
+        py = rand.random(side * side) * extent
+        (us, vs) = geometric_edges(px, py, spacing * math.sqrt(GEOMETRIC_DEGREE / math.pi))
+    else:
+        street = kind == 'street'
+        (gy, gx) = np.divmod(np.arange(side * side, dtype=np.float64), side)
+        px = gx * spacing
+        py = gy * spacing
+        if street:
+            px += rand.uniform(-0.5, 0.5, len(px)) * STREET_JITTER * spacing
+            py += rand.uniform(-0.5, 0.5, len(py)) * STREET_JITTER * spacing
+        (us, vs) = grid_edges(side, rand, STREET_DROP if street else 0.0)
+
+    # Roads are longer than the straight line between their ends, unless they are grid lines
+    lengths = np.hypot(px[us] - px[vs], py[us] - py[vs])
+    if kind == 'street':
+        lengths *= 1 + rand.random(len(lengths)) * STREET_CURVATURE
+        oneway = rand.random(len(us)) < STREET_ONEWAY
+    else:
+        oneway = np.zeros(len(us), dtype=bool)
+    (us, vs, lengths) = (np.concatenate([us, vs[~oneway]]), np.concatenate([vs, us[~oneway]]),
+                         np.concatenate([lengths, lengths[~oneway]]))
+    order = np.lexsort((vs, us))
+
+    meters_per_lat = EARTH_RADIUS * math.pi / 180
+    meters_per_lon = meters_per_lat * math.cos(math.radians(ORIGIN_LAT))
+    return {
+        "x": ORIGIN_LONG + px / meters_per_lon,
+        "y": ORIGIN_LAT + py / meters_per_lat,
+        "elevation": terrain(px, py, extent, relief, rand),
+        "us": us[order],
+        "vs": vs[order],
+        "length": lengths[order].astype(np.float32)
+    }
+
+
+def synthetic_graph(nodes=10000, kind='grid', seed=0, spacing=100, relief=50):
+    """
+    Makes up a map with the same attributes as an OSMnx graph with elevations (see synthetic_arrays for the
+    parameters). Node ids start at 1
+    :return: (networkx MultiDiGraph object) The graph representing the map
+    """
+    arrays = synthetic_arrays(nodes, kind, seed, spacing, relief)
+    G = nx.MultiDiGraph(crs='epsg:4326', name='synthetic {} graph'.format(kind))
+    for i, (x, y, elevation) in enumerate(zip(arrays["x"].tolist(), arrays["y"].tolist(),
+                                              arrays["elevation"].tolist())):
+        G.add_node(i + 1, osmid=i + 1, x=x, y=y, elevation=elevation)
+    for u, v, length in zip(arrays["us"].tolist(), arrays["vs"].tolist(), arrays["length"].tolist()):
+        G.add_edge(u + 1, v + 1, key=0, length=length)
+    for u, v, data in G.edges(data=True):
+        data['oneway'] = not G.has_edge(v, u)
+    return G
+
+
+def synthetic_routing_graph(nodes=10000, kind='grid', seed=0, spacing=100, relief=50):
+    """
+    Makes up the same map as synthetic_graph straight into a routing graph, without building a networkx
+    graph, so maps of millions of nodes can be made quickly (see synthetic_arrays for the parameters)
+    :return: (RoutingGraph object) The graph representing the map
+    """
+    arrays = synthetic_arrays(nodes, kind, seed, spacing, relief)
+    n = len(arrays["x"])
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(arrays["us"], minlength=n))
+    return RoutingGraph(np.arange(1, n + 1, dtype=np.int64), arrays["x"], arrays["y"], arrays["elevation"],
+                        offsets, arrays["vs"].astype(np.int32), arrays["length"])
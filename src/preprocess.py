@@ -0,0 +1,86 @@
+import sys
+import os
+import glob
+import argparse
+import pickle as pkl
+
+sys.path.insert(1, './model')
+
+from routing_graph import RoutingGraph
+from contraction_hierarchy import ContractionHierarchy
+from landmarks import Landmarks, LANDMARK_COUNT
+from graph_tiles import split_tiles, TILE_DEGREES
+
+
+def export_graph(graph_file):
+    """
+    Compiles a pickled graph into a memory-mappable routing graph file next to it
+    :param graph_file: (str) The path of the pickled networkx MultiDiGraph
+    :return: (str) The path of the compiled graph file
+    """
+    infile = open(graph_file, 'rb')
+    G = pkl.load(infile)
+    infile.close()
+
+    compiled_file = os.path.splitext(graph_file)[0] + ".rgraph"
+    RoutingGraph.from_networkx(G).save(compiled_file)
+    return compiled_file
+
+
+def export_hierarchy(graph_file):
+    """
+    Builds a contraction hierarchy over the edge lengths of a compiled graph and saves it next to it
+    :param graph_file: (str) The path of the pickled networkx MultiDiGraph, compiled with export_graph
+    :return: (str) The path of the hierarchy file
+    """
+    rg = RoutingGraph.load(os.path.splitext(graph_file)[0] + ".rgraph")
+    hierarchy_file = os.path.splitext(graph_file)[0] + ".ch"
+    ContractionHierarchy.build(rg).save(hierarchy_file)
+    return hierarchy_file
+
+
+def export_landmarks(graph_file, count=LANDMARK_COUNT):
+    """
+    Picks landmarks for a compiled graph and saves their distances to and from every node next to it
+    :param graph_file: (str) The path of the pickled networkx MultiDiGraph, compiled with export_graph
+    :param count: (int) The number of landmarks
+    :return: (str) The path of the landmarks file
+    """
+    rg = RoutingGraph.load(os.path.splitext(graph_file)[0] + ".rgraph")
+    landmarks_file = os.path.splitext(graph_file)[0] + ".landmarks"
+    Landmarks.build(rg, count).save(landmarks_file)
+    return landmarks_file
+
+
+def export_tiles(graph_file, size=TILE_DEGREES):
+    """
+    Splits a compiled graph into square tiles saved in a directory next to it, so only the tiles around a
+    query need to be loaded (see graph_tiles.TiledGraph)
+    :param graph_file: (str) The path of the pickled networkx MultiDiGraph, compiled with export_graph
+    :param size: (number) The side of a tile in degrees
+    :return: a (directory of the tiles, number of tiles) pair
+    """
+    rg = RoutingGraph.load(os.path.splitext(graph_file)[0] + ".rgraph")
+    tiles_directory = os.path.splitext(graph_file)[0] + ".tiles"
+    return tiles_directory, split_tiles(rg, tiles_directory, size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compiles pickled graphs for routing")
+    parser.add_argument("graph_files", nargs="*", help="Pickled graphs (default: ./graphs/*.pkl)")
+    parser.add_argument("--landmarks", type=int, default=LANDMARK_COUNT,
+                        help="The number of landmarks to pick for distance bounds, 0 for none")
+    parser.add_argument("--tiles", action="store_true",
+                        help="Also split each graph into tiles, for areas too large to load at once")
+    parser.add_argument("--tile-size", type=float, default=TILE_DEGREES, help="The side of a tile in degrees")
+    args = parser.parse_args()
+
+    graph_files = args.graph_files or glob.glob("./graphs/*.pkl")
+    for graph_file in graph_files:
+        print("Compiled", graph_file, "to", export_graph(graph_file))
+        print("Saved the contraction hierarchy of", graph_file, "to", export_hierarchy(graph_file))
+        if args.landmarks > 0:
+            print("Saved", args.landmarks, "landmarks of", graph_file, "to", export_landmarks(graph_file, args.landmarks))
+        if args.tiles:
+            (tiles_directory, count) = export_tiles(graph_file, args.tile_size)
+            print("Split", graph_file, "into", count, "tiles in", tiles_directory)
@@ -0,0 +1,321 @@
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import cpu_count
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(1, './model')
+sys.path.insert(1, './view')
+
+from model import Model
+from graph_cache import graph_cache, GRAPH_FILES
+from spatial_index import SpatialIndex
+from query_trace import QueryTrace, NULL_TRACE
+from route_cache import RouteCache
+from percentiles import percentile
+from route_geometry import route_lines, line_geometry
+
+# Points further than this from every node of the map, in meters, are rejected instead of snapped
+MAX_SNAP_DISTANCE = 1000
+# Number of most recent request latencies the stats endpoint reports percentiles over
+LATENCY_WINDOW = 10000
+
+# Set in each worker process the first time it routes
+worker_model = None
+
+
+def route_request(travel_type, start, end, extra_travel, mode, algorithm, time_budget=None, traced=False):
+    """
+    Finds a route in a worker process. Workers started by fork inherit the graphs the server
+    loaded at startup, so they are not loaded again
+    :param travel_type: ('driving', 'walking' or 'biking') The routing option
+    :param start: (node) The starting point
+    :param end: (node) The end point
+    :param extra_travel: (number) The percentage over the shortest path length that the user is willing to travel
+    :param mode: ('maximize' or 'mimimize') Specifies if the route should maximize or minimize elevation
+    :param algorithm: ('dijkstra', 'astar' or 'bidirectional') Specifies how the minimize search finds its bounds
+                      (see Model.min_ele)
+    :param time_budget: (number) Optional time in seconds the maximize search may take (see Model.max_ele_anytime)
+    :param traced: (bool) Records the stages of the query and returns them under "stages"
+    :return: a dictionary with the route, its geometry and statistics, and those of the shortest path
+    """
+    global worker_model
+    if worker_model is None:
+        worker_model = Model()
+    trace = QueryTrace() if traced else NULL_TRACE
+    with trace.stage("graph_load") as record:
+        misses = graph_cache.misses
+        G = graph_cache.get(travel_type)
+        record["cache_hit"] = graph_cache.misses == misses
+    result = worker_model.compute_route(G, start, end, extra_travel, mode, algorithm, time_budget, trace)
+
+    (lats, lons) = route_lines(G, [result["route"]])[0]
+    return {
+        "route": result["route"],
+        "geometry": line_geometry(lats, lons),
+        "length": result["length"],
+        "elevation_stats": result["elevation_stats"],
+        "shortest_length": result["shortest_length"],
+        "shortest_elevation_stats": result["shortest_elevation_stats"],
+        "solver_time": result["solver_time"],
+        "nodes_settled": result["nodes_settled"],
+        "anytime": result.get("anytime"),
+        "stages": trace.stages if traced else None
+    }
+
+
+class RoutingService(object):
+    """
+    Answers route requests on a pool of worker processes that share the graphs loaded at startup,
+    and keeps the latencies of recent requests
+    """
+
+    def __init__(self, travel_types=None, workers=None, trace_log=None, route_cache=None):
+        """
+        :param travel_types: (list) The travel types to load at startup, all of them by default
+        :param workers: (int) The number of worker processes, one per core by default
+        :param trace_log: (str) Optional path of a JSON lines file the trace of every route request is appended to
+        :param route_cache: (RouteCache object) Optional cache of the routes found, checked before routing
+        """
+        self.travel_types = list(travel_types or GRAPH_FILES)
+        self.trace_log = trace_log
+        self.route_cache = route_cache
+        # Graphs and their spatial indexes are built before the pool starts so the workers inherit them
+        graph_cache.warm_up(self.travel_types)
+        for travel_type in self.travel_types:
+            SpatialIndex.of(graph_cache.get(travel_type))
+        self.pool = ProcessPoolExecutor(workers or cpu_count())
+
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.requests = 0
+        self.errors = 0
+        self.started = time.time()
+
+    def route(self, params):
+        """
+        Finds a route between two coordinates
+        :param params: (dictionary) The start and end coordinates as [latitude, longitude] lists, the mode,
+                       the travel type, the extra travel percentage and optionally the algorithm, the
+                       time budget of a maximize search in seconds and "trace", to return the stages of the query
+        :return: a dictionary with the route, its geometry and statistics (see route_request)
+        """
+        try:
+            (start_lat, start_long) = [float(v) for v in params["start"]]
+            (end_lat, end_long) = [float(v) for v in params["end"]]
+            extra_travel = float(params.get("extra_travel", 25))
+            time_budget = float(params["time_budget"]) if params.get("time_budget") is not None else None
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("start and end must be [latitude, longitude] pairs, and extra_travel and "
+                             "time_budget numbers")
+        mode = params.get("mode", "minimize")
+        travel_type = params.get("travel_type", "walking").lower()
+        algorithm = params.get("algorithm", "dijkstra")
+        if mode not in ("minimize", "maximize"):
+            raise ValueError("mode must be 'minimize' or 'maximize'")
+        if travel_type not in self.travel_types:
+            raise ValueError("travel_type must be one of " + ", ".join(self.travel_types))
+        if algorithm not in ("dijkstra", "astar", "bidirectional"):
+            raise ValueError("algorithm must be 'dijkstra', 'astar' or 'bidirectional'")
+        if extra_travel < 0:
+            raise ValueError("extra_travel must not be negative")
+        if time_budget is not None and time_budget <= 0:
+            raise ValueError("time_budget must be positive")
+
+        traced = self.trace_log is not None or params.get("trace") in (True, "true", "1")
+        if traced:
+            trace = QueryTrace(self.trace_log, travel_type=travel_type, mode=mode, algorithm=algorithm,
+                               extra_travel=extra_travel)
+        else:
+            trace = NULL_TRACE
+
+        with trace.stage("nearest_node"):
+            with self.lock:
+                index = SpatialIndex.of(graph_cache.get(travel_type))
+            start = index.nearest_node(start_lat, start_long, MAX_SNAP_DISTANCE)
+            end = index.nearest_node(end_lat, end_long, MAX_SNAP_DISTANCE)
+        if start is None or end is None:
+            raise ValueError("Geocoordinate is not within the map")
+
+        if self.route_cache is not None:
+            with trace.stage("route_cache") as record:
+                with self.lock:
+                    G = graph_cache.get(travel_type)
+                key = self.route_cache.key(G, start, end, mode, extra_travel, algorithm, time_budget)
+                result = self.route_cache.get(key)
+                record["hit"] = result is not None
+            if result is not None:
+                result["cached"] = True
+                if traced:
+                    result["trace"] = trace.finish()
+                return result
+            # The route is found for the bottom of the extra travel bucket, so it suits every query in it
+            extra_travel = self.route_cache.bucket_of(extra_travel)
+
+        result = self.pool.submit(route_request, travel_type, start, end, extra_travel, mode, algorithm,
+                                  time_budget, traced).result()
+        stages = result.pop("stages")
+        result["cached"] = False
+        if self.route_cache is not None:
+            self.route_cache.put(key, result)
+        if traced:
+            trace.add_stages(stages)
+            result["trace"] = trace.finish()
+        return result
+
+    def record(self, mode, latency, failed):
+        """
+        Records the latency of a request
+        :param mode: (string) The mode of the request, or None if it was not a route request
+        :param latency: (number) The time taken to answer the request in seconds
+        :param failed: (bool) True if the request was answered with an error
+        """
+        with self.lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+            for key in ("all", mode):
+                if key is not None:
+                    self.latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+    def stats(self):
+        """
+        :return: a dictionary with the request counts, latency percentiles in milliseconds per mode over the
+                 most recent requests, and the graph and route cache hit and miss counts
+        """
+        with self.lock:
+            latencies = {}
+            for key, values in self.latencies.items():
+                values = sorted(values)
+                latencies[key] = {
+                    "count": len(values),
+                    "p50": percentile(values, 50) * 1000,
+                    "p95": percentile(values, 95) * 1000,
+                    "p99": percentile(values, 99) * 1000,
+                    "max": values[-1] * 1000
+                }
+            return {
+                "uptime": time.time() - self.started,
+                "requests": self.requests,
+                "errors": self.errors,
+                "latency_ms": latencies,
+                "graph_cache": {"hits": graph_cache.hits, "misses": graph_cache.misses},
+                "route_cache": self.route_cache.stats() if self.route_cache is not None else None
+            }
+
+    def shutdown(self):
+        self.pool.shutdown()
+        if self.route_cache is not None:
+            self.route_cache.close()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /route?start=lat,long&end=lat,long&mode=minimize&travel_type=walking&extra_travel=25&time_budget=0.5
+    POST /route with the same parameters in a JSON body, giving start and end as [latitude, longitude]
+    GET /stats
+    """
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self.send_json(200, self.service.stats())
+        elif url.path == "/route":
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            for key in ("start", "end"):
+                if key in params:
+                    params[key] = params[key].split(",")
+            self.handle_route(params)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/route":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "The body must be a JSON object"})
+            return
+        if not isinstance(params, dict):
+            self.send_json(400, {"error": "The body must be a JSON object"})
+            return
+        self.handle_route(params)
+
+    def handle_route(self, params):
+        t = time.time()
+        try:
+            self.send_json(200, self.service.route(params))
+            failed = False
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {"error": str(e)})
+            failed = True
+        except Exception as e:
+            # A worker that crashed or a solver error still gets an answer, and counts as a failed request
+            self.send_json(500, {"error": "{}: {}".format(type(e).__name__, e)})
+            failed = True
+        mode = params.get("mode", "minimize")
+        self.service.record(mode if mode in ("minimize", "maximize") else None, time.time() - t, failed)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=8000, travel_types=None, workers=None, trace_log=None, route_cache=None):
+    """
+    Loads the graphs and answers route requests over HTTP until interrupted
+    :param host: (string) The address to listen on
+    :param port: (int) The port to listen on
+    :param travel_types: (list) The travel types to load, all of them by default
+    :param workers: (int) The number of worker processes, one per core by default
+    :param trace_log: (str) Optional path of a JSON lines file the trace of every route request is appended to
+    :param route_cache: (RouteCache object) Optional cache of the routes found
+    """
+    service = RoutingService(travel_types, workers, trace_log, route_cache)
+    RequestHandler.service = service
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    print("Serving routes on http://%s:%d" % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve routes over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--travel-types", nargs="+", default=None, choices=list(GRAPH_FILES))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--trace-log", default=None, metavar="FILE",
+                        help="append the timings and search counters of each route request to a JSON lines file")
+    parser.add_argument("--route-cache-size", type=int, default=0,
+                        help="the number of routes kept to answer repeated requests, none by default")
+    parser.add_argument("--route-cache-file", default=None, metavar="FILE",
+                        help="keep the cached routes in a sqlite database, so they survive restarts")
+    parser.add_argument("--route-cache-ttl", type=float, default=None, metavar="SECONDS")
+    args = parser.parse_args()
+
+    route_cache = None
+    if args.route_cache_size > 0 or args.route_cache_file is not None:
+        route_cache = RouteCache(args.route_cache_size or 10000, args.route_cache_ttl, args.route_cache_file)
+    serve(args.host, args.port, args.travel_types, args.workers, args.trace_log, route_cache)
@@ -1,7 +1,20 @@
 import unittest
 import sys
+import os
+import json
+import tempfile
+import random
+import time
+import pickle
+import threading
+import contextlib
+import urllib.request
+import urllib.error
+from unittest import mock
+from http.server import ThreadingHTTPServer
 import networkx as nx
 import osmnx as ox
+from shapely.geometry import LineString
 
 sys.path.insert(1, './controller')
 sys.path.insert(1, './model')
@@ -10,9 +23,80 @@ sys.path.insert(1, './view')
 from controller import Controller
 from model import Model
 from view import View
+from routing_graph import RoutingGraph
+from spatial_index import SpatialIndex
+from route_metrics import routes_metrics
+from synthetic_graph import synthetic_graph, synthetic_routing_graph, GRAPH_KINDS
+from contraction_hierarchy import ContractionHierarchy
+from query_trace import QueryTrace
+from route_cache import RouteCache
+from route_session import RouteSession
+from graph_tiles import split_tiles, TiledGraph
+from route_geometry import routes_geojson
+from landmarks import Landmarks
+from graph_cache import graph_cache, GraphCache, load_graph, GRAPH_FILES
+from server import RoutingService, RequestHandler
+from batch import route_many
+from benchmark import run_scaling, compare
+
+# The start and end points of the routes the tests find on the Hampshire County maps
+START = (42.4096, -72.5352)
+END = (42.3510, -72.5338)
 
 class test_suite(unittest.TestCase):
 
+    def setUp(self):
+        self.model = Model()
+
+    def get_map_ends(self, travel_type, extra_travel=50):
+        """
+        Loads the Hampshire County map of a travel type the way the controller does, and finds the nodes nearest
+        the start and end points of the test routes
+        :param travel_type: (str) The travel type of the map
+        :param extra_travel: (number) The extra travel allowed, which sets the region loaded from a tiled map
+        :return: a (graph, origin, destination) tuple
+        """
+        controller = Controller()
+        (controller.start_lat, controller.start_long) = START
+        (controller.end_lat, controller.end_long) = END
+        controller.extra_travel = extra_travel
+        controller.travel_type = travel_type
+        G = controller.get_map()
+        return (G, ox.get_nearest_node(G, START), ox.get_nearest_node(G, END))
+
+    @staticmethod
+    def shortest_length(rg, start, end):
+        """
+        :param rg: (RoutingGraph object) A synthetic map
+        :param start: (int) The OSM id of the starting point
+        :param end: (int) The OSM id of the end point
+        :return: (float) The length of the shortest path from start to end, inf if there is none
+        """
+        return rg.dijkstra(rg.index_of(start), rg.index_of(end))[0][rg.index_of(end)]
+
+    @staticmethod
+    def point(rg, node):
+        """
+        :param rg: (RoutingGraph object) A synthetic map
+        :param node: (int) The compact id of a node
+        :return: the (latitude, longitude) of the node
+        """
+        return (float(rg.y[node]), float(rg.x[node]))
+
+    @contextlib.contextmanager
+    def cached_graph(self, rg):
+        """
+        Makes the process-wide graph cache load rg for every travel type, instead of the Hampshire County maps
+        :param rg: (RoutingGraph object) A synthetic map
+        """
+        with mock.patch.object(graph_cache, 'loader', lambda travel_type: rg), \
+                mock.patch.object(graph_cache, 'tiles_loader', lambda travel_type: None):
+            graph_cache.clear()
+            try:
+                yield
+            finally:
+                graph_cache.clear()
+
     # Compare ascents of walking route between shortest length path and our minimum elevation path
     def test_compare_routes_min_walk(self):
         model = Model()
@@ -211,5 +295,585 @@ class test_suite(unittest.TestCase):
 
         self.assertTrue(max_el_stats["ascents"] >= shortest_stats["ascents"])
 
+    # Compare the minimum elevation walking route found on the compact routing graph with the one found on the networkx graph
+    def test_routing_graph_min_walk(self):
+        model = self.model
+        (G, origin, destination) = self.get_map_ends('Walking')
+        rg = RoutingGraph.from_networkx(G)
+
+        shortest_path = model.get_shortest_path(rg, origin, destination)
+        shortest_path_length = model.get_total_length(rg, shortest_path)
+        can_travel = 1.5 * shortest_path_length
+        rg_path = model.get_op_route(rg, origin, destination, can_travel, 'minimize')
+        nx_path = model.get_op_route(G, origin, destination, can_travel, 'minimize')
+
+        self.assertEqual(rg_path, nx_path)
+        self.assertTrue(model.get_elevation_stats(rg, rg_path)["ascents"] <= model.get_elevation_stats(rg, shortest_path)["ascents"])
+        self.assertTrue(rg.memory_usage() < len(G.nodes) * 100)
+
+    # Compare the nodes found by the spatial index with OSMnx's nearest node search
+    def test_spatial_index_nearest_nodes(self):
+        G = self.get_map_ends('Driving')[0]
+        index = SpatialIndex.of(G)
+
+        lats = [42.4096, 42.3510, 42.2773, 42.4195, 42.3275, 42.3486]
+        lons = [-72.5352, -72.5338, -72.8645, -72.9234, -72.6353, -72.6993]
+        nodes = index.nearest_nodes(lats, lons)
+        for lat, lon, node in zip(lats, lons, nodes):
+            self.assertEqual(node, ox.get_nearest_node(G, (lat, lon)))
+
+        self.assertIsNone(index.nearest_node(0.0, 0.0, max_distance=1000))
+
+    # Check that the batched lookup finds the same nodes as looking up the points one at a time
+    def test_spatial_index_synthetic(self):
+        rg = synthetic_routing_graph(2500, 'geometric', seed=1)
+        index = SpatialIndex.of(rg)
+        (min_lat, max_lat, min_lon, max_lon) = (float(rg.y.min()), float(rg.y.max()), float(rg.x.min()), float(rg.x.max()))
+        rand = random.Random(0)
+        lats = [rand.uniform(min_lat - 0.02, max_lat + 0.02) for _ in range(500)]
+        lons = [rand.uniform(min_lon - 0.02, max_lon + 0.02) for _ in range(500)]
+        for max_distance in [None, 200]:
+            nodes = index.nearest_nodes(lats, lons, max_distance)
+            self.assertEqual(nodes, [index.nearest_node(lat, lon, max_distance) for lat, lon in zip(lats, lons)])
+        self.assertIn(None, nodes)
+        self.assertEqual(index.nearest_nodes([], []), [])
+
+    # Check that the minimum elevation walking route stays within a tight length budget
+    def test_min_ele_within_budget_walk(self):
+        model = self.model
+        (G, origin, destination) = self.get_map_ends('Walking', 5)
+
+        shortest_path = model.get_shortest_path(G, origin, destination)
+        shortest_path_length = model.get_total_length(G, shortest_path)
+        can_travel = 1.05 * shortest_path_length
+        min_el_path = model.get_op_route(G, origin, destination, can_travel, 'minimize')
+
+        self.assertEqual(min_el_path[0], origin)
+        self.assertEqual(min_el_path[-1], destination)
+        self.assertTrue(model.get_total_length(G, min_el_path) <= can_travel + 1e-3)
+        self.assertTrue(model.get_elevation_stats(G, min_el_path)["ascents"] <= model.get_elevation_stats(G, shortest_path)["ascents"])
+
+    # Compare the A* searches with the Dijkstra searches on a walking route: same result, fewer nodes settled
+    def test_astar_min_walk(self):
+        model = self.model
+        (G, origin, destination) = self.get_map_ends('Walking', 20)
+
+        settled = {}
+        stats = {}
+        for algorithm in ['dijkstra', 'astar']:
+            model.search_stats = {"nodes_settled": 0}
+            shortest_path = model.get_shortest_path(G, origin, destination, algorithm)
+            shortest_path_length = model.get_total_length(G, shortest_path)
+            can_travel = 1.2 * shortest_path_length
+            min_el_path = model.get_op_route(G, origin, destination, can_travel, 'minimize', algorithm)
+            settled[algorithm] = model.search_stats["nodes_settled"]
+            stats[algorithm] = model.get_elevation_stats(G, min_el_path)
+
+        self.assertAlmostEqual(stats['astar']["ascents"], stats['dijkstra']["ascents"], places=3)
+        self.assertTrue(settled['astar'] < settled['dijkstra'])
+
+    # Check that budgets looked up on the length/elevation frontier match separate minimize searches
+    def test_pareto_routes_min_walk(self):
+        model = self.model
+        (G, origin, destination) = self.get_map_ends('Walking')
+
+        shortest_path = model.get_shortest_path(G, origin, destination)
+        shortest_path_length = model.get_total_length(G, shortest_path)
+        routes = model.pareto_routes(G, origin, destination, 1.5 * shortest_path_length)
+
+        self.assertAlmostEqual(routes[0]["length"], shortest_path_length, places=1)
+        for extra_travel in [0, 10, 25, 50]:
+            can_travel = ((100.0 + extra_travel) * shortest_path_length) / 100.0
+            min_el_path = model.get_op_route(G, origin, destination, can_travel, 'minimize')
+            pareto_path = model.get_pareto_route(routes, can_travel)
+            self.assertTrue(model.get_total_length(G, pareto_path) <= can_travel + 1e-3)
+            self.assertAlmostEqual(model.get_elevation_stats(G, pareto_path)["ascents"],
+                                   model.get_elevation_stats(G, min_el_path)["ascents"], places=2)
+
+    # Check that the batched route statistics match the statistics of each route on its own
+    def test_routes_metrics_walk(self):
+        model = self.model
+        (G, origin, destination) = self.get_map_ends('Walking')
+
+        shortest_path = model.get_shortest_path(G, origin, destination)
+        can_travel = 1.2 * model.get_total_length(G, shortest_path)
+        routes = [shortest_path, model.get_op_route(G, origin, destination, can_travel, 'minimize'),
+                  model.get_op_route(G, origin, destination, can_travel, 'maximize')]
+
+        for graph in [G, RoutingGraph.of(G)]:
+            for route, metrics in zip(routes, routes_metrics(graph, routes)):
+                self.assertEqual(metrics["length"], model.get_total_length(graph, route))
+                self.assertEqual(model.elevation_stats_of(metrics), model.get_elevation_stats(graph, route))
+                self.assertTrue(0 <= metrics["grade_p50"] <= metrics["grade_p90"] <= metrics["grade_max"])
+
+    # Check that the anytime maximize search returns a route within the budget that its upper bound covers
+    def test_max_ele_anytime_walk(self):
+        model = self.model
+        (G, origin, destination) = self.get_map_ends('Walking')
+
+        shortest_path = model.get_shortest_path(G, origin, destination)
+        can_travel = 1.5 * model.get_total_length(G, shortest_path)
+        result = model.max_ele_anytime(G, origin, destination, can_travel, 1)
+
+        route = result["route"]
+        self.assertEqual(route[0], origin)
+        self.assertEqual(route[-1], destination)
+        self.assertEqual(len(set(route)), len(route))
+        self.assertTrue(model.get_total_length(G, route) <= can_travel + 1e-3)
+        self.assertAlmostEqual(result["elevation_gain"], model.get_elevation_stats(G, route)["ascents"], places=2)
+        self.assertTrue(result["elevation_gain"] <= result["upper_bound"] + 1e-3)
+        self.assertTrue(0 <= result["gap"] <= 1)
+
+    # Check that synthetic maps built as networkx graphs and as routing graphs are the same
+    def test_synthetic_graph_kinds(self):
+        for kind in GRAPH_KINDS:
+            G = synthetic_graph(400, kind, seed=1)
+            converted = RoutingGraph.from_networkx(G)
+            rg = synthetic_routing_graph(400, kind, seed=1)
+            for name in ["osm_ids", "x", "y", "elevation", "offsets", "targets", "lengths"]:
+                self.assertTrue((getattr(converted, name) == getattr(rg, name)).all())
+
+    # Check the optimized routes against the shortest path on a synthetic map, without the Hampshire County graphs
+    def test_compare_routes_synthetic(self):
+        model = self.model
+        G = synthetic_graph(900, 'street', seed=2)
+        origin = 1
+        destination = G.number_of_nodes()
+
+        shortest_path = model.get_shortest_path(G, origin, destination)
+        shortest_path_length = model.get_total_length(G, shortest_path)
+        shortest_path_ascents = model.get_elevation_stats(G, shortest_path)["ascents"]
+        for extra_travel in [0, 25, 50]:
+            can_travel = ((100.0 + extra_travel) * shortest_path_length) / 100.0
+            for mode in ['minimize', 'maximize']:
+                route = model.get_op_route(G, origin, destination, can_travel, mode)
+                self.assertEqual(route[0], origin)
+                self.assertEqual(route[-1], destination)
+                self.assertTrue(model.get_total_length(G, route) <= can_travel + 1e-3)
+                if mode == 'minimize':
+                    self.assertTrue(model.get_elevation_stats(G, route)["ascents"] <= shortest_path_ascents + 1e-3)
+
+    # Check that the contraction hierarchy finds shortest paths as long as Dijkstra's algorithm does
+    def test_contraction_hierarchy_synthetic(self):
+        rg = synthetic_routing_graph(900, 'street', seed=3)
+        hierarchy = ContractionHierarchy.build(rg)
+        for source, target in [(0, 899), (10, 450), (899, 31), (200, 640)]:
+            dist = rg.dijkstra(source)[0][target]
+            path = hierarchy.shortest_path(source, target)
+            self.assertEqual(path[0], source)
+            self.assertEqual(path[-1], target)
+            self.assertAlmostEqual(sum(rg.edge_length(u, v) for u, v in zip(path, path[1:])), dist, places=2)
+
+    # Check that a traced query records its searches and is appended to the trace log
+    def test_query_trace_synthetic(self):
+        model = self.model
+        G = synthetic_graph(900, 'grid', seed=4)
+        (handle, log_file) = tempfile.mkstemp(suffix=".jsonl")
+        os.close(handle)
+        try:
+            trace = QueryTrace(log_file, mode='minimize')
+            result = model.compute_route(G, 1, G.number_of_nodes(), 25, 'minimize', trace=trace)
+            trace.finish()
+            with open(log_file) as infile:
+                lines = [json.loads(line) for line in infile]
+        finally:
+            os.remove(log_file)
+
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]["mode"], 'minimize')
+        stages = {stage["stage"]: stage for stage in lines[0]["stages"]}
+        self.assertEqual(set(stages), {"shortest_path", "optimized_search"})
+        self.assertAlmostEqual(stages["optimized_search"]["path_length"], result["length"], places=3)
+        self.assertEqual(stages["optimized_search"]["path_nodes"], len(result["route"]))
+        self.assertEqual(sum(stage["nodes_settled"] for stage in stages.values()), result["nodes_settled"])
+        for stage in stages.values():
+            self.assertTrue(stage["nodes_pushed"] >= stage["nodes_settled"] > 0)
+            self.assertTrue(0 < stage["heap_peak"] <= stage["nodes_pushed"])
+
+    # Check that repeated queries in the same extra travel bucket are answered from the route cache, also after
+    # the cache database is opened again
+    def test_route_cache_synthetic(self):
+        G = synthetic_graph(900, 'street', seed=2)
+        (handle, cache_file) = tempfile.mkstemp(suffix=".sqlite")
+        os.close(handle)
+        try:
+            for path in [None, cache_file]:
+                model = Model(RouteCache(max_entries=2, path=path, bucket=5))
+                first = model.compute_route(G, 1, 900, 27, 'minimize')
+                second = model.compute_route(G, 1, 900, 29, 'minimize')
+                self.assertFalse(first["cached"])
+                self.assertTrue(second["cached"])
+                self.assertEqual(first["route"], second["route"])
+                self.assertEqual(first["route"], self.model.compute_route(G, 1, 900, 25, 'minimize')["route"])
+
+                # The least recently used route is dropped when the cache is full
+                model.compute_route(G, 2, 900, 25, 'minimize')
+                model.compute_route(G, 3, 900, 25, 'minimize')
+                self.assertFalse(model.compute_route(G, 1, 900, 25, 'minimize')["cached"])
+                model.route_cache.close()
+
+            model = Model(RouteCache(path=cache_file, bucket=5))
+            self.assertTrue(model.compute_route(G, 1, 900, 25, 'minimize')["cached"])
+            model.route_cache.close()
+        finally:
+            os.remove(cache_file)
+
+    # Check that a repeated query through the controller, which routes with a route session, is answered from
+    # the route cache
+    def test_route_cache_controller(self):
+        rg = synthetic_routing_graph(900, 'street', seed=2)
+        model = Model(RouteCache(bucket=5))
+        model.set_view(mock.Mock())
+        controller = Controller()
+        controller.set_model(model)
+        (start, end) = (self.point(rg, 0), self.point(rg, 899))
+        with self.cached_graph(rg):
+            for extra_travel in ["25", "25", "27"]:
+                controller.confirm('Walking', 'Minimize', str(start[0]), str(start[1]), str(end[0]), str(end[1]),
+                                   extra_travel)
+
+        self.assertEqual(model.route_cache.stats(), {"entries": 1, "hits": 2, "misses": 1})
+        routes = [call.args[1] for call in model.vobj.show_route.call_args_list]
+        self.assertEqual(routes, [routes[0]] * 3)
+        self.assertEqual(routes[0], Model().compute_route(rg, 1, 900, 25, 'minimize')["route"])
+
+    # Check that shorter parallel edges are used, and measured, by the routing algorithms and the route statistics
+    def test_parallel_edges_synthetic(self):
+        model = self.model
+        G = synthetic_graph(400, 'grid', seed=3)
+        for u, v, length in list(G.edges(data='length')):
+            if u % 3 == 0:
+                G.add_edge(u, v, key=1, length=length / 2)
+        rg = RoutingGraph.of(G)
+        self.assertEqual(model.get_cost(G, 3, 4), G.edges[3, 4, 1]['length'])
+        self.assertEqual(rg.edge_key(rg.index_of(3), rg.index_of(4)), 1)
+        self.assertEqual(rg.edge_key(rg.index_of(4), rg.index_of(3)), 0)
+
+        shortest_path = model.get_shortest_path(G, 1, 400)
+        self.assertAlmostEqual(model.get_total_length(G, shortest_path),
+                               nx.shortest_path_length(G, 1, 400, weight='length'), places=2)
+        route = model.get_op_route(G, 1, 400, 1.2 * model.get_total_length(G, shortest_path), 'minimize')
+        self.assertTrue(model.get_total_length(G, route) <= 1.2 * model.get_total_length(G, shortest_path) + 1e-3)
+
+        (handle, graph_file) = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            rg.save(graph_file)
+            loaded = RoutingGraph.load(graph_file)
+            self.assertEqual(loaded.keys.tolist(), rg.keys.tolist())
+            self.assertEqual(loaded.reverse().keys.tolist(), rg.reverse().keys.tolist())
+            # The per-edge arrays the searches use are read from the file in place, not computed again
+            for graph, expected in [(loaded, rg), (loaded.reverse(), rg.reverse())]:
+                for name in ["gains", "grades"]:
+                    self.assertEqual(getattr(graph, name).tolist(), getattr(expected, name).tolist())
+                    self.assertFalse(getattr(graph, name).flags.writeable)
+        finally:
+            os.remove(graph_file)
+
+    # Check that the GeoJSON of routes follows the curved geometry of their edges, and holds the properties given
+    def test_route_geojson_synthetic(self):
+        G = synthetic_graph(100, 'grid', seed=1)
+        route = self.model.get_shortest_path(G, 1, 100)
+        rg = RoutingGraph.of(G)
+        (u, v) = (route[1], route[2])
+        (start, end) = ((G.nodes[u]['x'], G.nodes[u]['y']), (G.nodes[v]['x'], G.nodes[v]['y']))
+        bends = [(start[0] + 0.0001, start[1] + 0.0002), (end[0] - 0.0001, end[1] + 0.0002)]
+        G[u][v][rg.edge_key(rg.index_of(u), rg.index_of(v))]['geometry'] = LineString([start] + bends + [end])
+
+        properties = [{"role": "optimized", "color": "#42aaf5", "length": 900.0}, {"role": "alternative"}]
+        collection = routes_geojson(G, [route, route[:2]], properties)
+        self.assertEqual(collection["type"], "FeatureCollection")
+        self.assertEqual([feature["properties"] for feature in collection["features"]], properties)
+        coordinates = [[G.nodes[node]['x'], G.nodes[node]['y']] for node in route]
+        self.assertEqual(collection["features"][0]["geometry"],
+                         {"type": "LineString", "coordinates": coordinates[:2] + [list(bend) for bend in bends] + coordinates[2:]})
+        self.assertEqual(collection["features"][1]["geometry"]["coordinates"], coordinates[:2])
+        # A routing graph keeps no edge geometry, so its lines only join the nodes
+        self.assertEqual(routes_geojson(rg, [route], properties[:1])["features"][0]["geometry"]["coordinates"], coordinates)
+
+    # Check that a route session finds routes as good as new queries, only searching again for new budgets
+    def test_route_session_synthetic(self):
+        G = synthetic_graph(900, 'street', seed=2)
+        for mode in ['minimize', 'maximize']:
+            session = RouteSession(G, 1, 900, mode)
+            for extra_travel, resumed in [(40, False), (40, True), (15, mode == 'minimize'), (60, False)]:
+                result = session.compute_route(extra_travel)
+                expected = self.model.compute_route(G, 1, 900, extra_travel, mode)
+                self.assertEqual(result["resumed"], resumed)
+                self.assertEqual(result["shortest_length"], expected["shortest_length"])
+                self.assertTrue(result["length"] <= result["can_travel"] + 1e-3)
+                if mode == 'minimize':
+                    self.assertAlmostEqual(result["elevation_stats"]["ascents"],
+                                           expected["elevation_stats"]["ascents"], places=3)
+                else:
+                    self.assertEqual(result["route"], expected["route"])
+                if resumed:
+                    self.assertEqual(result["nodes_settled"], 0)
+
+    # Check that a search stopped by its deadline reports the time it actually took, also when the deadline passes
+    # before the search has started, and that the upper bound holds over every simple path of small maps
+    def test_max_ele_anytime_synthetic(self):
+        model = self.model
+        rg = synthetic_routing_graph(2500, 'geometric', seed=2)
+        can_travel = 1.3 * self.shortest_length(rg, 1, 2500)
+        result = model.max_ele_anytime(rg, 1, 2500, can_travel, 0.02)
+        self.assertTrue(result["elapsed"] >= 0.02)
+        self.assertTrue(result["iterations"] > 0)
+
+        # A budget smaller than the searches the upper bound needs stops after the one the first route needs
+        model = Model()
+        result = model.max_ele_anytime(rg, 1, 2500, can_travel, 1e-6)
+        self.assertTrue(model.search_stats["nodes_settled"] <= rg.number_of_nodes())
+        self.assertEqual(result["route"], model.get_shortest_path(rg, 1, 2500))
+        self.assertEqual((result["upper_bound"], result["gap"], result["iterations"]), (None, None, 0))
+        model = self.model
+
+        for kind in GRAPH_KINDS:
+            rg = synthetic_routing_graph(36, kind, seed=3)
+            for (start, end) in [(1, 36), (4, 27)]:
+                (s, t) = (rg.index_of(start), rg.index_of(end))
+                dist_to_end = rg.reverse().dijkstra(t)[0]
+                if dist_to_end[s] == float('inf'):
+                    continue
+                can_travel = 1.4 * dist_to_end[s]
+                result = model.max_ele_anytime(rg, start, end, can_travel, 1)
+
+                # Find the best simple path by trying every one that can still reach the end within can_travel
+                best_gain = 0
+                stack = [([s], 0, 0)]
+                while len(stack) != 0:
+                    (path, length, gain) = stack.pop()
+                    if path[-1] == t:
+                        best_gain = max(best_gain, gain)
+                        continue
+                    for next, edge_length, edge_gain in rg.edge_gains(path[-1]):
+                        if next not in path and length + edge_length + dist_to_end[next] <= can_travel:
+                            stack.append((path + [next], length + edge_length, gain + edge_gain))
+                self.assertTrue(result["elevation_gain"] <= best_gain + 1e-3)
+                self.assertTrue(best_gain <= result["upper_bound"] + 1e-3)
+
+    # Check that the bidirectional minimize search finds routes with as little elevation gain as the one from
+    # start, over many small maps, endpoint pairs and budgets
+    def test_bidirectional_min_synthetic(self):
+        model = self.model
+        for kind in GRAPH_KINDS:
+            for seed in range(12):
+                rg = synthetic_routing_graph(49, kind, seed=seed)
+                for (start, end) in [(1, 49), (31, 15), (8, 42), (25, 3), (44, 20)]:
+                    length = self.shortest_length(rg, start, end)
+                    if length == float('inf'):
+                        continue
+                    for can_travel in [length * 1.1, length * 1.4, length * 2, length * 3]:
+                        route = model.min_ele(rg, start, end, can_travel, 'bidirectional')
+                        expected = model.min_ele(rg, start, end, can_travel, 'dijkstra')
+                        self.assertEqual((route[0], route[-1]), (start, end))
+                        self.assertEqual(len(set(route)), len(route))
+                        self.assertTrue(model.get_total_length(rg, route) <= can_travel + 1e-3)
+                        self.assertAlmostEqual(model.get_elevation_stats(rg, route)["ascents"],
+                                               model.get_elevation_stats(rg, expected)["ascents"], places=3)
+        rg = synthetic_routing_graph(49, 'grid', seed=5)
+        self.assertAlmostEqual(model.get_elevation_stats(rg, model.min_ele(rg, 31, 15, 420, 'bidirectional'))["ascents"],
+                               model.get_elevation_stats(rg, model.min_ele(rg, 31, 15, 420, 'dijkstra'))["ascents"],
+                               places=3)
+
+    # Check that the region loaded from tiles holds routes as good as the ones found in the whole map
+    def test_graph_tiles_synthetic(self):
+        rg = synthetic_routing_graph(2500, 'street', seed=2)
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertTrue(split_tiles(rg, directory, 0.005) > 1)
+            for (start, end) in [(1, 260), (1275, 1330), (2000, 1850)]:
+                if self.shortest_length(rg, start, end) == float('inf'):
+                    continue
+                tiles = TiledGraph(directory)
+                for extra_travel in [10, 40]:
+                    G = tiles.graph_for(self.point(rg, rg.index_of(start)), self.point(rg, rg.index_of(end)),
+                                        extra_travel)
+                    self.assertTrue(G.number_of_nodes() < rg.number_of_nodes())
+                    expected = self.model.compute_route(rg, start, end, extra_travel, 'minimize')
+                    result = self.model.compute_route(G, start, end, extra_travel, 'minimize')
+                    self.assertAlmostEqual(result["shortest_length"], expected["shortest_length"], places=2)
+                    self.assertAlmostEqual(result["elevation_stats"]["ascents"],
+                                           expected["elevation_stats"]["ascents"], places=3)
+
+    # Check that landmark bounds never exceed the real distances, and that searches using them find valid routes
+    def test_landmarks_synthetic(self):
+        for kind in GRAPH_KINDS:
+            rg = synthetic_routing_graph(900, kind, seed=2)
+            with tempfile.TemporaryDirectory() as directory:
+                Landmarks.build(rg, 8).save(os.path.join(directory, "graph.landmarks"))
+                landmarks = Landmarks.load(os.path.join(directory, "graph.landmarks"))
+            self.assertTrue(landmarks.matches(rg))
+            for (start, end) in [(1, 900), (45, 610), (300, 31)]:
+                (s, t) = (rg.index_of(start), rg.index_of(end))
+                dist_to_end = rg.reverse().dijkstra(t)[0]
+                dist_from_start = rg.dijkstra(s)[0]
+                for bound, dist in zip(landmarks.lower_bounds(t).tolist(), dist_to_end):
+                    self.assertTrue(bound <= dist)
+                for bound, dist in zip(landmarks.lower_bounds_from(s).tolist(), dist_from_start):
+                    self.assertTrue(bound <= dist)
+                self.assertEqual(landmarks.lower_bound(s, t), landmarks.lower_bounds(t)[s])
+                if dist_to_end[s] == float('inf'):
+                    continue
+
+                rg.indexes['landmarks'] = landmarks
+                can_travel = dist_to_end[s] * 1.3
+                model = self.model
+                route = model.max_ele(rg, start, end, can_travel)
+                self.assertEqual((route[0], route[-1]), (start, end))
+                self.assertTrue(model.get_total_length(rg, route) <= can_travel + 1e-3)
+                route = model.min_ele(rg, start, end, can_travel, 'astar')
+                del rg.indexes['landmarks']
+                expected = model.min_ele(rg, start, end, can_travel, 'astar')
+                self.assertAlmostEqual(model.get_elevation_stats(rg, route)["ascents"],
+                                       model.get_elevation_stats(rg, expected)["ascents"], places=3)
+
+    # Check that the routing service answers route requests, rejects bad ones, reports failures of the workers
+    # and counts every request in its latency percentiles
+    def test_server_synthetic(self):
+        rg = synthetic_routing_graph(900, 'street', seed=2)
+        (start, end) = (list(self.point(rg, 0)), list(self.point(rg, 899)))
+        with self.cached_graph(rg):
+            service = RoutingService(['walking'], workers=1)
+            RequestHandler.service = service
+            server = ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = "http://127.0.0.1:%d" % server.server_address[1]
+
+            def request(path, body=None):
+                data = json.dumps(body).encode() if body is not None else None
+                try:
+                    with urllib.request.urlopen(url + path, data) as response:
+                        return response.status, json.loads(response.read())
+                except urllib.error.HTTPError as e:
+                    return e.code, json.loads(e.read())
+
+            try:
+                (status, result) = request("/route", {"start": start, "end": end, "extra_travel": 30})
+                self.assertEqual(status, 200)
+                self.assertEqual((result["route"][0], result["route"][-1]), (1, 900))
+                self.assertTrue(result["length"] <= 1.3 * result["shortest_length"] + 1e-3)
+                self.assertEqual(len(result["geometry"]["coordinates"]), len(result["route"]))
+                (status, result) = request("/route?start=%f,%f&end=%f,%f&mode=maximize" % tuple(start + end))
+                self.assertEqual(status, 200)
+
+                for body in [{"start": start}, {"start": start, "end": end, "mode": "sideways"},
+                             {"start": start, "end": end, "extra_travel": -5},
+                             {"start": start, "end": [0.0, 0.0]}]:
+                    (status, result) = request("/route", body)
+                    self.assertEqual(status, 400)
+                with mock.patch.object(service, 'route', side_effect=RuntimeError("worker crashed")):
+                    (status, result) = request("/route", {"start": start, "end": end})
+                self.assertEqual(status, 500)
+                self.assertIn("worker crashed", result["error"])
+
+                # Requests are recorded once they are answered, so the last one may not be counted yet
+                for _ in range(100):
+                    (status, stats) = request("/stats")
+                    if stats["requests"] == 7:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(stats["requests"], 7)
+                self.assertEqual(stats["errors"], 5)
+                latency = stats["latency_ms"]["all"]
+                self.assertEqual(latency["count"], 7)
+                self.assertTrue(0 < latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"])
+                self.assertEqual(stats["latency_ms"]["maximize"]["count"], 1)
+            finally:
+                server.shutdown()
+                server.server_close()
+                service.shutdown()
+
+    # Check that batch routing answers every pair in order, with an error for the pairs it cannot route or that fail
+    def test_batch_synthetic(self):
+        rg = synthetic_routing_graph(900, 'street', seed=1)
+        unreachable = rg.dijkstra(0)[0].index(float('inf'))
+        point = lambda i: self.point(rg, i)
+        pairs = [(point(0), point(899)), (point(0), point(unreachable)), (point(450), (0.0, 0.0)),
+                 (point(899), point(0)), (point(10), point(500))]
+        with self.cached_graph(rg):
+            results = route_many(pairs, 'minimize', 25, 'walking', processes=2, chunksize=1)
+
+        self.assertEqual(len(results), len(pairs))
+        for (start, end), result in zip([(1, 900), (1, unreachable + 1), (451, None), (900, 1), (11, 501)], results):
+            self.assertEqual((result["start"], result["end"]), (start, end))
+            if result["error"] is None:
+                self.assertEqual((result["route"][0], result["route"][-1]), (start, end))
+                expected = self.model.compute_route(rg, start, end, 25, 'minimize')
+                self.assertAlmostEqual(result["elevation_stats"]["ascents"],
+                                       expected["elevation_stats"]["ascents"], places=3)
+            else:
+                self.assertIsNone(result["route"])
+        self.assertEqual([result["error"] is None for result in results], [True, False, False, True, True])
+        self.assertIn("No path", results[1]["error"])
+        self.assertIn("not within the map", results[2]["error"])
+
+        # An unexpected error fails only its own pair
+        compute_route = Model.compute_route
+        def failing_compute_route(model, G, start, *args):
+            if start == 11:
+                raise AttributeError("broken input")
+            return compute_route(model, G, start, *args)
+        with self.cached_graph(rg), mock.patch.object(Model, 'compute_route', failing_compute_route):
+            failed = route_many(pairs, 'minimize', 25, 'walking', processes=2, chunksize=1)
+        self.assertEqual([result["route"] for result in failed[:4]], [result["route"] for result in results[:4]])
+        self.assertEqual((failed[4]["route"], failed[4]["error"]), (None, "AttributeError: broken input"))
+
+    # Check that benchmark reports are only compared against baselines that routed the same pairs
+    def test_benchmark_compare_synthetic(self):
+        report = run_scaling(sizes=(400,), size=3, memory=False)
+        self.assertEqual(compare(report, report), [])
+        for key, value in [("size", 5), ("extra_travel", 50)]:
+            self.assertRaises(ValueError, compare, report, dict(report, **{key: value}))
+        baseline = json.loads(json.dumps(report))
+        del baseline["graphs"]["400"]["corpus"][-1]
+        self.assertRaises(ValueError, compare, report, baseline)
+
+    # Check that the graph cache drops the least recently used graphs to fit its budget, and that files built
+    # for another graph, or older than the graph, are not used
+    def test_graph_cache_synthetic(self):
+        graphs = {travel_type: synthetic_routing_graph(400, 'grid', seed=i)
+                  for i, travel_type in enumerate(['driving', 'walking', 'biking'])}
+        size = graphs['driving'].memory_usage()
+        cache = GraphCache(max_bytes=2 * size, loader=lambda travel_type: graphs[travel_type],
+                           tiles_loader=lambda travel_type: None)
+        cache.get('driving')
+        cache.get('walking')
+        cache.get('Driving')
+        cache.get('biking')
+        self.assertEqual(list(cache.graphs), ['driving', 'biking'])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        self.assertTrue(cache.total_memory_usage() <= cache.max_bytes)
+        self.assertIs(cache.get_region('walking', (0, 0), (0, 0), 25), graphs['walking'])
+        self.assertEqual(list(cache.graphs), ['biking', 'walking'])
+
+        # A graph is always kept, even over the budget
+        cache.max_bytes = 1
+        cache.get('driving')
+        self.assertEqual(list(cache.graphs), ['driving'])
+
+        rg = synthetic_routing_graph(400, 'grid', seed=0)
+        hierarchy = ContractionHierarchy.build(rg)
+        landmarks = Landmarks.build(rg, 4)
+        self.assertTrue(hierarchy.matches(rg) and landmarks.matches(rg))
+        # Same number of nodes and edges, other lengths
+        other = RoutingGraph(rg.osm_ids, rg.x, rg.y, rg.elevation, rg.offsets, rg.targets, rg.lengths * 2)
+        self.assertFalse(hierarchy.matches(other) or landmarks.matches(other))
+
+        G = synthetic_graph(400, 'grid', seed=0)
+        with tempfile.TemporaryDirectory() as directory:
+            graph_file = os.path.join(directory, "walking.pkl")
+            with open(graph_file, 'wb') as outfile:
+                pickle.dump(G, outfile)
+            RoutingGraph.of(G).save(os.path.join(directory, "walking.rgraph"))
+            hierarchy.save(os.path.join(directory, "walking.ch"))
+            landmarks.save(os.path.join(directory, "walking.landmarks"))
+            with mock.patch.dict(GRAPH_FILES, {'walking': graph_file}):
+                loaded = load_graph('walking')
+                self.assertIsInstance(loaded, RoutingGraph)
+                self.assertEqual(set(loaded.indexes), {'contraction_hierarchy', 'landmarks', 'graph_shape'})
+                # The pickle changed after the graph was compiled
+                os.utime(os.path.join(directory, "walking.rgraph"), (0, 0))
+                self.assertIsInstance(load_graph('walking'), nx.MultiDiGraph)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
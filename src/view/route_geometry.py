@@ -0,0 +1,73 @@
+import numpy as np
+from routing_graph import RoutingGraph
+
+
+def route_lines(G, routes):
+    """
+    Gets the coordinates of many routes, looking up all of their nodes in the graph's coordinate arrays at once.
+    Where an edge of a networkx graph has a geometry, as the curved streets merged by OSMnx's simplification do,
+    the line follows it between the edge's nodes. A RoutingGraph keeps no edge geometry, so its lines join the nodes
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param routes: (list) The routes, as lists of nodes
+    :return: a list with a (latitudes, longitudes) pair of float64 arrays for each route
+    """
+    rg = RoutingGraph.of(G)
+    nodes = [node for route in routes for node in route]
+    indexes = rg.indexes_of(nodes)
+    splits = np.cumsum([len(route) for route in routes])[:-1]
+    lines = list(zip(np.split(rg.y[indexes], splits), np.split(rg.x[indexes], splits)))
+    if isinstance(G, RoutingGraph):
+        return lines
+    return [curved_line(G, rg, route, lats, lons) for route, (lats, lons) in zip(routes, lines)]
+
+
+def curved_line(G, rg, route, lats, lons):
+    """
+    Puts the inner points of the geometry of a route's edges, for the edges that have one, between the
+    coordinates of the route's nodes
+    :param G: (networkx MultiDiGraph) The graph representing the map
+    :param rg: (RoutingGraph object) The routing graph of G, which knows the key of the edge used between two nodes
+    :param route: (list) The route, as a list of nodes
+    :param lats: (float64 array) The latitude of every node of the route
+    :param lons: (float64 array) The longitude of every node of the route
+    :return: a (latitudes, longitudes) pair of float64 arrays
+    """
+    if len(route) < 2:
+        return (lats, lons)
+    indexes = rg.indexes_of(route)
+    keys = rg.keys[rg.edge_indexes(indexes[:-1], indexes[1:])].tolist()
+    # The points of each edge's geometry run from its start node to its end node, as (longitude, latitude)
+    inner = [list(geometry.coords)[1:-1] if geometry is not None else []
+             for geometry in (G[u][v][key].get('geometry') for u, v, key in zip(route, route[1:], keys))]
+    if not any(inner):
+        return (lats, lons)
+    points = [(lats[0], lons[0])]
+    for lat, lon, edge_points in zip(lats[1:].tolist(), lons[1:].tolist(), inner):
+        points.extend((point_lat, point_lon) for (point_lon, point_lat) in edge_points)
+        points.append((lat, lon))
+    points = np.array(points, dtype=np.float64)
+    return (points[:, 0], points[:, 1])
+
+
+def line_geometry(lats, lons):
+    """
+    :param lats: (float64 array) The latitude of every point of a line
+    :param lons: (float64 array) The longitude of every point of a line
+    :return: (dictionary) The line as a GeoJSON LineString, with [longitude, latitude] coordinates
+    """
+    return {"type": "LineString", "coordinates": np.column_stack((lons, lats)).tolist()}
+
+
+def routes_geojson(G, routes, properties):
+    """
+    Makes a GeoJSON FeatureCollection out of routes
+    :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+    :param routes: (list) The routes, as lists of nodes
+    :param properties: (list) The properties of each route, as dictionaries
+    :return: (dictionary) The FeatureCollection, with a LineString feature per route
+    """
+    return {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "geometry": line_geometry(lats, lons), "properties": props}
+                     for (lats, lons), props in zip(route_lines(G, routes), properties)]
+    }
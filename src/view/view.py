@@ -1,97 +1,21 @@
-import osmnx as ox
 import folium
 import webbrowser
 import time
+import json
 import itertools
 import threading
 import sys
 from branca.element import Template, MacroElement
 import os
+from route_geometry import route_lines, routes_geojson
 
+# Colors of the optimized route and of the additional routes, in order
+ROUTE_COLOR = "#42aaf5"
+ALT_ROUTE_COLORS = ["#eb4034", "#fcba03", "#9b42f5", "#2ecc71", "#f58d42", "#42f5e3"]
 
-class View(object):
-    """
-    View object
-    """
-    def __init__(self):
-        self.done = False
-
-    def show_route(self, G, route, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, alt_route=None):
-        """
-        Takes optimized route and displays it on a folium map
-        :param G: (networkx MultiDiGraph object) The graph representing the map
-        :param route: (list) Optimized route
-        :param alt_route: (list) Additional routes to be displayed on map
-        """
-        template = self.get_template(elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest)
-
-        route_coords = []
-        for n in route:
-            x_coord = str(G.nodes[n]['y'])
-            y_coord = str(G.nodes[n]['x'])
-            route_coords.append(x_coord + "," + y_coord)
-
-        print()
-
-        directions_url = "https://www.google.com/maps/dir/"
-        for c in route_coords:
-            directions_url += c + "/"
-        # print(directions_url)
-        # webbrowser.open(directions_url, new=2)
-        # print()
-
-        print("Processing route")
-        t = threading.Thread(target=self.loading_animation)
-        t.start()
-
-        route_map = ox.plot_route_folium(G, route, route_opacity=0.75, route_color="#42aaf5", tiles='Stamen Terrain')
-
-        #alt_route[0] is networkx's shortest path, weighted by length
-        if(len(alt_route)>0):
-            ox.plot_route_folium(G, alt_route[0], route_map, route_opacity=0.75, route_color="#eb4034")
-
-        # alt_route[1] is networkx's shortest path, weighted by elevation
-        if(len(alt_route)>1):
-            ox.plot_route_folium(G, alt_route[1], route_map, route_opacity=0.75, route_color="#fcba03")
-
-        #add our route on top of others
-        ox.plot_route_folium(G, route, route_map, route_opacity=0.75, route_color="#42aaf5", tiles='Stamen Terrain')
-
-        #add markers to start and end nodes
-        folium.Marker(route_coords[0].split(","), popup='<i>Start</i>', icon=folium.Icon(color='blue', icon='unchecked')).add_to(route_map)
-        folium.Marker(route_coords[-1].split(","), popup='<i>End</i>', icon=folium.Icon(color='green', icon='flag')).add_to(route_map)
-
-        macro = MacroElement()
-        macro._template = Template(template)
-
-        route_map.get_root().add_child(macro)
-
-        filepath = './route.html'
-        route_map.save(filepath)
-        # This was broken on windows (and maybe on Mac). We'll fix it later
-        # webbrowser.open(filepath, new=2)
-        webbrowser.open('file://' + os.path.realpath(filepath), new=2)
-        self.done = True
-        print('Done!')
-
-    def loading_animation(self):
-        """
-        Displays loading animation
-        """
-        for c in itertools.cycle(['.', '..', '...']):
-            if self.done:
-                break
-            sys.stdout.write('\rProcessing route ' + c + '  ')
-            sys.stdout.flush()
-            time.sleep(0.25)
-        sys.stdout.flush()
-
-    def get_template(self, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest):
-        """
-        Returns style template for folium map webpage
-        :return: Stylesheet template
-        """
-        template = """
+# The parts of the page around the map that are the same for every route: the legend with its scripts,
+# and the end of the page with the stylesheet. Only the legend entries and the data legend are filled in per route
+LEGEND_TEMPLATE = """
         {% macro html(this, kwargs) %}
 
         <!doctype html>
@@ -138,13 +62,14 @@ class View(object):
 
         <div class='legend-title'>Legend</div>
         <div class='legend-scale'>
-          <ul class='legend-labels'>
-            <li><span style='background:#42aaf5;opacity:0.75;'></span>Our Route</li>
-            <li><span style='background:#eb4034;opacity:0.75;'></span>Shortest Length Route</li>
+          <ul class='legend-labels'>"""
+LEGEND_ENTRY_TEMPLATE = """
+            <li><span style='background:{};opacity:0.75;'></span>{}</li>"""
+LEGEND_END_TEMPLATE = """
           </ul>
         </div>
         </div>"""
-        template2 = """
+DATA_TEMPLATE = """
         <div id='datalegend' class='datalegend' 
             style='position: absolute; z-index:9999; border:2px solid grey; background-color:rgba(255, 255, 255, 0.8);
              border-radius:6px; padding: 10px; font-size:14px; right: 200px; bottom: 20px;'>
@@ -169,9 +94,8 @@ class View(object):
           </ul>
         </div>
         </div>
-        """.format(total_distance_optimized, elevation_stats_optimized['net_change'], elevation_stats_optimized['ascents'], elevation_stats_optimized['descents'], elevation_stats_optimized['total_change'],
-        total_distance_shortest, elevation_stats_shortest['net_change'], elevation_stats_shortest['ascents'], elevation_stats_shortest['descents'], elevation_stats_shortest['total_change'])
-        template3 = """
+        """
+PAGE_END_TEMPLATE = """
         </body>
         </html>
 
@@ -256,6 +180,126 @@ class View(object):
             }
         </style>
         {% endmacro %}"""
-        template = template + template2 + template3
-        return template
 
+
+class View(object):
+    """
+    View object
+    """
+    def __init__(self, output='html'):
+        """
+        :param output: ('html' or 'geojson') Whether routes are shown on a map in the browser, or only written
+                       to route.geojson for other programs to use
+        """
+        self.done = False
+        self.output = output
+
+    def show_route(self, G, route, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, alt_route=None):
+        """
+        Takes optimized route and displays it on a folium map
+        :param G: (networkx MultiDiGraph object) The graph representing the map
+        :param route: (list) Optimized route
+        :param alt_route: (list) Additional routes to be displayed on map
+        """
+        print()
+        if self.output == 'geojson':
+            filepath = './route.geojson'
+            with open(filepath, 'w') as outfile:
+                json.dump(self.get_geojson(G, route, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, alt_route), outfile)
+            print('Route saved to', filepath)
+            return
+
+        print("Processing route")
+        self.done = False
+        t = threading.Thread(target=self.loading_animation)
+        t.start()
+
+        route_map = self.get_map(G, route, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, alt_route)
+
+        filepath = './route.html'
+        route_map.save(filepath)
+        # This was broken on windows (and maybe on Mac). We'll fix it later
+        # webbrowser.open(filepath, new=2)
+        webbrowser.open('file://' + os.path.realpath(filepath), new=2)
+        self.done = True
+        t.join()
+        print('Done!')
+
+    def get_map(self, G, route, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, alt_route=None):
+        """
+        Draws the optimized route and the additional routes on a folium map. The coordinates of every route
+        are looked up at once, and each route is drawn once, all in the same layer
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param route: (list) Optimized route
+        :param alt_route: (list) Additional routes to be displayed on map
+        :return: (folium Map) The map
+        """
+        routes = (alt_route or []) + [route]
+        lines = route_lines(G, routes)
+        lats = [float(lat) for (route_lats, route_lons) in lines for lat in (route_lats.min(), route_lats.max())]
+        lons = [float(lon) for (route_lats, route_lons) in lines for lon in (route_lons.min(), route_lons.max())]
+        route_map = folium.Map(tiles='Stamen Terrain')
+        route_map.fit_bounds([(min(lats), min(lons)), (max(lats), max(lons))])
+
+        #alt_route[0] is the shortest path, weighted by length, and any further routes (such as other routes
+        #on the length/elevation frontier) get the next colors of the palette. Our route goes on top of the others
+        colors = [color for (_, color) in zip(alt_route or [], itertools.cycle(ALT_ROUTE_COLORS))] + [ROUTE_COLOR]
+        layer = folium.FeatureGroup(name='Routes')
+        for (route_lats, route_lons), color in zip(lines, colors):
+            folium.PolyLine(locations=list(zip(route_lats.tolist(), route_lons.tolist())), color=color, weight=5, opacity=0.75).add_to(layer)
+        layer.add_to(route_map)
+
+        #add markers to start and end nodes
+        (route_lats, route_lons) = lines[-1]
+        folium.Marker([float(route_lats[0]), float(route_lons[0])], popup='<i>Start</i>', icon=folium.Icon(color='blue', icon='unchecked')).add_to(route_map)
+        folium.Marker([float(route_lats[-1]), float(route_lons[-1])], popup='<i>End</i>', icon=folium.Icon(color='green', icon='flag')).add_to(route_map)
+
+        macro = MacroElement()
+        macro._template = Template(self.get_template(elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, len(alt_route or [])))
+        route_map.get_root().add_child(macro)
+        return route_map
+
+    def get_geojson(self, G, route, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, alt_route=None):
+        """
+        Gets the optimized route and the additional routes as GeoJSON, without drawing a map
+        :param G: (networkx MultiDiGraph or RoutingGraph object) The graph representing the map
+        :param route: (list) Optimized route
+        :param alt_route: (list) Additional routes, the first of which is the shortest path
+        :return: (dictionary) A FeatureCollection with the optimized route first. Each feature's properties
+                 hold its role ('optimized', 'shortest' or 'alternative') and color, and the first two also
+                 hold their length and elevation statistics
+        """
+        alt_route = alt_route or []
+        properties = [dict(elevation_stats_optimized, role='optimized', color=ROUTE_COLOR, length=total_distance_optimized)]
+        for i, color in zip(range(len(alt_route)), itertools.cycle(ALT_ROUTE_COLORS)):
+            if i == 0:
+                properties.append(dict(elevation_stats_shortest, role='shortest', color=color, length=total_distance_shortest))
+            else:
+                properties.append({'role': 'alternative', 'color': color})
+        return routes_geojson(G, [route] + alt_route, properties)
+
+    def loading_animation(self):
+        """
+        Displays loading animation
+        """
+        for c in itertools.cycle(['.', '..', '...']):
+            if self.done:
+                break
+            sys.stdout.write('\rProcessing route ' + c + '  ')
+            sys.stdout.flush()
+            time.sleep(0.25)
+        sys.stdout.flush()
+
+    def get_template(self, elevation_stats_optimized, elevation_stats_shortest, total_distance_optimized, total_distance_shortest, alt_routes=1):
+        """
+        Returns style template for folium map webpage
+        :param alt_routes: (int) The number of additional routes drawn, the first of which is the shortest path.
+                           Each one gets a legend entry in its color
+        :return: Stylesheet template
+        """
+        entries = [LEGEND_ENTRY_TEMPLATE.format(ROUTE_COLOR, "Our Route")]
+        for i, color in zip(range(alt_routes), itertools.cycle(ALT_ROUTE_COLORS)):
+            entries.append(LEGEND_ENTRY_TEMPLATE.format(color, "Shortest Length Route" if i == 0 else "Alternative Route {}".format(i)))
+        data = DATA_TEMPLATE.format(total_distance_optimized, elevation_stats_optimized['net_change'], elevation_stats_optimized['ascents'], elevation_stats_optimized['descents'], elevation_stats_optimized['total_change'],
+        total_distance_shortest, elevation_stats_shortest['net_change'], elevation_stats_shortest['ascents'], elevation_stats_shortest['descents'], elevation_stats_shortest['total_change'])
+        return LEGEND_TEMPLATE + "".join(entries) + LEGEND_END_TEMPLATE + data + PAGE_END_TEMPLATE